@@ -0,0 +1,191 @@
+"""
+Parser of the logs of airnefcmd (AirMTP), turning them into events.
+
+Lines are parsed one at a time, in order, with compiled patterns, and every
+event they contain is returned (a line may hold several progress updates of
+a download, separated by carriage returns). A small state machine follows
+the connection of the camera and the downloads in progress:
+    - "Camera Model ..., S/N ..." means a camera is connected,
+    - the first progress update of a file means its download started, the
+      one at 100% that it completed,
+    - a retry delay while a camera is connected means it was disconnected,
+      and interrupts the downloads in progress.
+
+Replay of a recorded log, and benchmark on a recorded or generated log:
+    python3 -m backend.airmtp_log_parser replay <log file>
+    python3 -m backend.airmtp_log_parser benchmark [log file]
+"""
+
+import re
+import sys
+import time
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+# Kinds of events.
+CAMERA_DETECTED = "camera_detected"  # Camera model, serial number.
+CAMERA_DISCONNECTED = "camera_disconnected"  # No values.
+DOWNLOAD_STARTED = "download_started"  # Path, size in bytes.
+DOWNLOAD_COMPLETED = "download_completed"  # Path, size in bytes.
+RETRYING = "retrying"  # Delay in seconds.
+
+CAMERA_PATTERN = re.compile(
+    r'Camera Model "(?P<model>[^"]*)".*?S/N "(?P<serial>[^"]*)"'
+)
+PROGRESS_PATTERN = re.compile(
+    r"(?P<percent>\d{1,3})%\s*(?P<path>.+?)\s*\[size = (?P<size>[\d,]+)"
+)
+RETRY_PATTERN = re.compile(r"Delaying (?P<seconds>\d+) seconds? before retrying")
+
+
+class LogEvent(NamedTuple):
+    """Event found in the logs."""
+
+    kind: str  # One of the kinds of events above.
+    values: Tuple  # Depends on the kind.
+    line_number: int  # Line of the logs, from 1.
+
+
+class AirMTPLogParser:
+    """Parses the lines of the logs one by one, in order."""
+
+    camera_connected: bool
+    downloads: Dict[str, int]  # Path to size, of the downloads in progress.
+
+    def __init__(self):
+        """Constructor"""
+        self.camera_connected = False
+        self.downloads = {}
+        self.line_count = 0
+
+    def feed(self, line: str) -> List[LogEvent]:
+        """Parses the next line of the logs.
+
+        Args:
+            line (str): Line, without its end of line.
+
+        Returns:
+            List[LogEvent]: Events of the line, in order.
+        """
+        self.line_count += 1
+        events = []
+        # Progress updates are written over each other with carriage returns.
+        for segment in line.split("\r"):
+            # Cheap tests first: most lines are neither of these.
+            if "[size = " in segment:
+                self.parse_progress(segment, events)
+            elif "Camera Model" in segment:
+                match = CAMERA_PATTERN.search(segment)
+                if match is not None:
+                    self.camera_connected = True
+                    self.add_event(
+                        events, CAMERA_DETECTED, match["model"], match["serial"]
+                    )
+            elif "before retrying" in segment:
+                match = RETRY_PATTERN.search(segment)
+                if match is not None:
+                    self.add_event(events, RETRYING, int(match["seconds"]))
+                    if self.camera_connected:
+                        self.camera_connected = False
+                        self.downloads.clear()
+                        self.add_event(events, CAMERA_DISCONNECTED)
+        return events
+
+    def parse_progress(self, segment: str, events: List[LogEvent]):
+        match = PROGRESS_PATTERN.search(segment)
+        if match is None:
+            return
+        path = match["path"]
+        size = int(match["size"].replace(",", ""))
+        if path not in self.downloads:
+            self.downloads[path] = size
+            self.add_event(events, DOWNLOAD_STARTED, path, size)
+        if int(match["percent"]) >= 100:
+            del self.downloads[path]
+            self.add_event(events, DOWNLOAD_COMPLETED, path, size)
+
+    def add_event(self, events: List[LogEvent], kind: str, *values):
+        events.append(LogEvent(kind, values, self.line_count))
+
+
+def replay(lines: Iterable[str]) -> List[LogEvent]:
+    """Parses recorded logs, e.g. to check the events found in them.
+
+    Args:
+        lines (Iterable[str]): Lines of the logs, with or without their end of
+                               line (e.g. from read_log()).
+
+    Returns:
+        List[LogEvent]: Events of the logs, in order.
+    """
+    parser = AirMTPLogParser()
+    events = []
+    for line in lines:
+        events += parser.feed(line.rstrip("\r\n"))
+    return events
+
+
+def read_log(log_path: str) -> List[str]:
+    """Lines of a recorded log, split on line feeds only: the carriage
+    returns between progress updates are kept.
+    """
+    with open(log_path, "rb") as f:
+        text = f.read().decode("utf-8", errors="replace")
+    lines = text.split("\n")
+    if lines[-1] == "":
+        lines.pop()
+    return lines
+
+
+def generate_log(downloads: int = 10000) -> List[str]:
+    """Lines of a session: a camera connected, downloading pictures, with
+    verbose noise between them, and disconnected at the end.
+    """
+    lines = ['Camera Model "D7500", S/N "3001234"']
+    for index in range(downloads):
+        path = f"./DSC_{index:04d}.JPG"
+        size = f"{6_000_000 + index:,}"
+        lines.append(f"Found new object handle 0x{index:08x}, downloading")
+        lines.append(
+            "\r".join(
+                f"{percent:3d}% {path} [size = {size}, 3.51 MB/s]"
+                for percent in range(0, 101, 25)
+            )
+        )
+        lines.append("MTP_OP_GetObjectInfo response: MTP_RESP_Ok")
+    lines.append("Delaying 5 seconds before retrying")
+    return lines
+
+
+def benchmark(log_path: Optional[str] = None):
+    """Measures the parsing throughput.
+
+    Args:
+        log_path (str, optional): Recorded log to parse. Defaults to a
+                                  generated one.
+    """
+    if log_path is None:
+        lines = generate_log()
+    else:
+        lines = read_log(log_path)
+    size = sum(len(line) for line in lines)
+
+    start = time.perf_counter()
+    events = replay(lines)
+    duration = time.perf_counter() - start
+
+    counts = {}
+    for event in events:
+        counts[event.kind] = counts.get(event.kind, 0) + 1
+    print(
+        f"{len(lines)} lines ({size / 1e6:.1f} MB) in {1000 * duration:.0f} ms: "
+        f"{len(lines) / duration:.0f} lines/s, {size / 1e6 / duration:.1f} MB/s"
+    )
+    print(", ".join(f"{count} {kind}" for kind, count in sorted(counts.items())))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2 and sys.argv[1] == "replay":
+        for event in replay(read_log(sys.argv[2])):
+            print(event.line_number, event.kind, *event.values)
+    else:
+        benchmark(sys.argv[2] if len(sys.argv) > 2 else None)
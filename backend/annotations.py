@@ -0,0 +1,278 @@
+"""
+Vector annotations (lines, rectangles, circles, text) drawn over an image.
+
+Shapes are kept as small objects in image coordinates and painted over the
+displayed image, they are only rasterized into the pixels when the image is
+exported. Memory and redraw cost depend on the number of shapes, not on the
+size of the image, and a shape can still be selected and removed later.
+
+Shapes are never modified once created, so that the undo history can share
+them between its states.
+"""
+
+import math
+from PySide6.QtCore import QPointF, QRectF, Qt
+from PySide6.QtGui import QColor, QFont, QPainter, QPen
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+
+class Shape:
+    """Annotation shape, in pixels of the full resolution image."""
+
+    __slots__ = ("kind", "x0", "y0", "x1", "y1", "color", "width", "text")
+
+    LINE = "line"
+    RECTANGLE = "rectangle"  # Between (x0, y0) and (x1, y1).
+    CIRCLE = "circle"  # Inscribed between (x0, y0) and (x1, y1).
+    TEXT = "text"  # Framed text, in the rectangle.
+
+    def __init__(
+        self,
+        kind: str,
+        x0: float,
+        y0: float,
+        x1: float,
+        y1: float,
+        color: str,
+        width: float,
+        text: str = "",
+    ):
+        """Constructor
+
+        Args:
+            kind (str): One of LINE, RECTANGLE, CIRCLE or TEXT.
+            x0 (float): First point.
+            y0 (float): First point.
+            x1 (float): Last point.
+            y1 (float): Last point.
+            color (str): Pen color, "#rrggbb".
+            width (float): Pen width.
+            text (str, optional): Text of a TEXT shape. Defaults to "".
+        """
+        self.kind = kind
+        self.x0 = x0
+        self.y0 = y0
+        self.x1 = x1
+        self.y1 = y1
+        self.color = color
+        self.width = width
+        self.text = text
+
+    def circle(self) -> Tuple[float, float, float]:
+        """Center and radius of a CIRCLE shape."""
+        radius = (abs(self.x1 - self.x0) + abs(self.y1 - self.y0)) // 2
+        return (self.x0 + self.x1) / 2, (self.y0 + self.y1) / 2, radius
+
+    def extent(self) -> Tuple[float, float, float, float]:
+        """Left, top, right and bottom of the shape, pen included."""
+        margin = self.width / 2 + 1
+        if self.kind == self.CIRCLE:
+            x, y, radius = self.circle()
+            margin += radius
+            return x - margin, y - margin, x + margin, y + margin
+        return (
+            min(self.x0, self.x1) - margin,
+            min(self.y0, self.y1) - margin,
+            max(self.x0, self.x1) + margin,
+            max(self.y0, self.y1) + margin,
+        )
+
+    def bounds(self) -> QRectF:
+        """Area covered by the shape, pen included."""
+        left, top, right, bottom = self.extent()
+        return QRectF(left, top, right - left, bottom - top)
+
+    def contains(self, x: float, y: float, tolerance: float) -> bool:
+        """Checks if a point is on the shape (or inside a text frame).
+
+        Args:
+            x (float): Point, in image coordinates.
+            y (float): Point, in image coordinates.
+            tolerance (float): Maximum distance to the pen, in pixels.
+        """
+        tolerance += self.width / 2
+        if self.kind == self.LINE:
+            distance = distance_to_segment(x, y, self.x0, self.y0, self.x1, self.y1)
+            return distance <= tolerance
+
+        if self.kind == self.CIRCLE:
+            center_x, center_y, radius = self.circle()
+            return abs(math.hypot(x - center_x, y - center_y) - radius) <= tolerance
+
+        left, right = sorted((self.x0, self.x1))
+        top, bottom = sorted((self.y0, self.y1))
+        if self.kind == self.TEXT:
+            return left <= x <= right and top <= y <= bottom
+        return any(
+            distance_to_segment(x, y, *edge) <= tolerance
+            for edge in (
+                (left, top, right, top),
+                (right, top, right, bottom),
+                (left, bottom, right, bottom),
+                (left, top, left, bottom),
+            )
+        )
+
+    def transformed(
+        self, transform_point: Callable[[float, float], Tuple[float, float]]
+    ) -> "Shape":
+        """Returns the shape moved by a flip or a rotation of the image.
+        Text stays upright.
+        """
+        x0, y0 = transform_point(self.x0, self.y0)
+        x1, y1 = transform_point(self.x1, self.y1)
+        return Shape(self.kind, x0, y0, x1, y1, self.color, self.width, self.text)
+
+    def paint(self, painter: QPainter, scale: float):
+        """Draws the shape.
+
+        Args:
+            painter (QPainter): Painter of an image with a resolution of scale
+                                times the full resolution.
+            scale (float): Scale of the painted image.
+        """
+        painter.setPen(QPen(QColor(self.color), self.width * scale))
+        if self.kind == self.LINE:
+            painter.drawLine(
+                QPointF(self.x0 * scale, self.y0 * scale),
+                QPointF(self.x1 * scale, self.y1 * scale),
+            )
+
+        elif self.kind == self.CIRCLE:
+            x, y, radius = self.circle()
+            painter.drawEllipse(
+                QPointF(x * scale, y * scale), radius * scale, radius * scale
+            )
+
+        else:
+            rect = QRectF(
+                QPointF(self.x0 * scale, self.y0 * scale),
+                QPointF(self.x1 * scale, self.y1 * scale),
+            ).normalized()
+            if self.kind == self.TEXT:
+                font = QFont("Times")
+                font.setBold(True)
+                font.setPointSizeF(max(1.0, self.width * 3 * scale))
+                painter.setFont(font)
+                painter.drawText(rect, Qt.TextFlag.TextWordWrap, self.text)
+            painter.drawRect(rect)
+
+    def to_dict(self) -> dict:
+        """Serializes the shape (JSON compatible)."""
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Shape":
+        return cls(**{name: data[name] for name in cls.__slots__ if name in data})
+
+
+def distance_to_segment(
+    x: float, y: float, x0: float, y0: float, x1: float, y1: float
+) -> float:
+    """Distance from a point to a segment."""
+    dx, dy = x1 - x0, y1 - y0
+    length = dx * dx + dy * dy
+    t = 0.0
+    if length > 0:
+        t = max(0.0, min(1.0, ((x - x0) * dx + (y - y0) * dy) / length))
+    return math.hypot(x - x0 - t * dx, y - y0 - t * dy)
+
+
+class AnnotationLayer:
+    """Shapes drawn over an image, with a grid index of their bounds
+    to find the shapes under a point or inside an area.
+    """
+
+    shapes: Tuple[Shape, ...]  # In drawing order.
+    grid: Dict[Tuple[int, int], List[int]]  # Cell -> indices of shapes.
+
+    CELL_SIZE = 256
+
+    def __init__(self, shapes: Tuple[Shape, ...] = ()):
+        self.shapes = ()
+        self.grid = {}
+        self.set_shapes(shapes)
+
+    def __len__(self) -> int:
+        return len(self.shapes)
+
+    def set_shapes(self, shapes: Tuple[Shape, ...]):
+        """Replaces the shapes. Shapes appended to the current ones are
+        indexed incrementally, anything else rebuilds the index.
+        """
+        shapes = tuple(shapes)
+        if shapes[: len(self.shapes)] != self.shapes:
+            self.shapes = ()
+            self.grid = {}
+        start = len(self.shapes)
+        self.shapes = shapes
+        grid = self.grid
+        for index in range(start, len(shapes)):
+            for cell in self.cells(*shapes[index].extent()):
+                cell_shapes = grid.get(cell)
+                if cell_shapes is None:
+                    grid[cell] = [index]
+                else:
+                    cell_shapes.append(index)
+
+    def cells(
+        self, left: float, top: float, right: float, bottom: float
+    ) -> Iterator[Tuple[int, int]]:
+        """Cells of the grid overlapping an area."""
+        size = self.CELL_SIZE
+        rows = range(int(top // size), int(bottom // size) + 1)
+        for column in range(int(left // size), int(right // size) + 1):
+            for row in rows:
+                yield column, row
+
+    def shapes_in(self, rect: QRectF) -> List[Shape]:
+        """Shapes overlapping an area, in drawing order.
+
+        Args:
+            rect (QRectF): Area, in image coordinates.
+        """
+        left, top, right, bottom = rect.left(), rect.top(), rect.right(), rect.bottom()
+        indices = set()
+        for cell in self.cells(left, top, right, bottom):
+            indices.update(self.grid.get(cell, ()))
+
+        shapes = []
+        for index in sorted(indices):
+            shape = self.shapes[index]
+            shape_left, shape_top, shape_right, shape_bottom = shape.extent()
+            if (
+                shape_left <= right
+                and shape_right >= left
+                and shape_top <= bottom
+                and shape_bottom >= top
+            ):
+                shapes.append(shape)
+        return shapes
+
+    def shape_at(self, x: float, y: float, tolerance: float) -> Optional[Shape]:
+        """Topmost shape under a point.
+
+        Args:
+            x (float): Point, in image coordinates.
+            y (float): Point, in image coordinates.
+            tolerance (float): Maximum distance to the pen, in pixels.
+        """
+        area = QRectF(x - tolerance, y - tolerance, 2 * tolerance, 2 * tolerance)
+        for shape in reversed(self.shapes_in(area)):
+            if shape.contains(x, y, tolerance):
+                return shape
+        return None
+
+    def paint(self, painter: QPainter, scale: float, rect: Optional[QRectF] = None):
+        """Draws the shapes.
+
+        Args:
+            painter (QPainter): Painter of an image with a resolution of scale
+                                times the full resolution.
+            scale (float): Scale of the painted image.
+            rect (QRectF, optional): Only draw the shapes overlapping this area
+                                     of the image. Defaults to all shapes.
+        """
+        shapes = self.shapes if rect is None else self.shapes_in(rect)
+        for shape in shapes:
+            shape.paint(painter, scale)
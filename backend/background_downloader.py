@@ -1,44 +1,175 @@
 """
 This file contains the QThread responsible for running airmtp
 script to retrieve pictures from camera.
+
+The output of the script is read through a pipe as soon as it's written,
+and parsed line by line (see backend.airmtp_log_parser): its events are
+sent as signals right away. The output of the sessions is also appended to
+LOG_FILE, for troubleshooting. The thread restarts the script when it exits,
+with a growing delay if it keeps crashing, until it's stopped.
 """
+import logging
 import os
-from subprocess import Popen
-from PySide6.QtCore import QThread, Signal
+import subprocess
+import sys
+import threading
 import time
-from external.airmtp import *
+from PySide6.QtCore import QThread, Signal
+from typing import Optional
+
+from backend.airmtp_log_parser import (
+    AirMTPLogParser,
+    CAMERA_DETECTED,
+    CAMERA_DISCONNECTED,
+    DOWNLOAD_COMPLETED,
+)
+
+logger = logging.getLogger(__name__)
+
 
 class ImageDownloaderThread(QThread):
+    camera_detected = Signal(str, str)  # Camera model, serial number.
+    camera_disconnected = Signal(bool)
     download_signal = Signal(str)
-    camera_detected = Signal(str)
     error_signal = Signal(str)
 
     CAMERA_IP = "192.168.1.1"
     DOWNLOAD_DIR = "."
-    INTERVAL = 5
+    LOG_FILE = ".log_airmtp_download"
+    MAX_LOG_BYTES = 10 * 1024 * 1024
+    RESTART_DELAY = 1.0  # Seconds before restarting airmtp after it exits.
+    MAX_RESTART_DELAY = 60.0
+    STABLE_TIME = 60.0  # Seconds after which a session resets the delay.
+    SHUTDOWN_TIMEOUT = 2.0  # Seconds given to airmtp, then to the thread.
 
     COMMAND = f"--outputdir {DOWNLOAD_DIR} --ifexists uniquename --ipaddress {CAMERA_IP} --realtimedownload only --logginglevel verbose --cameratransferlist ignore"
 
     def __init__(self):
         super().__init__()
-        self.running = True
+        self.stop_event = threading.Event()
+        self.lock = threading.Lock()  # Starting airmtp vs stopping it.
+        self.process = None
+        self.parser = AirMTPLogParser()
+        self.restarts = 0
 
-    def init_session(self):
+    def command(self):
         current_file_dir = os.path.sep.join(os.path.abspath(__file__).split(os.path.sep)[:-2])
-        dir = os.path.join(current_file_dir, "external", "airmtp", "airnefcmd.py")
+        script = os.path.join(current_file_dir, "external", "airmtp", "airnefcmd.py")
 
-        command = f"python3 {dir} {self.COMMAND}"
-        with open(".log_airmtp_download", "w") as f:
-            self.process = Popen(command.split(" "), stdout=f, stderr=f)
+        # The interpreter running the application, unless it's the frozen
+        # executable.
+        python = "python3" if getattr(sys, "frozen", False) else sys.executable
+        # Unbuffered: each line is read as soon as it's printed.
+        return [python, "-u", script] + self.COMMAND.split(" ")
 
-        while self.running:
-            time.sleep(5)
+    def init_session(self) -> Optional[int]:
+        """Runs a session of airmtp, until it exits.
 
-        self.process.kill()
+        Returns:
+            Optional[int]: Exit code of airmtp, None if it wasn't started.
+        """
+        self.parser = AirMTPLogParser()
+        try:
+            log = self.open_log()
+        except OSError as e:
+            logger.warning("Can't open %s: %s", self.LOG_FILE, e)
+            log = open(os.devnull, "wb")
+
+        with log:
+            with self.lock:
+                if self.stop_event.is_set():
+                    return None
+                try:
+                    self.process = subprocess.Popen(
+                        self.command(), stdout=subprocess.PIPE, stderr=subprocess.STDOUT
+                    )
+                except OSError as e:
+                    self.error_signal.emit(f"Can't start airmtp: {e}")
+                    return None
+
+            log.write(f"--- airmtp started at {time.ctime()}\n".encode())
+            try:
+                # Lines end with "\n" only: progress updates separated by "\r"
+                # stay on the same line. The pipe is closed when airmtp exits.
+                for line in iter(self.process.stdout.readline, b""):
+                    text = line.decode("utf-8", errors="replace").rstrip("\r\n")
+                    self.analyze_line(text)
+                    log.write(line)
+                    log.flush()
+            except Exception:
+                # It wouldn't be supervised anymore.
+                self.process.kill()
+                raise
+            finally:
+                self.process.stdout.close()
+
+        return self.process.wait()
+
+    def open_log(self):
+        """Opens LOG_FILE to append the output of a session, after the ones
+        before it. It's moved to LOG_FILE.1 once it's over MAX_LOG_BYTES.
+        """
+        if (
+            os.path.exists(self.LOG_FILE)
+            and os.path.getsize(self.LOG_FILE) > self.MAX_LOG_BYTES
+        ):
+            os.replace(self.LOG_FILE, self.LOG_FILE + ".1")
+        return open(self.LOG_FILE, "ab")
+
+    def analyze_line(self, line: str):
+        """Emits the events of a line of the output, in order."""
+        for event in self.parser.feed(line):
+            if event.kind == CAMERA_DETECTED:
+                self.camera_detected.emit(*event.values)
+            elif event.kind == DOWNLOAD_COMPLETED:
+                self.download_signal.emit(event.values[0])
+            elif event.kind == CAMERA_DISCONNECTED:
+                self.camera_disconnected.emit(True)
 
     def run(self):
-        self.init_session()
+        """Runs airmtp until stop() is called, restarting it when it exits.
+        The delay before a restart doubles while airmtp keeps crashing.
+        """
+        delay = self.RESTART_DELAY
+        while not self.stop_event.is_set():
+            start = time.monotonic()
+            exit_code = self.init_session()
+            if self.parser.camera_connected:
+                self.camera_disconnected.emit(True)
+            if self.stop_event.is_set():
+                break
+
+            if time.monotonic() - start >= self.STABLE_TIME:
+                delay = self.RESTART_DELAY
+            logger.warning(
+                "airmtp exited (code %s), restarting in %.1f s", exit_code, delay
+            )
+            # Returns right away when stopped.
+            if self.stop_event.wait(delay):
+                break
+            delay = min(2 * delay, self.MAX_RESTART_DELAY)
+            self.restarts += 1
 
     def stop(self):
-        self.running = False
-        self.wait()
\ No newline at end of file
+        """Stops airmtp and the thread, in at most 2 * SHUTDOWN_TIMEOUT
+        seconds: airmtp is killed if it doesn't exit when asked to.
+        """
+        start = time.perf_counter()
+        self.stop_event.set()
+        with self.lock:
+            process = self.process
+        if process is not None and process.poll() is None:
+            process.terminate()
+            try:
+                process.wait(self.SHUTDOWN_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+        # The pipe is closed, the thread ends.
+        if not self.wait(int(1000 * self.SHUTDOWN_TIMEOUT)):
+            logger.warning("Camera downloader thread didn't stop")
+        logger.info(
+            "Camera downloader stopped in %.0f ms (%d restarts)",
+            1000 * (time.perf_counter() - start),
+            self.restarts,
+        )
@@ -1,17 +1,197 @@
 """
 Abstraction for image background removal
+
+Creating an ONNX Runtime session reads the model weights (170 MB for u2net)
+and takes seconds. Sessions are created once per model, the first time it's
+used, and shared by every image of the application (see RembgSessionPool).
+ONNX Runtime and rembg are only imported by the process removing backgrounds.
+
+Several pictures (e.g. a whole session) are processed by remove_backgrounds,
+which runs the model on batches of pictures and decodes, infers and encodes
+different pictures at the same time.
 """
 
+import logging
 import numpy as np
+import os
+import queue
+import sys
+import threading
+import time
 import cv2
-from external.rembg.rembg import remove
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+MODELS = ("u2net", "u2netp", "isnet-general-use", "silueta")
+# Short names accepted for the models.
+MODEL_ALIASES = {"isnet": "isnet-general-use"}
+DEFAULT_MODEL = os.environ.get("EPANOUIDENT_REMBG_MODEL", "u2net")
+# Model -> normalization mean, standard deviation (RGB) and input size.
+MODEL_INPUTS = {
+    "u2net": ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225), 320),
+    "u2netp": ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225), 320),
+    "isnet-general-use": ((0.5, 0.5, 0.5), (1.0, 1.0, 1.0), 1024),
+    "silueta": ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225), 320),
+}
+BATCH_SIZE = int(os.environ.get("EPANOUIDENT_REMBG_BATCH_SIZE", 4))
+OUTPUT_SUFFIX = "_no_background.png"
+
+
+class RembgSessionPool:
+    """Long-lived rembg sessions, one per model, created on first use.
+    ONNX Runtime sessions can run from several threads at once.
+    """
+
+    sessions: Dict[str, object]  # Model name -> rembg session.
+    load_times: Dict[str, float]  # Model name -> seconds to create the session.
+
+    def __init__(self, intra_op_threads: int = 0, inter_op_threads: int = 0):
+        """Constructor
+
+        Args:
+            intra_op_threads (int, optional): Threads used inside an operator.
+                                              Defaults to 0 (ONNX Runtime's
+                                              choice).
+            inter_op_threads (int, optional): Threads running operators in
+                                              parallel. Defaults to 0 (ONNX
+                                              Runtime's choice).
+        """
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self.sessions = {}
+        self.load_times = {}
+        self.batch_models = set()  # Models whose batch size isn't fixed to 1.
+        self.single_models = set()  # Models whose batch size is fixed to 1.
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def model_name(model: str) -> str:
+        model = MODEL_ALIASES.get(model, model)
+        if model not in MODELS:
+            raise ValueError(f"Unknown background removal model: {model}")
+        return model
+
+    def session_options(self):
+        """ONNX Runtime options of the sessions."""
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        if self.intra_op_threads:
+            options.intra_op_num_threads = self.intra_op_threads
+        if self.inter_op_threads:
+            options.inter_op_num_threads = self.inter_op_threads
+        return options
+
+    def get(self, model: str = DEFAULT_MODEL):
+        """Returns the session of a model, creating it if needed.
+
+        Args:
+            model (str, optional): One of MODELS. Defaults to DEFAULT_MODEL.
+        """
+        from external.rembg.rembg.sessions import sessions_class
+
+        model = self.model_name(model)
+        # Several images may need the model at once, it's only loaded once.
+        with self.lock:
+            session = self.sessions.get(model)
+            if session is None:
+                start = time.perf_counter()
+                session_class = next(
+                    session_class
+                    for session_class in sessions_class
+                    if session_class.name() == model
+                )
+                session = session_class(model, self.session_options())
+                self.sessions[model] = session
+                self.load_times[model] = time.perf_counter() - start
+                logger.info(
+                    "Background removal model %s loaded in %.2f s",
+                    model,
+                    self.load_times[model],
+                )
+            return session
 
+    def remove(self, image: np.ndarray, model: str = DEFAULT_MODEL) -> np.ndarray:
+        """Removes the background of an image.
 
-def remove_background(image_path: str):
+        Args:
+            image (np.ndarray): Input image.
+            model (str, optional): One of MODELS. Defaults to DEFAULT_MODEL.
+
+        Returns:
+            np.ndarray: Image with the background as transparency.
+        """
+        from external.rembg.rembg import remove
+
+        return remove(image, session=self.get(model))
+
+    def predict(self, inputs: np.ndarray, model: str = DEFAULT_MODEL) -> np.ndarray:
+        """Runs the model on a batch of inputs, in a single run if the model
+        accepts batches, else one input at a time.
+
+        Args:
+            inputs (np.ndarray): Inputs, (N, 3, size, size), see preprocess().
+            model (str, optional): One of MODELS. Defaults to DEFAULT_MODEL.
+
+        Returns:
+            np.ndarray: Raw predictions, (N, size, size).
+        """
+        model = self.model_name(model)
+        session = self.get(model).inner_session
+        input_name = session.get_inputs()[0].name
+        if len(inputs) > 1 and model not in self.single_models:
+            try:
+                predictions = session.run(None, {input_name: inputs})[0][:, 0]
+                self.batch_models.add(model)
+                return predictions
+            except Exception:
+                if model in self.batch_models:
+                    raise
+                # The batch dimension of the model is fixed.
+                logger.info("Model %s doesn't accept batches", model)
+                self.single_models.add(model)
+
+        return np.concatenate(
+            [
+                session.run(None, {input_name: inputs[index : index + 1]})[0][:, 0]
+                for index in range(len(inputs))
+            ]
+        )
+
+    def clear(self):
+        """Releases the sessions, e.g. to free memory."""
+        with self.lock:
+            self.sessions.clear()
+
+
+_rembg_session_pool = None
+
+
+def get_rembg_session_pool() -> RembgSessionPool:
+    """Returns the application-wide pool of rembg sessions.
+    Thread counts can be set with the EPANOUIDENT_REMBG_INTRA_OP_THREADS and
+    EPANOUIDENT_REMBG_INTER_OP_THREADS environment variables.
+    """
+    global _rembg_session_pool
+    if _rembg_session_pool is None:
+        _rembg_session_pool = RembgSessionPool(
+            intra_op_threads=int(
+                os.environ.get("EPANOUIDENT_REMBG_INTRA_OP_THREADS", 0)
+            ),
+            inter_op_threads=int(
+                os.environ.get("EPANOUIDENT_REMBG_INTER_OP_THREADS", 0)
+            ),
+        )
+    return _rembg_session_pool
+
+
+def remove_background(image_path: str, model: str = DEFAULT_MODEL):
     """Removes background from image and image without background
 
     Args:
         image_path (str): Path to input image
+        model (str, optional): One of MODELS. Defaults to DEFAULT_MODEL.
 
     Output:
         output_image: Image without the background
@@ -19,7 +199,205 @@ def remove_background(image_path: str):
 
     """
     input_image = cv2.imread(image_path, cv2.IMREAD_COLOR)
-    output_image = remove(input_image)
+    output_image = get_rembg_session_pool().remove(input_image, model)
     output_image = cv2.cvtColor(output_image, cv2.COLOR_RGBA2BGRA)
 
     return output_image, input_image
+
+
+def preprocess(image: np.ndarray, model: str) -> np.ndarray:
+    """Converts a BGR image to the input of a model, (3, size, size)."""
+    mean, std, size = MODEL_INPUTS[model]
+    image = cv2.resize(
+        cv2.cvtColor(image, cv2.COLOR_BGR2RGB),
+        (size, size),
+        interpolation=cv2.INTER_LANCZOS4,
+    ).astype(np.float32)
+    image /= max(float(image.max()), 1e-6)
+    image = (image - np.float32(mean)) / np.float32(std)
+    return image.transpose((2, 0, 1))
+
+
+def postprocess(prediction: np.ndarray, width: int, height: int) -> np.ndarray:
+    """Converts a raw prediction to the alpha mask of a width x height image."""
+    low, high = float(prediction.min()), float(prediction.max())
+    prediction = (prediction - low) / max(high - low, 1e-6)
+    return cv2.resize(
+        (prediction * 255).astype(np.uint8),
+        (width, height),
+        interpolation=cv2.INTER_LANCZOS4,
+    )
+
+
+def output_path(image_path: str) -> str:
+    """Path of the picture without background written by remove_backgrounds.
+    The extension of the picture is kept in the name, so that e.g. photo.jpg
+    and photo.png don't share their result.
+    """
+    base, extension = os.path.splitext(image_path)
+    return base + extension.replace(".", "_") + OUTPUT_SUFFIX
+
+
+def remove_backgrounds(
+    image_paths: List[str],
+    model: str = DEFAULT_MODEL,
+    batch_size: int = BATCH_SIZE,
+    on_result: Optional[Callable[[str, Optional[str], Optional[str]], None]] = None,
+) -> float:
+    """Removes the background of several pictures, and writes each of them
+    without background next to the original (see output_path). Masks are
+    taken from and stored in the mask cache. Pictures which are already
+    results (their name ends with OUTPUT_SUFFIX) are skipped.
+
+    Decoding, inference and encoding run in three stages at the same time:
+    a thread decodes the next pictures while the model runs on a batch of
+    batch_size pictures, and another thread writes the previous ones.
+
+    Args:
+        image_paths (List[str]): Pictures to process.
+        model (str, optional): One of MODELS. Defaults to DEFAULT_MODEL.
+        batch_size (int, optional): Pictures per inference.
+                                    Defaults to BATCH_SIZE.
+        on_result (Callable, optional): Called (from the encoding thread)
+                                        with the path of each picture, the
+                                        path written and an error message.
+
+    Returns:
+        float: Pictures written per second.
+    """
+    from backend.mask_cache import get_mask_cache
+
+    model = RembgSessionPool.model_name(model)
+    pool = get_rembg_session_pool()
+    mask_cache = get_mask_cache()
+    # Bounded, so that few full resolution pictures are in memory at once.
+    decoded = queue.Queue(maxsize=batch_size)
+    predicted = queue.Queue(maxsize=batch_size)
+
+    written = 0
+
+    # Items are (path, image, model input or prediction, cached mask, error).
+    def decode():
+        for image_path in image_paths:
+            if image_path.endswith(OUTPUT_SUFFIX):
+                error = "Already without background"
+                decoded.put((image_path, None, None, None, error))
+                continue
+            try:
+                image = cv2.imread(image_path, cv2.IMREAD_COLOR)
+                if image is None:
+                    raise ValueError("Can't read the picture")
+                mask = mask_cache.get(image_path, model)
+                if mask is not None and mask.shape == image.shape[:2]:
+                    decoded.put((image_path, image, None, mask, None))
+                else:
+                    model_input = preprocess(image, model)
+                    decoded.put((image_path, image, model_input, None, None))
+            except Exception as e:
+                decoded.put((image_path, None, None, None, str(e)))
+        decoded.put(None)
+
+    def encode():
+        nonlocal written
+        while True:
+            item = predicted.get()
+            if item is None:
+                return
+            image_path, image, prediction, mask, error = item
+            written_path = None
+            try:
+                if error is None:
+                    if mask is None:
+                        height, width = image.shape[:2]
+                        mask = postprocess(prediction, width, height)
+                        mask_cache.put(image_path, mask, model)
+                    written_path = output_path(image_path)
+                    if not cv2.imwrite(written_path, np.dstack((image, mask))):
+                        raise OSError("Can't write the result")
+                    written += 1
+            except Exception as e:
+                written_path, error = None, str(e)
+            if on_result is not None:
+                try:
+                    on_result(image_path, written_path, error)
+                except Exception:
+                    # The next pictures are still encoded, or the pipeline
+                    # would be blocked.
+                    logger.exception("Result of %s not reported", image_path)
+
+    start = time.perf_counter()
+    decoder = threading.Thread(target=decode, name="background-removal-decode")
+    encoder = threading.Thread(target=encode, name="background-removal-encode")
+    decoder.start()
+    encoder.start()
+
+    def infer(batch: List[Tuple]):
+        try:
+            predictions = pool.predict(np.stack([item[2] for item in batch]), model)
+        except Exception as e:
+            for image_path, image, _, _, _ in batch:
+                predicted.put((image_path, image, None, None, str(e)))
+            return
+        for (image_path, image, _, _, _), prediction in zip(batch, predictions):
+            predicted.put((image_path, image, prediction, None, None))
+
+    batch = []
+    while True:
+        item = decoded.get()
+        if item is None:
+            break
+        if item[2] is None:
+            # Unreadable, or mask already cached.
+            predicted.put(item)
+            continue
+        batch.append(item)
+        if len(batch) == batch_size:
+            infer(batch)
+            batch = []
+    if batch:
+        infer(batch)
+    predicted.put(None)
+
+    decoder.join()
+    encoder.join()
+    return written / max(time.perf_counter() - start, 1e-6)
+
+
+def benchmark(image_paths: List[str], model: str = DEFAULT_MODEL):
+    """Compares the latency of the first image (cold, the session is
+    created) with the next ones (warm, the session is reused).
+
+    Args:
+        image_paths (List[str]): Pictures to process.
+        model (str, optional): One of MODELS. Defaults to DEFAULT_MODEL.
+    """
+    images = [cv2.imread(path, cv2.IMREAD_COLOR) for path in image_paths]
+    images = [image for image in images if image is not None]
+    if not images:
+        print("No image found.")
+        return
+
+    pool = RembgSessionPool(
+        get_rembg_session_pool().intra_op_threads,
+        get_rembg_session_pool().inter_op_threads,
+    )
+    latencies = []
+    for image in images:
+        start = time.perf_counter()
+        pool.remove(image, model)
+        latencies.append(time.perf_counter() - start)
+
+    print(
+        f"{model}: cold {1000 * latencies[0]:.0f} ms "
+        f"(session {1000 * pool.load_times[pool.model_name(model)]:.0f} ms)"
+    )
+    if len(latencies) > 1:
+        warm = latencies[1:]
+        print(
+            f"{model}: warm {1000 * sum(warm) / len(warm):.0f} ms/image average, "
+            f"{1000 * min(warm):.0f} ms min, {len(warm)} images"
+        )
+
+
+if __name__ == "__main__":
+    benchmark(sys.argv[2:], sys.argv[1])
@@ -0,0 +1,490 @@
+"""
+Background removal in a separate process.
+
+The inference of the background removal model takes seconds of CPU per
+picture. It runs in a worker process, so it never competes with the UI for
+the GIL, one picture at a time, so opening several pictures doesn't run
+several inferences at once. Jobs wait in a priority queue in the UI process:
+a picture requested twice is only processed once, and a job can be
+cancelled (e.g. when its tab is closed) until it's sent to the worker.
+
+The worker process is started with the first job, and loads the model once
+for all the pictures (see backend.background_removal). The masks it computes
+are stored in the mask cache: pictures already processed are loaded from it
+by the threads of the image loader pool, without waiting for the worker.
+
+Batches of pictures (e.g. selected in the gallery) are split in chunks,
+each chunk is a job processed by backend.background_removal.remove_backgrounds.
+A picture opened meanwhile only waits for the current chunk.
+"""
+
+import heapq
+import itertools
+import logging
+import multiprocessing
+import numpy as np
+import os
+import queue
+import time
+from PySide6.QtCore import QObject, QThread, Signal
+from typing import Dict, Hashable, List, Optional, Tuple
+
+from backend.background_removal import (
+    BATCH_SIZE,
+    DEFAULT_MODEL,
+    OUTPUT_SUFFIX,
+    RembgSessionPool,
+    remove_background,
+    remove_backgrounds,
+)
+from backend.image_loader_pool import get_image_loader_pool, PRIORITY_BACKGROUND
+from backend.mask_cache import get_mask_cache
+
+logger = logging.getLogger(__name__)
+
+
+def run_worker(
+    job_queue: multiprocessing.Queue, result_queue: multiprocessing.Queue, model: str
+):
+    """Entry point of the worker process: removes the background of the
+    pictures received until None is received.
+
+    Args:
+        job_queue (multiprocessing.Queue): Paths of the pictures, or
+                                           ("batch", key, paths) for a chunk
+                                           of a batch.
+        result_queue (multiprocessing.Queue): ("started", path),
+                                              ("finished", path, alpha mask)
+                                              or ("failed", path, message).
+                                              For a chunk, ("batch_image",
+                                              key, path, written path, error)
+                                              per picture, then
+                                              ("batch_finished", key).
+        model (str): Background removal model.
+    """
+    while True:
+        job = job_queue.get()
+        if job is None:
+            return
+        if isinstance(job, tuple):
+            _, key, image_paths = job
+            try:
+                remove_backgrounds(
+                    image_paths,
+                    model,
+                    on_result=lambda path, written_path, error: result_queue.put(
+                        ("batch_image", key, path, written_path, error)
+                    ),
+                )
+            finally:
+                result_queue.put(("batch_finished", key))
+            continue
+        image_path = job
+        result_queue.put(("started", image_path))
+        try:
+            output_image, _ = remove_background(image_path, model)
+            mask = np.ascontiguousarray(output_image[:, :, 3])
+            get_mask_cache().put(image_path, mask, model)
+            result_queue.put(("finished", image_path, mask))
+        except Exception as e:
+            result_queue.put(("failed", image_path, str(e)))
+
+
+class ResultListener(QThread):
+    """Forwards the results of the worker process to the UI thread."""
+
+    result_received = Signal(object)
+
+    def __init__(
+        self, result_queue: multiprocessing.Queue, process: multiprocessing.Process
+    ):
+        """Constructor
+
+        Args:
+            result_queue (multiprocessing.Queue): Results of the worker process.
+            process (multiprocessing.Process): Worker process.
+        """
+        super().__init__()
+        self.result_queue = result_queue
+        self.process = process
+
+    def run(self):
+        while True:
+            try:
+                result = self.result_queue.get(timeout=1)
+            except queue.Empty:
+                if not self.process.is_alive():
+                    self.result_received.emit(("exited", None))
+                    return
+                continue
+            if result is None:
+                return
+            self.result_received.emit(result)
+
+
+class BatchJob:
+    """Progress of a batch of pictures."""
+
+    def __init__(self, total: int):
+        """Constructor
+
+        Args:
+            total (int): Number of pictures.
+        """
+        self.total = total
+        self.processed = 0
+        self.written = 0
+        self.failed = 0  # Not written, cancelled included.
+        self.chunks = 0  # Waiting or running.
+        self.start = time.perf_counter()
+
+    def images_per_second(self) -> float:
+        """Pictures written per second, the failed ones aren't counted."""
+        return self.written / max(time.perf_counter() - self.start, 1e-6)
+
+
+class BackgroundRemovalWorker(QObject):
+    """Priority queue of background removal jobs, run by a worker process.
+    Must be used from the UI thread.
+    """
+
+    job_started = Signal(str)  # Image path.
+    job_finished = Signal(str, object)  # Image path, alpha mask (np.ndarray).
+    job_failed = Signal(str, str)  # Image path, error message.
+    queue_changed = Signal(int)  # Number of jobs waiting or running.
+    # Image path, cached mask or None. Sent by the image loader pool.
+    cache_checked = Signal(str, object)
+    # Batch id, pictures processed, total, pictures per second.
+    batch_progress = Signal(int, int, int, float)
+    batch_finished = Signal(int, int, int)  # Batch id, pictures written, failed.
+
+    SHUTDOWN_TIMEOUT = 5  # Seconds to finish the running job when quitting.
+    CHUNK_SIZE = 4 * BATCH_SIZE  # Pictures of a batch sent at once.
+
+    # Jobs are the path of a picture, or ("batch", batch id, index) for
+    # the chunk of a batch.
+    requests: Dict[str, int]  # Path -> number of requests, waiting or running.
+    checking: Dict[str, int]  # Path of the jobs looked up in the cache -> priority.
+    priorities: Dict[Hashable, int]  # Waiting job -> priority.
+    heap: List[Tuple[int, int, Hashable]]  # (priority, order, job).
+    running: Optional[Hashable]  # Job sent to the worker process.
+    chunks: Dict[tuple, List[str]]  # Chunk -> paths not processed yet.
+    batches: Dict[int, BatchJob]
+
+    def __init__(self):
+        super().__init__()
+        # Same behaviour on every platform, and no copy of the Qt state.
+        self.context = multiprocessing.get_context("spawn")
+        self.process = None
+        self.job_queue = None
+        self.result_queue = None
+        self.listener = None
+        self.model = RembgSessionPool.model_name(DEFAULT_MODEL)
+        self.mask_cache = get_mask_cache()
+        self.cache_checked.connect(self.handle_cache_checked)
+
+        self.requests = {}
+        self.checking = {}
+        self.priorities = {}
+        self.heap = []
+        self.counter = itertools.count()
+        self.running = None
+        self.chunks = {}
+        self.batches = {}
+        self.batch_ids = itertools.count()
+
+    def request(self, image_path: str, priority: int = PRIORITY_BACKGROUND):
+        """Schedules the background removal of a picture. The mask is sent
+        by job_finished, to every requester of the picture.
+
+        Args:
+            image_path (str): Path of the picture.
+            priority (int, optional): Lower values run first, see
+                                      backend.image_loader_pool.
+                                      Defaults to PRIORITY_BACKGROUND.
+        """
+        path = os.path.abspath(image_path)
+        count = self.requests.get(path, 0)
+        self.requests[path] = count + 1
+        if path in self.checking:
+            self.checking[path] = min(self.checking[path], priority)
+            return
+        if path == self.running:
+            return
+        if count == 0 and path not in self.priorities:
+            # New job: the mask may already be cached.
+            self.checking[path] = priority
+            get_image_loader_pool().submit(self.check_cache, path, priority=priority)
+            self.queue_changed.emit(len(self.requests))
+            return
+        if path in self.priorities and self.priorities[path] <= priority:
+            return
+        # The previous entry of the job, if any, is skipped by start_next().
+        self.priorities[path] = priority
+        heapq.heappush(self.heap, (priority, next(self.counter), path))
+        self.queue_changed.emit(len(self.requests))
+        self.start_next()
+
+    def check_cache(self, path: str):
+        """Looks up the mask of a picture in the cache (in a loader thread)."""
+        self.cache_checked.emit(path, self.mask_cache.get(path, self.model))
+
+    def handle_cache_checked(self, path: str, mask: Optional[np.ndarray]):
+        """Sends the cached mask of a picture, or queues its job."""
+        priority = self.checking.pop(path, None)
+        if priority is None or path not in self.requests:
+            return  # Cancelled, or shut down.
+        if mask is None:
+            self.priorities[path] = priority
+            heapq.heappush(self.heap, (priority, next(self.counter), path))
+            self.start_next()
+            return
+
+        logger.info(
+            "Background mask of %s loaded from the cache (%d hits, %d misses)",
+            path,
+            self.mask_cache.hits,
+            self.mask_cache.misses,
+        )
+        del self.requests[path]
+        self.job_finished.emit(path, mask)
+        self.queue_changed.emit(len(self.requests))
+
+    def metrics(self) -> Dict[str, int]:
+        """Returns a snapshot of the queue and mask cache counters.
+        Masks are stored by the worker process, its counters aren't included.
+        """
+        cache_metrics = self.mask_cache.metrics()
+        return {
+            "jobs": len(self.requests),
+            "running": int(self.running is not None),
+            "cache_hits": cache_metrics["hits"],
+            "cache_misses": cache_metrics["misses"],
+        }
+
+    def cancel(self, image_path: str):
+        """Cancels a request. The job is dropped once nobody requests it.
+        A job already running can't be interrupted, its result is dropped.
+
+        Args:
+            image_path (str): Path of the picture.
+        """
+        path = os.path.abspath(image_path)
+        count = self.requests.get(path, 0)
+        if count > 1:
+            self.requests[path] = count - 1
+            return
+        if count == 1:
+            del self.requests[path]
+            self.priorities.pop(path, None)
+            self.queue_changed.emit(len(self.requests))
+
+    def request_batch(self, image_paths: List[str]) -> int:
+        """Schedules the background removal of several pictures, after the
+        pictures requested one by one. Each result is written next to its
+        picture (see backend.background_removal.output_path), pictures which
+        are already results are left out. Progress is sent by batch_progress,
+        then batch_finished.
+
+        Args:
+            image_paths (List[str]): Paths of the pictures.
+
+        Returns:
+            int: Id of the batch.
+        """
+        batch_id = next(self.batch_ids)
+        paths = [
+            os.path.abspath(image_path)
+            for image_path in image_paths
+            if not image_path.endswith(OUTPUT_SUFFIX)
+        ]
+        batch = BatchJob(len(paths))
+        self.batches[batch_id] = batch
+        for index in range(0, len(paths), self.CHUNK_SIZE):
+            key = ("batch", batch_id, index)
+            self.chunks[key] = paths[index : index + self.CHUNK_SIZE]
+            self.priorities[key] = PRIORITY_BACKGROUND
+            heapq.heappush(self.heap, (PRIORITY_BACKGROUND, next(self.counter), key))
+            batch.chunks += 1
+
+        self.batch_progress.emit(batch_id, 0, batch.total, 0.0)
+        if not batch.chunks:
+            self.finish_batch(batch_id)
+        self.start_next()
+        return batch_id
+
+    def cancel_batch(self, batch_id: int):
+        """Cancels the pictures of a batch which aren't being processed.
+
+        Args:
+            batch_id (int): Id of the batch.
+        """
+        for key in [key for key in self.chunks if key[1] == batch_id]:
+            if key != self.running:
+                self.priorities.pop(key, None)
+                self.chunk_done(key)
+
+    def batch_image_done(
+        self, key: tuple, path: str, written_path: Optional[str], error: Optional[str]
+    ):
+        """Counts a picture of a chunk processed by the worker process."""
+        remaining = self.chunks.get(key)
+        if remaining is None or path not in remaining:
+            return
+        remaining.remove(path)
+        batch = self.batches[key[1]]
+        batch.processed += 1
+        if error is None:
+            batch.written += 1
+        else:
+            batch.failed += 1
+            logger.warning("Background removal of %s failed: %s", path, error)
+        self.batch_progress.emit(
+            key[1], batch.processed, batch.total, batch.images_per_second()
+        )
+
+    def chunk_done(self, key: tuple):
+        """Ends a chunk. Its pictures not processed count as failed."""
+        remaining = self.chunks.pop(key, None)
+        if remaining is None:
+            return
+        batch = self.batches[key[1]]
+        batch.failed += len(remaining)
+        batch.processed += len(remaining)
+        batch.chunks -= 1
+        if batch.chunks == 0:
+            self.finish_batch(key[1])
+
+    def finish_batch(self, batch_id: int):
+        batch = self.batches.pop(batch_id)
+        logger.info(
+            "Background removal of %d pictures: %d failed, %.2f pictures/s",
+            batch.total,
+            batch.failed,
+            batch.images_per_second(),
+        )
+        self.batch_finished.emit(batch_id, batch.written, batch.failed)
+
+    def start(self):
+        """Starts the worker process, if it isn't running."""
+        if self.process is not None:
+            return
+        self.job_queue = self.context.Queue()
+        self.result_queue = self.context.Queue()
+        self.process = self.context.Process(
+            target=run_worker,
+            args=(self.job_queue, self.result_queue, self.model),
+            name="EpanouiDent background removal",
+            daemon=True,
+        )
+        self.process.start()
+        self.listener = ResultListener(self.result_queue, self.process)
+        self.listener.result_received.connect(self.handle_result)
+        self.listener.start()
+        logger.info("Background removal process started (pid %d)", self.process.pid)
+
+    def start_next(self):
+        """Sends the job with the highest priority to the worker process."""
+        if self.running is not None:
+            return
+        while self.heap:
+            priority, _, key = heapq.heappop(self.heap)
+            # Else cancelled, or queued again with a higher priority.
+            if self.priorities.get(key) == priority:
+                del self.priorities[key]
+                self.start()
+                self.running = key
+                if isinstance(key, tuple):
+                    self.job_queue.put(("batch", key, self.chunks[key]))
+                else:
+                    self.job_queue.put(key)
+                return
+
+    def handle_result(self, result: tuple):
+        """Handles a message of the worker process (see run_worker)."""
+        kind, path = result[:2]
+        if kind == "started":
+            if path in self.requests:
+                self.job_started.emit(path)
+            return
+
+        if kind == "batch_image":
+            self.batch_image_done(*result[1:])
+            return
+
+        if kind == "exited":
+            if self.listener is None or self.sender() is not self.listener:
+                return  # Shut down.
+            logger.warning("Background removal process exited unexpectedly")
+            self.stop_process()
+            path = self.running
+            if path is None:
+                return
+            if isinstance(path, tuple):
+                result = ("batch_finished", path)
+            else:
+                result = ("failed", path, "Worker exited")
+
+        self.running = None
+        if result[0] == "batch_finished":
+            self.chunk_done(path)
+        elif self.requests.pop(path, None):
+            if result[0] == "finished":
+                self.job_finished.emit(path, result[2])
+            else:
+                logger.warning("Background removal of %s failed: %s", path, result[2])
+                self.job_failed.emit(path, result[2])
+        self.queue_changed.emit(len(self.requests))
+        self.start_next()
+
+    def stop_process(self):
+        """Stops the worker process, waiting for the running job at most
+        SHUTDOWN_TIMEOUT seconds.
+        """
+        if self.process is None:
+            return
+        listener, self.listener = self.listener, None
+        if self.process.is_alive():
+            self.job_queue.put(None)
+            self.process.join(self.SHUTDOWN_TIMEOUT)
+            if self.process.is_alive():
+                self.process.terminate()
+                self.process.join()
+        self.result_queue.put(None)
+        listener.wait()
+        for process_queue in (self.job_queue, self.result_queue):
+            process_queue.close()
+            process_queue.cancel_join_thread()
+        self.process = None
+        self.job_queue = None
+        self.result_queue = None
+
+    def shutdown(self):
+        """Drops the jobs and stops the worker process, e.g. when quitting."""
+        self.requests.clear()
+        self.checking.clear()
+        self.priorities.clear()
+        self.heap.clear()
+        self.running = None
+        self.chunks.clear()
+        self.batches.clear()
+        self.stop_process()
+
+
+_background_removal_worker = None
+
+
+def get_background_removal_worker() -> BackgroundRemovalWorker:
+    """Returns the application-wide background removal worker.
+    Its process is only started with the first job.
+    """
+    global _background_removal_worker
+    if _background_removal_worker is None:
+        _background_removal_worker = BackgroundRemovalWorker()
+    return _background_removal_worker
+
+
+def shutdown_background_removal_worker():
+    """Stops the worker process, if it was started."""
+    if _background_removal_worker is not None:
+        _background_removal_worker.shutdown()
@@ -0,0 +1,152 @@
+"""
+Undo/redo history of the edits of an image, with a memory budget.
+
+Each step of the history is an immutable state of the edits, e.g. the list
+of operations of backend.edit_pipeline: undo and redo only move between
+states, the images are rendered (and cached) by the pipeline. Consecutive
+states share the objects which didn't change, so a step only costs the
+objects it adds. The oldest steps are dropped when the history goes over its
+memory budget.
+"""
+
+import os
+import sys
+from typing import Generic, List, Optional, Set, TypeVar
+
+MAX_HISTORY_BYTES = int(os.environ.get("EPANOUIDENT_UNDO_BUDGET_MB", 64)) * 1024 * 1024
+MAX_HISTORY_STATES = 1000
+
+State = TypeVar("State")
+
+
+def object_ids(value, ids: Set[int]) -> Set[int]:
+    """Adds the ids of value and of the items of the tuples it's made of."""
+    ids.add(id(value))
+    if isinstance(value, tuple):
+        for item in value:
+            object_ids(item, ids)
+    return ids
+
+
+def object_bytes(value, shared: Optional[Set[int]] = None) -> int:
+    """Approximate memory held by an immutable value, tuples included.
+
+    Args:
+        value: Value, e.g. a tuple of operations.
+        shared (Set[int], optional): Ids of the objects which aren't counted,
+                                     e.g. those of the previous state.
+    """
+    if shared is not None and id(value) in shared:
+        return 0
+    nbytes = sys.getsizeof(value)
+    if isinstance(value, tuple):
+        nbytes += sum(object_bytes(item, shared) for item in value)
+    return nbytes
+
+
+class EditHistory(Generic[State]):
+    """Undo/redo history of immutable states, with a memory budget."""
+
+    states: List[State]
+    sizes: List[int]  # Memory held by each state, not shared with the previous.
+    position: int  # Index of the current state.
+
+    def __init__(
+        self,
+        state: State,
+        max_bytes: int = MAX_HISTORY_BYTES,
+        max_states: int = MAX_HISTORY_STATES,
+    ):
+        """Constructor
+
+        Args:
+            state (State): State before any edit.
+            max_bytes (int, optional): Memory budget of the history. Defaults to
+                                       EPANOUIDENT_UNDO_BUDGET_MB or 64 MB.
+            max_states (int, optional): Maximum number of steps.
+                                        Defaults to MAX_HISTORY_STATES.
+        """
+        self.max_bytes = max_bytes
+        self.max_states = max_states
+        self.states = [state]
+        self.sizes = [object_bytes(state)]
+        self.position = 0
+
+    @property
+    def state(self) -> State:
+        """Current state."""
+        return self.states[self.position]
+
+    @property
+    def nbytes(self) -> int:
+        """Memory held by the history, in bytes."""
+        return sum(self.sizes)
+
+    def can_undo(self) -> bool:
+        return self.position > 0
+
+    def can_redo(self) -> bool:
+        return self.position < len(self.states) - 1
+
+    def state_bytes(self, index: int) -> int:
+        if index == 0:
+            return object_bytes(self.states[0])
+        return object_bytes(
+            self.states[index], object_ids(self.states[index - 1], set())
+        )
+
+    def push(self, state: State):
+        """Records a new step. The states which were undone can't be redone
+        anymore.
+        """
+        del self.states[self.position + 1 :]
+        del self.sizes[self.position + 1 :]
+        self.states.append(state)
+        self.position += 1
+        self.sizes.append(self.state_bytes(self.position))
+        self.trim()
+
+    def replace(self, state: State):
+        """Replaces the current state without recording a new step, e.g. while
+        a slider is moving.
+        """
+        del self.states[self.position + 1 :]
+        del self.sizes[self.position + 1 :]
+        self.states[self.position] = state
+        self.sizes[self.position] = self.state_bytes(self.position)
+        self.trim()
+
+    def undo(self) -> bool:
+        """Goes back to the previous state.
+
+        Returns:
+            bool: False if there's nothing to undo.
+        """
+        if not self.can_undo():
+            return False
+        self.position -= 1
+        return True
+
+    def redo(self) -> bool:
+        """Goes forward to the next state.
+
+        Returns:
+            bool: False if there's nothing to redo.
+        """
+        if not self.can_redo():
+            return False
+        self.position += 1
+        return True
+
+    def trim(self):
+        """Drops the oldest steps until the history fits in its budget. The
+        current state is always kept.
+        """
+        while self.position > 0 and (
+            len(self.states) > self.max_states or self.nbytes > self.max_bytes
+        ):
+            del self.states[0]
+            del self.sizes[0]
+            self.position -= 1
+            # It doesn't share its objects with a previous state anymore.
+            self.sizes[0] = self.state_bytes(0)
@@ -0,0 +1,494 @@
+"""
+Non-destructive editing of an image.
+
+The edits of an image are an ordered list of operations (flips, rotations,
+channel gains, background removal) applied to the original image, and the
+annotations drawn over the result (see backend.annotations). Operations only
+hold their parameters, they are immutable and serializable, so the list can
+be saved and any parameter changed later on.
+
+The result of each prefix of the list is cached: changing an operation only
+re-runs the operations after it, and undo/redo (which move between lists of
+operations) mostly hit the cache. Interactive display renders a proxy of the
+image (longest side of PROXY_SIZE pixels), the full resolution is only
+rendered when the image is exported, with the annotations flattened into it.
+
+Images are numpy arrays (BGR or BGRA) which are never modified in place.
+Rendering is thread-safe, e.g. to render the full resolution in a worker
+thread while the proxy is edited.
+"""
+
+import cv2
+import numpy as np
+import os
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from PySide6.QtGui import QImage, QPainter
+from typing import Dict, NamedTuple, Optional, Tuple, Union
+
+from backend.annotations import AnnotationLayer, Shape
+from backend.edit_history import EditHistory
+
+PROXY_SIZE = int(os.environ.get("EPANOUIDENT_PROXY_SIZE", 2048))
+MAX_CACHE_BYTES = int(os.environ.get("EPANOUIDENT_EDIT_CACHE_MB", 512)) * 1024 * 1024
+
+
+def array_to_qimage(image: np.ndarray) -> QImage:
+    """Wraps a BGR or BGRA image in a QImage, without copying it.
+    The array must be kept alive as long as the QImage is used.
+    """
+    return QImage(
+        image,
+        image.shape[1],
+        image.shape[0],
+        image.strides[0],
+        QImage.Format_ARGB32 if image.shape[2] == 4 else QImage.Format_BGR888,
+    )
+
+
+def as_tuple(value):
+    """Converts the lists of a deserialized value back to tuples."""
+    if isinstance(value, list):
+        return tuple(as_tuple(item) for item in value)
+    return value
+
+
+class FlipOperation(NamedTuple):
+    """Horizontal (flip_code=1) or vertical (flip_code=0) flip."""
+
+    flip_code: int
+
+    NAME = "flip"
+
+    def apply(self, image: np.ndarray, scale: float) -> np.ndarray:
+        return cv2.flip(image, self.flip_code)
+
+    def transform_mask(self, mask: np.ndarray) -> np.ndarray:
+        return cv2.flip(mask, self.flip_code)
+
+    def transform_point(
+        self, x: float, y: float, width: int, height: int
+    ) -> Tuple[float, float]:
+        if self.flip_code >= 0:
+            x = width - x if self.flip_code == 1 else x
+            y = height - y if self.flip_code == 0 else y
+            return x, y
+        return width - x, height - y
+
+
+class RotateOperation(NamedTuple):
+    """Rotation by a multiple of 90 degrees (cv2.ROTATE_*)."""
+
+    rotate_code: int
+
+    NAME = "rotate"
+
+    def apply(self, image: np.ndarray, scale: float) -> np.ndarray:
+        return cv2.rotate(image, self.rotate_code)
+
+    def transform_mask(self, mask: np.ndarray) -> np.ndarray:
+        return cv2.rotate(mask, self.rotate_code)
+
+    def transform_point(
+        self, x: float, y: float, width: int, height: int
+    ) -> Tuple[float, float]:
+        if self.rotate_code == cv2.ROTATE_90_CLOCKWISE:
+            return height - y, x
+        if self.rotate_code == cv2.ROTATE_90_COUNTERCLOCKWISE:
+            return y, width - x
+        return width - x, height - y
+
+
+@lru_cache(maxsize=64)
+def channel_gains_lut(gains: Tuple[int, int, int]) -> np.ndarray:
+    """Lookup table applying channel gains to a BGR image with cv2.LUT.
+    Like cv2.xphoto.applyChannelGains, gains are relative to the highest one,
+    so that no channel saturates.
+
+    Args:
+        gains (Tuple[int, int, int]): Gains in % (R, G, B order).
+    """
+    values = np.arange(256, dtype=np.float32)
+    highest = max(max(gains), 1)
+    return np.dstack(
+        [
+            np.clip(np.rint(values * gain / highest), 0, 255).astype(np.uint8)
+            for gain in reversed(gains)
+        ]
+    )
+
+
+class ChannelGainsOperation(NamedTuple):
+    """Channel gains, in % (R, G, B order)."""
+
+    gains: Tuple[int, int, int]
+
+    NAME = "channel_gains"
+
+    def apply(self, image: np.ndarray, scale: float) -> np.ndarray:
+        color = cv2.LUT(
+            np.ascontiguousarray(image[:, :, :3]), channel_gains_lut(self.gains)
+        )
+        if image.shape[2] == 4:
+            return np.dstack((color, image[:, :, 3]))
+        return color
+
+    def transform_mask(self, mask: np.ndarray) -> np.ndarray:
+        return mask
+
+    def transform_point(
+        self, x: float, y: float, width: int, height: int
+    ) -> Tuple[float, float]:
+        return x, y
+
+
+class RemoveBackgroundOperation(NamedTuple):
+    """Makes the background transparent. The alpha mask is computed on the
+    original image (see EditPipeline.set_background_mask) and goes through
+    the flips and rotations applied before this operation.
+    """
+
+    NAME = "remove_background"
+
+    def apply(
+        self, image: np.ndarray, scale: float, mask: Optional[np.ndarray] = None
+    ) -> np.ndarray:
+        if mask is None:
+            return image
+        if mask.shape[:2] != image.shape[:2]:
+            mask = cv2.resize(mask, (image.shape[1], image.shape[0]))
+        return np.dstack((image[:, :, :3], mask))
+
+    def transform_mask(self, mask: np.ndarray) -> np.ndarray:
+        return mask
+
+    def transform_point(
+        self, x: float, y: float, width: int, height: int
+    ) -> Tuple[float, float]:
+        return x, y
+
+
+Operation = Union[
+    FlipOperation,
+    RotateOperation,
+    ChannelGainsOperation,
+    RemoveBackgroundOperation,
+]
+
+OPERATIONS = {
+    operation.NAME: operation
+    for operation in (
+        FlipOperation,
+        RotateOperation,
+        ChannelGainsOperation,
+        RemoveBackgroundOperation,
+    )
+}
+
+
+def operation_to_dict(operation: Operation) -> dict:
+    """Serializes an operation (JSON compatible)."""
+    return {"operation": operation.NAME, **operation._asdict()}
+
+
+def operation_from_dict(data: dict) -> Operation:
+    """Deserializes an operation serialized by operation_to_dict.
+
+    Raises:
+        KeyError: Unknown operation.
+    """
+    operation = OPERATIONS[data["operation"]]
+    return operation(
+        **{
+            field: as_tuple(value)
+            for field, value in data.items()
+            if field in operation._fields
+        }
+    )
+
+
+class EditState(NamedTuple):
+    """Edits of an image at one step of the undo history."""
+
+    operations: Tuple[Operation, ...] = ()
+    # Drawn over the result of the operations, in its coordinates.
+    annotations: Tuple[Shape, ...] = ()
+
+
+class EditPipeline:
+    """Edits of an image, with undo/redo and a cache of the rendered images."""
+
+    source: np.ndarray
+    proxy_source: np.ndarray
+    proxy_scale: float  # Proxy resolution / full resolution.
+    background_mask: Optional[np.ndarray]  # Alpha mask of the source.
+    proxy_background_mask: Optional[np.ndarray]
+    history: EditHistory  # Successive states of the edits.
+    cache: Dict[tuple, np.ndarray]  # Rendered image per prefix of operations.
+
+    def __init__(
+        self,
+        source: np.ndarray,
+        proxy_size: int = PROXY_SIZE,
+        max_cache_bytes: int = MAX_CACHE_BYTES,
+    ):
+        """Constructor
+
+        Args:
+            source (np.ndarray): Original image (BGR or BGRA).
+            proxy_size (int, optional): Longest side of the proxy image, in
+                                        pixels. Defaults to
+                                        EPANOUIDENT_PROXY_SIZE or 2048.
+            max_cache_bytes (int, optional): Memory budget of the cache.
+                                             Defaults to
+                                             EPANOUIDENT_EDIT_CACHE_MB or 512 MB.
+        """
+        self.source = source
+        self.proxy_scale = min(1.0, proxy_size / max(source.shape[:2]))
+        self.proxy_source = self.resize_to_proxy(source, cv2.INTER_AREA)
+        self.background_mask = None
+        self.proxy_background_mask = None
+        self.max_cache_bytes = max_cache_bytes
+        self.cache = OrderedDict()
+        self.cache_bytes = 0
+        # Renders started before the cache was cleared aren't cached.
+        self.cache_generation = 0
+        self.cache_lock = threading.Lock()
+        self.history = EditHistory(EditState())
+
+    def resize_to_proxy(self, image: np.ndarray, interpolation: int) -> np.ndarray:
+        if self.proxy_scale == 1.0:
+            return image
+        return cv2.resize(
+            image,
+            (
+                max(1, round(image.shape[1] * self.proxy_scale)),
+                max(1, round(image.shape[0] * self.proxy_scale)),
+            ),
+            interpolation=interpolation,
+        )
+
+    def set_background_mask(self, mask: np.ndarray):
+        """Sets the alpha mask used to remove the background.
+
+        Args:
+            mask (np.ndarray): Mask of the source image (uint8, 255 for the
+                               foreground).
+        """
+        self.proxy_background_mask = self.resize_to_proxy(mask, cv2.INTER_AREA)
+        self.background_mask = mask
+        # Renders without the mask are outdated.
+        self.clear_cache()
+
+    @property
+    def state(self) -> EditState:
+        return self.history.state
+
+    @property
+    def operations(self) -> Tuple[Operation, ...]:
+        """Current list of operations."""
+        return self.state.operations
+
+    @property
+    def annotations(self) -> Tuple[Shape, ...]:
+        """Current annotations."""
+        return self.state.annotations
+
+    def can_undo(self) -> bool:
+        return self.history.can_undo()
+
+    def can_redo(self) -> bool:
+        return self.history.can_redo()
+
+    def new_state(
+        self,
+        operations: Optional[Tuple[Operation, ...]],
+        annotations: Optional[Tuple[Shape, ...]],
+    ) -> EditState:
+        return EditState(
+            self.operations if operations is None else tuple(operations),
+            self.annotations if annotations is None else tuple(annotations),
+        )
+
+    def commit(
+        self,
+        operations: Optional[Tuple[Operation, ...]] = None,
+        annotations: Optional[Tuple[Shape, ...]] = None,
+    ):
+        """Replaces the operations and/or the annotations (None keeps them).
+        The states which were undone can't be redone anymore.
+        """
+        self.history.push(self.new_state(operations, annotations))
+
+    def amend(
+        self,
+        operations: Optional[Tuple[Operation, ...]] = None,
+        annotations: Optional[Tuple[Shape, ...]] = None,
+    ):
+        """Replaces the operations and/or the annotations without recording
+        a new undo step, e.g. while a slider is moving.
+        """
+        self.history.replace(self.new_state(operations, annotations))
+
+    def push(self, operation: Operation):
+        """Appends an operation. Annotations follow the flips and rotations."""
+        width, height = self.image_size(self.operations)
+        self.commit(
+            self.operations + (operation,),
+            tuple(
+                shape.transformed(
+                    lambda x, y: operation.transform_point(x, y, width, height)
+                )
+                for shape in self.annotations
+            ),
+        )
+
+    def set_operation(self, index: int, operation: Operation):
+        """Changes the parameters of an operation. Only the operations after
+        it will be rendered again.
+        """
+        operations = self.operations
+        self.commit(operations[:index] + (operation,) + operations[index + 1 :])
+
+    def remove_operation(self, index: int):
+        operations = self.operations
+        self.commit(operations[:index] + operations[index + 1 :])
+
+    def undo(self) -> bool:
+        """Goes back to the previous state.
+
+        Returns:
+            bool: False if there's nothing to undo.
+        """
+        return self.history.undo()
+
+    def redo(self) -> bool:
+        """Goes forward to the next state.
+
+        Returns:
+            bool: False if there's nothing to redo.
+        """
+        return self.history.redo()
+
+    def image_size(self, operations: Tuple[Operation, ...]) -> Tuple[int, int]:
+        """Full resolution width and height after operations."""
+        height, width = self.source.shape[:2]
+        for operation in operations:
+            if isinstance(operation, RotateOperation) and (
+                operation.rotate_code != cv2.ROTATE_180
+            ):
+                width, height = height, width
+        return width, height
+
+    @staticmethod
+    def mask_after(
+        mask: Optional[np.ndarray], operations: Tuple[Operation, ...]
+    ) -> Optional[np.ndarray]:
+        """Background mask transformed by the flips and rotations of operations."""
+        if mask is None:
+            return None
+        for operation in operations:
+            mask = operation.transform_mask(mask)
+        return mask
+
+    def render(
+        self, proxy: bool = True, operations: Optional[Tuple[Operation, ...]] = None
+    ) -> np.ndarray:
+        """Renders a list of operations.
+
+        Args:
+            proxy (bool, optional): Render the proxy instead of the full
+                                    resolution. Defaults to True.
+            operations (Tuple[Operation, ...], optional): Operations to render.
+                                                          Defaults to the
+                                                          current ones.
+
+        Returns:
+            np.ndarray: Rendered image. It must not be modified.
+        """
+        if operations is None:
+            operations = self.operations
+        keys = [(proxy,)]
+        for operation in operations:
+            keys.append(keys[-1] + ((operation.NAME, operation),))
+
+        start = 0
+        with self.cache_lock:
+            generation = self.cache_generation
+            image = self.proxy_source if proxy else self.source
+            mask = self.proxy_background_mask if proxy else self.background_mask
+            for index in range(len(operations), 0, -1):
+                if keys[index] in self.cache:
+                    self.cache.move_to_end(keys[index])
+                    start, image = index, self.cache[keys[index]]
+                    break
+
+        scale = self.proxy_scale if proxy else 1.0
+        for index in range(start, len(operations)):
+            operation = operations[index]
+            if isinstance(operation, RemoveBackgroundOperation):
+                image = operation.apply(
+                    image, scale, self.mask_after(mask, operations[:index])
+                )
+            else:
+                image = operation.apply(image, scale)
+            # Only the result of the full resolution is cached, its
+            # intermediate images would fill the cache.
+            if proxy or index == len(operations) - 1:
+                self.cache_image(keys[index + 1], image, generation)
+        return image
+
+    def cache_image(self, key: tuple, image: np.ndarray, generation: int):
+        with self.cache_lock:
+            if key in self.cache or generation != self.cache_generation:
+                return
+            self.cache[key] = image
+            self.cache_bytes += image.nbytes
+            while self.cache_bytes > self.max_cache_bytes and len(self.cache) > 1:
+                _, evicted = self.cache.popitem(last=False)
+                self.cache_bytes -= evicted.nbytes
+
+    def clear_cache(self):
+        with self.cache_lock:
+            self.cache.clear()
+            self.cache_bytes = 0
+            self.cache_generation += 1
+
+    def export(self) -> np.ndarray:
+        """Renders the full resolution image with the annotations flattened."""
+        image = self.render(proxy=False)
+        if not self.annotations:
+            return image
+        image = image.copy()
+        q_image = array_to_qimage(image)
+        with QPainter(q_image) as painter:
+            painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+            AnnotationLayer(self.annotations).paint(painter, 1.0)
+        return image
+
+    def to_dict(self) -> dict:
+        """Serializes the current edits (JSON compatible)."""
+        return {
+            "operations": [
+                operation_to_dict(operation) for operation in self.operations
+            ],
+            "annotations": [shape.to_dict() for shape in self.annotations],
+        }
+
+    @classmethod
+    def from_dict(cls, source: np.ndarray, data: dict, **kwargs) -> "EditPipeline":
+        """Creates a pipeline from edits serialized by to_dict.
+
+        Args:
+            source (np.ndarray): Original image.
+            data (dict): Serialized edits.
+        """
+        pipeline = cls(source, **kwargs)
+        pipeline.history = EditHistory(
+            EditState(
+                tuple(operation_from_dict(item) for item in data["operations"]),
+                tuple(Shape.from_dict(item) for item in data.get("annotations", [])),
+            )
+        )
+        return pipeline
@@ -0,0 +1,77 @@
+"""
+In-memory index of the patient folders, used by the main page search.
+
+The patient root can hold tens of thousands of folders on a network share,
+so it's listed and indexed once (in a background thread) and then kept up
+to date by a folder watcher instead of being listed on every keystroke.
+Searching is done by backend.search_engine, the most recently modified
+folders (e.g. where pictures were just downloaded) coming first.
+"""
+
+import os
+from PySide6.QtCore import QThread, Signal
+from typing import List
+
+from backend.folder_watcher import Snapshot, scan_directory
+from backend.search_engine import SearchEngine
+
+
+class FolderIndex(SearchEngine):
+    """Search engine over the names of the folders of a directory."""
+
+    def build_from_snapshot(self, snapshot: Snapshot):
+        """Replaces the content of the index.
+
+        Args:
+            snapshot (Snapshot): Sub-folders of the directory
+                                 (see backend.folder_watcher.scan_directory).
+        """
+        self.build(
+            {
+                os.path.basename(path): mtime / 1e9
+                for path, (_, mtime) in snapshot.items()
+            }
+        )
+
+    def apply_changes(
+        self,
+        snapshot: Snapshot,
+        added: List[str],
+        removed: List[str],
+        modified: List[str],
+    ):
+        """Updates the index with the changes reported by a folder watcher.
+
+        Args:
+            snapshot (Snapshot): Current sub-folders of the directory.
+            added (List[str]): Paths of new folders.
+            removed (List[str]): Paths of deleted folders.
+            modified (List[str]): Paths of modified folders.
+        """
+        for path in removed:
+            self.remove(os.path.basename(path))
+        for path in added + modified:
+            if path in snapshot:
+                self.add(os.path.basename(path), snapshot[path][1] / 1e9)
+
+
+class FolderIndexBuilder(QThread):
+    """Lists and indexes the sub-folders of a directory in the background."""
+
+    # Built FolderIndex and the snapshot it was built from.
+    index_built = Signal(object, object)
+
+    def __init__(self, directory: str):
+        """Constructor
+
+        Args:
+            directory (str): Directory containing the patient folders.
+        """
+        super().__init__()
+        self.directory = directory
+
+    def run(self):
+        snapshot = scan_directory(self.directory, lambda entry: entry.is_dir())
+        index = FolderIndex()
+        index.build_from_snapshot(snapshot)
+        self.index_built.emit(index, snapshot)
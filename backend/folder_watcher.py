@@ -0,0 +1,191 @@
+"""
+Watcher reporting the files added, removed and modified in a folder.
+
+It relies on QFileSystemWatcher (inotify, ReadDirectoryChangesW, kqueue...)
+to know when the folder changes. Bursts of events (e.g. a camera download)
+are debounced into a single scan, done in the image loader pool, and only
+the differences with the previous scan are reported. When the folder can't
+be watched, or when polling is forced for network shares (whose remote
+changes aren't notified), the folder is polled instead.
+"""
+
+import os
+from PySide6.QtCore import QFileSystemWatcher, QObject, QTimer, Signal
+from typing import Callable, Dict, Optional, Tuple
+
+from backend.image_loader_pool import get_image_loader_pool, PRIORITY_VISIBLE
+
+# Path to (size, modification time).
+Snapshot = Dict[str, Tuple[int, int]]
+
+
+def scan_directory(
+    directory: str, entry_filter: Optional[Callable[[os.DirEntry], bool]] = None
+) -> Snapshot:
+    """Lists a directory with the size and modification time of its entries.
+
+    Args:
+        directory (str): Directory to scan.
+        entry_filter (Callable[[os.DirEntry], bool], optional): Entries for which
+                                                                it returns False
+                                                                are ignored.
+
+    Returns:
+        Snapshot: Path to (size, modification time), empty if directory is missing.
+    """
+    snapshot = {}
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry_filter is not None and not entry_filter(entry):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                snapshot[entry.path] = (stat.st_size, stat.st_mtime_ns)
+    except OSError:
+        pass
+    return snapshot
+
+
+class FolderWatcher(QObject):
+    """Watches a single folder and emits its changes."""
+
+    directory: Optional[str]
+    snapshot: Snapshot
+
+    DEBOUNCE_MS = 300
+    POLL_INTERVAL_MS = 3000
+
+    # Added, removed and modified paths.
+    files_changed = Signal(list, list, list)
+    # Emitted from the loader pool: generation, new snapshot.
+    scan_finished = Signal(int, object)
+
+    def __init__(
+        self,
+        entry_filter: Optional[Callable[[os.DirEntry], bool]] = None,
+        poll_interval_ms: Optional[int] = None,
+    ):
+        """Constructor
+
+        Args:
+            entry_filter (Callable[[os.DirEntry], bool], optional): Entries for which
+                                                                    it returns False
+                                                                    are ignored.
+            poll_interval_ms (int, optional): Always poll the folder at this interval.
+                                              Defaults to EPANOUIDENT_WATCHER_POLL_MS,
+                                              polling only when watching fails.
+        """
+        super().__init__()
+        self.entry_filter = entry_filter
+        if poll_interval_ms is None and "EPANOUIDENT_WATCHER_POLL_MS" in os.environ:
+            poll_interval_ms = int(os.environ["EPANOUIDENT_WATCHER_POLL_MS"])
+        self.forced_poll_interval_ms = poll_interval_ms
+
+        self.directory = None
+        self.snapshot = {}
+        # Incremented for each watched folder, older scans are dropped.
+        self.generation = 0
+        self.scan_running = False
+        self.rescan_needed = False
+
+        self.watcher = QFileSystemWatcher()
+        self.watcher.directoryChanged.connect(self.schedule_scan)
+
+        self.debounce_timer = QTimer()
+        self.debounce_timer.setSingleShot(True)
+        self.debounce_timer.setInterval(self.DEBOUNCE_MS)
+        self.debounce_timer.timeout.connect(self.start_scan)
+
+        self.poll_timer = QTimer()
+        self.poll_timer.timeout.connect(self.start_scan)
+
+        self.scan_finished.connect(self.on_scan_finished)
+
+    def watch(self, directory: str, snapshot: Optional[Snapshot] = None) -> Snapshot:
+        """Starts watching directory, and stops watching the previous one.
+
+        Args:
+            directory (str): Directory to watch.
+            snapshot (Snapshot, optional): Current content of the directory, if the
+                                           caller already scanned it.
+
+        Returns:
+            Snapshot: Current content of the directory.
+        """
+        self.stop()
+        self.directory = directory
+        self.snapshot = (
+            snapshot
+            if snapshot is not None
+            else scan_directory(directory, self.entry_filter)
+        )
+
+        watched = self.watcher.addPath(directory)
+        if self.forced_poll_interval_ms:
+            self.poll_timer.start(self.forced_poll_interval_ms)
+        elif not watched:
+            self.poll_timer.start(self.POLL_INTERVAL_MS)
+
+        return self.snapshot
+
+    def stop(self):
+        """Stops watching the current directory."""
+        self.generation += 1
+        self.scan_running = False
+        self.rescan_needed = False
+        self.debounce_timer.stop()
+        self.poll_timer.stop()
+        if self.watcher.directories():
+            self.watcher.removePaths(self.watcher.directories())
+        self.directory = None
+        self.snapshot = {}
+
+    def schedule_scan(self):
+        """Requests a scan. Requests are debounced, so that a burst of
+        changes only results in a single scan.
+        """
+        if self.directory is not None:
+            self.debounce_timer.start()
+
+    def start_scan(self):
+        """Scans the directory in the image loader pool."""
+        if self.directory is None:
+            return
+        if self.scan_running:
+            self.rescan_needed = True
+            return
+
+        self.scan_running = True
+        get_image_loader_pool().submit(
+            self.scan, self.generation, self.directory, priority=PRIORITY_VISIBLE
+        )
+
+    def scan(self, generation: int, directory: str):
+        """Scans directory and sends the result to the GUI thread."""
+        self.scan_finished.emit(generation, scan_directory(directory, self.entry_filter))
+
+    def on_scan_finished(self, generation: int, snapshot: Snapshot):
+        """Emits the differences between snapshot and the previous scan."""
+        if generation != self.generation:
+            return
+
+        self.scan_running = False
+        previous = self.snapshot
+        self.snapshot = snapshot
+
+        added = list(snapshot.keys() - previous.keys())
+        removed = list(previous.keys() - snapshot.keys())
+        modified = [
+            path
+            for path, signature in snapshot.items()
+            if path in previous and previous[path] != signature
+        ]
+        if added or removed or modified:
+            self.files_changed.emit(added, removed, modified)
+
+        if self.rescan_needed:
+            self.rescan_needed = False
+            self.start_scan()
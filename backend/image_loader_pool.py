@@ -0,0 +1,197 @@
+"""
+Application-wide pool of threads used to load images.
+
+All widgets (gallery, collage, before/after, image edit page) submit their
+decoding jobs here instead of creating their own threads. Jobs are run by
+priority, can be cancelled by group (e.g. when the user switches folders)
+and the pool exposes queue-depth metrics.
+"""
+
+import heapq
+import itertools
+import os
+import threading
+from concurrent.futures import Future
+from typing import Callable, Dict, Hashable, List, Optional
+
+# Lower values run first.
+PRIORITY_INTERACTIVE = 0  # The user is waiting for this image (edit page, ...).
+PRIORITY_VISIBLE = 10  # Tiles currently shown on screen.
+PRIORITY_BACKGROUND = 20  # Everything else (off-screen tiles, prefetching).
+
+
+class ImageLoaderPool:
+    """Bounded priority thread pool with cancellable job groups.
+
+    OpenCV releases the GIL while decoding, and patient folders can live on
+    network shares, so the pool is sized above the CPU count by default.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None):
+        """Constructor
+
+        Args:
+            max_workers (int, optional): Number of worker threads.
+                                         Defaults to twice the CPU count (max 32).
+        """
+        self.max_workers = max_workers or min(32, 2 * (os.cpu_count() or 1))
+        self.queue = []
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+        self.threads: List[threading.Thread] = []
+        self.idle_workers = 0
+        self.running = True
+
+        # Metrics
+        self.active = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.max_queue_depth = 0
+
+    def submit(
+        self,
+        fn: Callable,
+        *args,
+        priority: int = PRIORITY_BACKGROUND,
+        group: Hashable = None,
+    ) -> Future:
+        """Schedules fn(*args).
+
+        Args:
+            fn (Callable): Function to run in a worker thread.
+            priority (int, optional): Lower values run first. Jobs with the same
+                                      priority run in submission order.
+            group (Hashable, optional): Group used to cancel several jobs at once.
+
+        Returns:
+            Future: Future holding fn's result.
+        """
+        future = Future()
+        with self.condition:
+            if not self.running:
+                raise RuntimeError("Image loader pool is shut down.")
+
+            heapq.heappush(
+                self.queue, (priority, next(self.counter), group, future, fn, args)
+            )
+            self.submitted += 1
+            self.max_queue_depth = max(self.max_queue_depth, len(self.queue))
+
+            if (
+                len(self.queue) > self.idle_workers
+                and len(self.threads) < self.max_workers
+            ):
+                thread = threading.Thread(
+                    target=self.worker,
+                    name=f"image-loader-{len(self.threads)}",
+                    daemon=True,
+                )
+                self.threads.append(thread)
+                thread.start()
+            self.condition.notify()
+
+        return future
+
+    def cancel_group(self, group: Hashable) -> int:
+        """Cancels the queued jobs of a group. Running jobs are left to finish.
+
+        Args:
+            group (Hashable): Group given to submit().
+
+        Returns:
+            int: Number of cancelled jobs.
+        """
+        with self.condition:
+            kept = []
+            cancelled = 0
+            for job in self.queue:
+                if job[2] == group and job[3].cancel():
+                    cancelled += 1
+                else:
+                    kept.append(job)
+            heapq.heapify(kept)
+            self.queue = kept
+            self.cancelled += cancelled
+
+        return cancelled
+
+    def queue_depth(self) -> int:
+        """Number of jobs waiting for a worker."""
+        with self.condition:
+            return len(self.queue)
+
+    def metrics(self) -> Dict[str, int]:
+        """Returns a snapshot of the pool's counters."""
+        with self.condition:
+            return {
+                "workers": len(self.threads),
+                "queue_depth": len(self.queue),
+                "max_queue_depth": self.max_queue_depth,
+                "active": self.active,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "cancelled": self.cancelled,
+            }
+
+    def worker(self):
+        """Worker thread loop."""
+        while True:
+            with self.condition:
+                self.idle_workers += 1
+                while self.running and not self.queue:
+                    self.condition.wait()
+                self.idle_workers -= 1
+                if not self.running:
+                    return
+
+                _, _, _, future, fn, args = heapq.heappop(self.queue)
+                if not future.set_running_or_notify_cancel():
+                    # Cancelled directly through the future.
+                    self.cancelled += 1
+                    continue
+                self.active += 1
+
+            try:
+                result = fn(*args)
+            except BaseException as e:
+                future.set_exception(e)
+                succeeded = False
+            else:
+                future.set_result(result)
+                succeeded = True
+
+            with self.condition:
+                self.active -= 1
+                if succeeded:
+                    self.completed += 1
+                else:
+                    self.failed += 1
+
+    def shutdown(self):
+        """Cancels queued jobs and stops the workers once their job is done."""
+        with self.condition:
+            self.running = False
+            for job in self.queue:
+                if job[3].cancel():
+                    self.cancelled += 1
+            self.queue = []
+            self.condition.notify_all()
+
+
+_image_loader_pool = None
+
+
+def get_image_loader_pool() -> ImageLoaderPool:
+    """Returns the application-wide image loader pool.
+    Its size can be set with the EPANOUIDENT_LOADER_THREADS environment variable.
+    """
+    global _image_loader_pool
+    if _image_loader_pool is None:
+        max_workers = os.environ.get("EPANOUIDENT_LOADER_THREADS")
+        _image_loader_pool = ImageLoaderPool(
+            int(max_workers) if max_workers else None
+        )
+    return _image_loader_pool
@@ -0,0 +1,192 @@
+"""
+Persistent cache of the background removal results.
+
+The alpha masks computed by the background removal model are stored inside
+each patient folder, under `.epanouident/masks`, as single channel PNG files
+(masks are mostly uniform, they compress very well). They are keyed by the
+hash of the picture's content and the model name, so a picture opened again
+(even renamed or copied) doesn't go through the model again. The cache of a
+folder is trimmed by evicting the least recently used masks.
+"""
+
+import cv2
+import hashlib
+import numpy as np
+import os
+import threading
+from typing import Dict, Optional, Tuple
+
+from backend.thumbnail_cache import CACHE_DIR_NAME
+from backend.utils import evict_least_recently_used
+
+MASKS_DIR_NAME = "masks"
+
+
+class MaskCache:
+    """Disk cache of alpha masks. It is thread-safe, and can be used by
+    several processes at once (files are written atomically).
+    """
+
+    MAX_DISK_BYTES = 64 * 1024 * 1024  # Per patient folder.
+    HASH_CHUNK_SIZE = 1024 * 1024
+
+    # (path, modification time, size) -> hash of the content.
+    file_hashes: Dict[Tuple[str, int, int], str]
+
+    def __init__(self, max_disk_bytes: int = MAX_DISK_BYTES):
+        """Constructor
+
+        Args:
+            max_disk_bytes (int, optional): Size limit of each on-disk cache folder.
+        """
+        self.max_disk_bytes = max_disk_bytes
+        self.file_hashes = {}
+        self.lock = threading.Lock()
+
+        # Metrics
+        self.hits = 0
+        self.misses = 0
+        self.stored = 0
+        self.evicted_bytes = 0
+
+    @staticmethod
+    def cache_directory(image_path: str) -> str:
+        """Returns the masks directory of the folder containing image_path."""
+        return os.path.join(
+            os.path.dirname(os.path.abspath(image_path)),
+            CACHE_DIR_NAME,
+            MASKS_DIR_NAME,
+        )
+
+    def file_hash(self, image_path: str) -> Optional[str]:
+        """Hash of the content of a file, only computed again if the file
+        changed.
+
+        Args:
+            image_path (str): Path to the image.
+
+        Returns:
+            Optional[str]: The hash, None if the file can't be read.
+        """
+        try:
+            stat = os.stat(image_path)
+        except OSError:
+            return None
+
+        identity = (os.path.abspath(image_path), stat.st_mtime_ns, stat.st_size)
+        with self.lock:
+            file_hash = self.file_hashes.get(identity)
+        if file_hash is not None:
+            return file_hash
+
+        sha1 = hashlib.sha1()
+        try:
+            with open(image_path, "rb") as f:
+                for chunk in iter(lambda: f.read(self.HASH_CHUNK_SIZE), b""):
+                    sha1.update(chunk)
+        except OSError:
+            return None
+
+        file_hash = sha1.hexdigest()
+        with self.lock:
+            self.file_hashes[identity] = file_hash
+        return file_hash
+
+    def mask_path(self, image_path: str, model: str) -> Optional[str]:
+        """Path of the cached mask of an image, None if it can't be read."""
+        file_hash = self.file_hash(image_path)
+        if file_hash is None:
+            return None
+        directory = self.cache_directory(image_path)
+        return os.path.join(directory, f"{file_hash}-{model}.png")
+
+    def get(self, image_path: str, model: str) -> Optional[np.ndarray]:
+        """Returns the cached mask of image_path if any.
+
+        Args:
+            image_path (str): Path to the original image.
+            model (str): Background removal model.
+        """
+        mask_path = self.mask_path(image_path, model)
+        mask = None
+        if mask_path is not None:
+            try:
+                with open(mask_path, "rb") as f:
+                    data = np.frombuffer(f.read(), dtype=np.uint8)
+                # Mark it as recently used for the disk eviction.
+                os.utime(mask_path)
+                mask = cv2.imdecode(data, cv2.IMREAD_GRAYSCALE)
+            except OSError:
+                pass
+
+        with self.lock:
+            if mask is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return mask
+
+    def put(self, image_path: str, mask: np.ndarray, model: str):
+        """Stores the mask of image_path on disk, and trims the cache of its
+        folder. Read-only folders are silently skipped.
+
+        Args:
+            image_path (str): Path to the original image.
+            mask (np.ndarray): Single channel alpha mask.
+            model (str): Background removal model.
+        """
+        mask_path = self.mask_path(image_path, model)
+        if mask_path is None:
+            return
+
+        ret, data = cv2.imencode(".png", mask)
+        if not ret:
+            return
+
+        directory = os.path.dirname(mask_path)
+        tmp_path = f"{mask_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(directory, exist_ok=True)
+            with open(tmp_path, "wb") as f:
+                f.write(data.tobytes())
+            os.replace(tmp_path, mask_path)
+        except OSError:
+            return
+
+        evicted_bytes = evict_least_recently_used(directory, self.max_disk_bytes)
+        with self.lock:
+            self.stored += 1
+            self.evicted_bytes += evicted_bytes
+
+    def metrics(self) -> Dict[str, int]:
+        """Returns a snapshot of the cache's counters."""
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "stored": self.stored,
+                "evicted_bytes": self.evicted_bytes,
+            }
+
+
+_mask_cache = None
+
+
+def get_mask_cache() -> MaskCache:
+    """Returns the mask cache of the process.
+    Its size limit can be set with the EPANOUIDENT_MASK_CACHE_MB environment
+    variable.
+    """
+    global _mask_cache
+    if _mask_cache is None:
+        _mask_cache = MaskCache(
+            max_disk_bytes=int(
+                os.environ.get(
+                    "EPANOUIDENT_MASK_CACHE_MB",
+                    MaskCache.MAX_DISK_BYTES // (1024 * 1024),
+                )
+            )
+            * 1024
+            * 1024
+        )
+    return _mask_cache
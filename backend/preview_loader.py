@@ -0,0 +1,240 @@
+"""
+Reduced-resolution image loading for previews (gallery tiles, collages).
+
+JPEG files are decoded directly at 1/2, 1/4 or 1/8 of their size, which
+libjpeg does in the DCT domain, or from their embedded EXIF thumbnail when it
+is large enough. Only the JPEG header is parsed to choose the smallest scale
+that still fills the requested tile.
+
+Benchmark on a folder of camera pictures:
+    python3 -m backend.preview_loader <folder> [tile_size]
+"""
+
+import cv2
+import numpy as np
+import os
+import struct
+import sys
+import time
+from typing import NamedTuple, Optional
+
+JPEG_EXTENSIONS = (".jpg", ".jpeg", ".jpe", ".jfif")
+# Formats OpenCV can decode.
+IMAGE_EXTENSIONS = JPEG_EXTENSIONS + (
+    ".png", ".bmp", ".dib", ".tif", ".tiff", ".webp", ".jp2",
+    ".pbm", ".pgm", ".ppm", ".pnm", ".sr", ".ras", ".exr", ".hdr", ".pic",
+)
+
+# Largest reduction first.
+REDUCED_DECODE_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
+# Start Of Frame markers holding the image dimensions.
+SOF_MARKERS = {
+    0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF
+}
+
+
+class JpegHeader(NamedTuple):
+    width: int
+    height: int
+    orientation: int  # EXIF orientation, 1 when missing.
+    thumbnail: Optional[bytes]  # Embedded EXIF thumbnail (JPEG stream).
+
+
+def read_jpeg_header(image_path: str) -> Optional[JpegHeader]:
+    """Reads the dimensions and EXIF thumbnail of a JPEG file
+    without decoding it.
+
+    Args:
+        image_path (str): Path to the JPEG file.
+
+    Returns:
+        Optional[JpegHeader]: Header, None if the file is not a valid JPEG.
+    """
+    orientation = 1
+    thumbnail = None
+    try:
+        with open(image_path, "rb") as f:
+            if f.read(2) != b"\xff\xd8":
+                return None
+
+            while True:
+                byte = f.read(1)
+                if not byte:
+                    return None
+                if byte != b"\xff":
+                    continue
+
+                marker = f.read(1)
+                while marker == b"\xff":  # Fill bytes
+                    marker = f.read(1)
+                if not marker:
+                    return None
+
+                marker = marker[0]
+                if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+                    continue  # Markers without payload
+                if marker == 0xD9 or marker == 0xDA:
+                    return None  # End of image or scan before any frame header
+
+                length_bytes = f.read(2)
+                if len(length_bytes) != 2:
+                    return None
+                length = struct.unpack(">H", length_bytes)[0] - 2
+
+                if marker in SOF_MARKERS:
+                    data = f.read(5)
+                    if len(data) != 5:
+                        return None
+                    height, width = struct.unpack(">HH", data[1:5])
+                    return JpegHeader(width, height, orientation, thumbnail)
+
+                if marker == 0xE1:
+                    data = f.read(length)
+                    if data.startswith(b"Exif\x00\x00"):
+                        orientation, thumbnail = parse_exif(data[6:])
+                else:
+                    f.seek(length, os.SEEK_CUR)
+    except (OSError, struct.error):
+        return None
+
+
+def parse_exif(tiff: bytes):
+    """Extracts the orientation and the thumbnail from an EXIF (TIFF) block.
+
+    Args:
+        tiff (bytes): EXIF payload, starting at the TIFF header.
+
+    Returns:
+        Tuple[int, Optional[bytes]]: Orientation and thumbnail JPEG stream.
+    """
+    orientation = 1
+    thumbnail = None
+    try:
+        endian = "<" if tiff[:2] == b"II" else ">"
+        ifd_offset = struct.unpack(endian + "I", tiff[4:8])[0]
+
+        # IFD0 contains the orientation, IFD1 the thumbnail.
+        for ifd_index in range(2):
+            if ifd_offset == 0 or ifd_offset + 2 > len(tiff):
+                break
+            count = struct.unpack(endian + "H", tiff[ifd_offset : ifd_offset + 2])[0]
+            thumbnail_offset = thumbnail_length = None
+            for i in range(count):
+                entry = ifd_offset + 2 + 12 * i
+                tag, _, _ = struct.unpack(endian + "HHI", tiff[entry : entry + 8])
+                if ifd_index == 0 and tag == 0x0112:
+                    orientation = struct.unpack(
+                        endian + "H", tiff[entry + 8 : entry + 10]
+                    )[0]
+                elif ifd_index == 1 and tag == 0x0201:
+                    thumbnail_offset = struct.unpack(
+                        endian + "I", tiff[entry + 8 : entry + 12]
+                    )[0]
+                elif ifd_index == 1 and tag == 0x0202:
+                    thumbnail_length = struct.unpack(
+                        endian + "I", tiff[entry + 8 : entry + 12]
+                    )[0]
+
+            if thumbnail_offset is not None and thumbnail_length:
+                thumbnail = tiff[thumbnail_offset : thumbnail_offset + thumbnail_length]
+
+            next_offset = ifd_offset + 2 + 12 * count
+            ifd_offset = struct.unpack(
+                endian + "I", tiff[next_offset : next_offset + 4]
+            )[0]
+    except struct.error:
+        pass
+
+    return orientation, thumbnail or None
+
+
+def apply_orientation(img: np.ndarray, orientation: int) -> np.ndarray:
+    """Applies an EXIF orientation to an image decoded without it."""
+    if orientation in (2, 5, 7):
+        img = cv2.flip(img, 1)
+    if orientation in (3, 4):
+        img = cv2.rotate(img, cv2.ROTATE_180)
+    elif orientation in (5, 8):
+        img = cv2.rotate(img, cv2.ROTATE_90_COUNTERCLOCKWISE)
+    elif orientation in (6, 7):
+        img = cv2.rotate(img, cv2.ROTATE_90_CLOCKWISE)
+    if orientation == 4:
+        img = cv2.flip(img, 1)
+    return img
+
+
+def load_preview(image_path: str, tile_size: int) -> Optional[np.ndarray]:
+    """Loads an image for previewing. The result's longest side is at least
+    tile_size (unless the image itself is smaller) and is as close as
+    possible to it, so the caller only has a small resize left to do.
+
+    Args:
+        image_path (str): Path to the image.
+        tile_size (int): Longest side of the tile the image is shown in.
+
+    Returns:
+        Optional[np.ndarray]: BGR image, None if the file is not an image.
+    """
+    if not image_path.lower().endswith(JPEG_EXTENSIONS):
+        return cv2.imread(image_path, cv2.IMREAD_COLOR)
+
+    header = read_jpeg_header(image_path)
+    if header is None:
+        return cv2.imread(image_path, cv2.IMREAD_COLOR)
+
+    if header.thumbnail is not None:
+        img = cv2.imdecode(np.frombuffer(header.thumbnail, np.uint8), cv2.IMREAD_COLOR)
+        if img is not None and max(img.shape[:2]) >= tile_size:
+            return apply_orientation(img, header.orientation)
+
+    longest_side = max(header.width, header.height)
+    for factor, flag in REDUCED_DECODE_FLAGS:
+        if longest_side // factor >= tile_size:
+            img = cv2.imread(image_path, flag)
+            if img is not None:
+                return img
+            break
+
+    return cv2.imread(image_path, cv2.IMREAD_COLOR)
+
+
+def benchmark(directory: str, tile_size: int = 300):
+    """Compares full and preview decoding on the JPEG files of a directory.
+
+    Args:
+        directory (str): Folder containing camera pictures.
+        tile_size (int, optional): Tile size to load previews for.
+    """
+    files = [
+        os.path.join(directory, f)
+        for f in sorted(os.listdir(directory))
+        if f.lower().endswith(JPEG_EXTENSIONS)
+    ]
+    if not files:
+        print("No JPEG file found.")
+        return
+
+    for name, loader in (
+        ("full decode", lambda path: cv2.imread(path, cv2.IMREAD_COLOR)),
+        ("preview decode", lambda path: load_preview(path, tile_size)),
+    ):
+        decoded_bytes = 0
+        start = time.perf_counter()
+        for path in files:
+            img = loader(path)
+            if img is not None:
+                decoded_bytes += img.nbytes
+        elapsed = time.perf_counter() - start
+        print(
+            f"{name}: {len(files)} files, {1000 * elapsed / len(files):.1f} ms/image, "
+            f"{decoded_bytes / len(files) / (1024 * 1024):.2f} MB/image decoded"
+        )
+
+
+if __name__ == "__main__":
+    benchmark(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 300)
@@ -0,0 +1,488 @@
+"""
+Fuzzy search engine for patient folder names.
+
+Names and queries are normalized (accents removed, case folded, punctuation
+turned into spaces) and split into tokens, so that "eloise" finds "Éloïse"
+and "dupont jean" finds "JEAN-DUPONT". Each query token matches the indexed
+tokens exactly, by prefix (the word being typed), by substring (trigram
+index, or a scan of the tokens for one or two letters) or within a small
+edit distance (typos). A name matches when all
+the query tokens match one of its tokens, the best matches and the most
+recently modified folders coming first.
+
+Benchmark on generated names:
+    python3 -m backend.search_engine [count]
+"""
+
+import bisect
+import heapq
+import random
+import re
+import sys
+import time
+import unicodedata
+from collections import defaultdict
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+# Cost of a query token match, lower is better.
+EXACT_COST = 0.0
+PREFIX_COST = 0.5
+SUBSTRING_COST = 0.75
+TYPO_COST = 1.0  # Per edit.
+
+# Recency is worth at most RECENCY_WEIGHT, halved every RECENCY_HALF_LIFE.
+RECENCY_WEIGHT = 0.4
+RECENCY_HALF_LIFE = 30 * 24 * 3600
+
+TOKEN_PATTERN = re.compile(r"[^\W\d_]+|\d+")
+
+# Letters NFKD doesn't decompose.
+LIGATURES = str.maketrans(
+    {"œ": "oe", "Œ": "oe", "æ": "ae", "Æ": "ae", "ø": "o", "Ø": "o"}
+)
+
+
+def normalize(text: str) -> str:
+    """Removes accents, folds case and turns punctuation into spaces.
+
+    Args:
+        text (str): Text to normalize.
+
+    Returns:
+        str: Normalized text, e.g. "Éloïse_Dupont" gives "eloise dupont".
+    """
+    text = unicodedata.normalize("NFKD", text.translate(LIGATURES))
+    return "".join(
+        c if c.isalnum() else " "
+        for c in text.casefold()
+        if not unicodedata.combining(c)
+    )
+
+
+def tokenize(text: str) -> List[str]:
+    """Normalizes text and splits it into words and numbers,
+    e.g. "Dupont42_Zoé" gives ["dupont", "42", "zoe"].
+    """
+    return TOKEN_PATTERN.findall(normalize(text))
+
+
+def trigrams(text: str) -> Set[str]:
+    """Returns the set of 3 characters substrings of text."""
+    return {text[i : i + 3] for i in range(len(text) - 2)}
+
+
+def deletions(token: str) -> Set[str]:
+    """Returns the strings obtained by removing one letter from token."""
+    return {token[:i] + token[i + 1 :] for i in range(len(token))}
+
+
+def remove_sorted(items: List[str], item: str):
+    """Removes item from a sorted list, if it's there."""
+    position = bisect.bisect_left(items, item)
+    if position < len(items) and items[position] == item:
+        del items[position]
+
+
+def bounded_edit_distance(a: str, b: str, max_distance: int) -> int:
+    """Levenshtein distance between a and b, with adjacent transpositions
+    counted as a single edit. The computation stops as soon as the distance
+    exceeds max_distance.
+
+    Returns:
+        int: Distance, max_distance + 1 when it's larger than max_distance.
+    """
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+
+    previous_row = None
+    row = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        previous_row, row, before = row, [i] + [0] * len(b), previous_row
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            row[j] = min(
+                previous_row[j] + 1, row[j - 1] + 1, previous_row[j - 1] + cost
+            )
+            if (
+                before is not None
+                and j > 1
+                and a[i - 1] == b[j - 2]
+                and a[i - 2] == b[j - 1]
+            ):
+                row[j] = min(row[j], before[j - 2] + 1)
+        if min(row) > max_distance:
+            return max_distance + 1
+    return min(row[-1], max_distance + 1)
+
+
+class TokenMatches(NamedTuple):
+    costs: Dict[str, float]  # Matching token to the cost of the match.
+    # Cost to its tokens and their number of names (an estimate once cached).
+    groups: Dict[float, Tuple[List[str], int]]
+
+
+class SearchEngine:
+    """Token and n-gram index of names."""
+
+    timestamps: Dict[str, float]  # Name to last modification time.
+    name_tokens: Dict[str, List[str]]
+    token_names: Dict[str, Set[str]]
+    sorted_tokens: List[str]  # For prefix lookups.
+    token_trigrams: Dict[str, Set[str]]  # Trigram of the padded tokens to tokens.
+    # "<token minus one letter>\0<token>" strings, sorted for lookups.
+    sorted_deletions: List[str]
+    recent_names: Dict[str, List[str]]  # Token to its names, most recent first.
+    recent_all: Optional[List[str]]  # All the names, most recent first.
+    match_cache: Dict[str, TokenMatches]  # Query token to matching tokens.
+
+    MATCH_CACHE_SIZE = 256
+    MIN_TYPO_LENGTH = 4  # Shorter query tokens must match exactly.
+    MIN_TWO_TYPOS_LENGTH = 7
+
+    def __init__(self):
+        """Constructor"""
+        self.timestamps = {}
+        self.name_tokens = {}
+        self.token_names = defaultdict(set)
+        self.sorted_tokens = []
+        self.token_trigrams = defaultdict(set)
+        self.sorted_deletions = []
+        self.recent_names = {}
+        self.recent_all = None
+        self.match_cache = {}
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.timestamps
+
+    def __iter__(self):
+        return iter(self.timestamps)
+
+    def build(self, timestamps: Dict[str, float]):
+        """Replaces the content of the index.
+
+        Args:
+            timestamps (Dict[str, float]): Names to index, with their last
+                                           modification time.
+        """
+        self.__init__()
+        for name, timestamp in timestamps.items():
+            self.add(name, timestamp, keep_sorted=False)
+        self.sorted_tokens = sorted(self.token_names)
+        self.sorted_deletions.sort()
+        for token in self.sorted_tokens:
+            self.names_by_recency(token)
+        self.all_names_by_recency()
+
+    def add(self, name: str, timestamp: float = 0.0, keep_sorted: bool = True):
+        """Adds a name to the index, or updates its modification time.
+
+        Args:
+            name (str): Name to index.
+            timestamp (float, optional): Last modification time of name.
+            keep_sorted (bool, optional): Update the prefix lookup list.
+                                          Only build() sets it to False.
+        """
+        if self.timestamps.get(name) == timestamp:
+            return
+        self.timestamps[name] = timestamp
+        self.recent_all = None
+        if name in self.name_tokens:
+            for token in self.name_tokens[name]:
+                self.recent_names.pop(token, None)
+            return
+
+        tokens = tokenize(name)
+        self.name_tokens[name] = tokens
+        for token in tokens:
+            if token not in self.token_names:
+                self.match_cache.clear()
+                for trigram in trigrams(f" {token} "):
+                    self.token_trigrams[trigram].add(token)
+                if keep_sorted:
+                    bisect.insort(self.sorted_tokens, token)
+                    for deleted in deletions(token):
+                        bisect.insort(self.sorted_deletions, f"{deleted}\0{token}")
+                else:
+                    self.sorted_deletions.extend(
+                        f"{deleted}\0{token}" for deleted in deletions(token)
+                    )
+            self.token_names[token].add(name)
+            self.recent_names.pop(token, None)
+
+    def remove(self, name: str):
+        """Removes a name from the index."""
+        if name not in self.timestamps:
+            return
+
+        del self.timestamps[name]
+        self.recent_all = None
+        for token in self.name_tokens.pop(name):
+            self.recent_names.pop(token, None)
+            names = self.token_names.get(token)
+            if names is None:
+                continue  # Token repeated in name.
+            names.discard(name)
+            if names:
+                continue
+
+            del self.token_names[token]
+            self.match_cache.clear()
+            for trigram in trigrams(f" {token} "):
+                self.token_trigrams[trigram].discard(token)
+                if not self.token_trigrams[trigram]:
+                    del self.token_trigrams[trigram]
+            remove_sorted(self.sorted_tokens, token)
+            for deleted in deletions(token):
+                remove_sorted(self.sorted_deletions, f"{deleted}\0{token}")
+
+    def match_token(self, query_token: str) -> TokenMatches:
+        """Finds the indexed tokens matching a query token.
+
+        Args:
+            query_token (str): Normalized query word.
+
+        Returns:
+            TokenMatches: Matching tokens and the cost of the match.
+        """
+        if query_token in self.match_cache:
+            return self.match_cache[query_token]
+
+        tokens_by_cost = defaultdict(list)
+
+        # Exact and prefix matches are contiguous in the sorted tokens.
+        start = bisect.bisect_left(self.sorted_tokens, query_token)
+        end = bisect.bisect_left(self.sorted_tokens, query_token + "\U0010ffff", start)
+        if start < end and self.sorted_tokens[start] == query_token:
+            tokens_by_cost[EXACT_COST].append(query_token)
+            start += 1
+        tokens_by_cost[PREFIX_COST].extend(self.sorted_tokens[start:end])
+
+        if len(query_token) >= 3:
+            postings = sorted(
+                (
+                    self.token_trigrams.get(trigram, set())
+                    for trigram in trigrams(query_token)
+                ),
+                key=len,
+            )
+            if postings[0]:
+                tokens_by_cost[SUBSTRING_COST].extend(
+                    token
+                    for token in set.intersection(*postings)
+                    if query_token in token and not token.startswith(query_token)
+                )
+        else:
+            # Too short for the trigrams: these are rare, and cached.
+            tokens_by_cost[SUBSTRING_COST].extend(
+                token
+                for token in self.sorted_tokens
+                if query_token in token and not token.startswith(query_token)
+            )
+
+        if len(query_token) >= self.MIN_TYPO_LENGTH:
+            # Tokens one edit away share a deletion with the query token,
+            # or one of them is a deletion of the other.
+            candidates = set(self.tokens_with_deletion(query_token))
+            for deleted in deletions(query_token):
+                candidates.update(self.tokens_with_deletion(deleted))
+                if deleted in self.token_names:
+                    candidates.add(deleted)
+            tokens_by_cost[TYPO_COST].extend(
+                token
+                for token in candidates
+                if query_token not in token
+                and bounded_edit_distance(query_token, token, 1) == 1
+            )
+
+        if (
+            not any(tokens_by_cost.values())
+            and len(query_token) >= self.MIN_TWO_TYPOS_LENGTH
+        ):
+            # Last resort for long words: candidates share most of their
+            # trigrams with the query token, an edit changing at most 3.
+            query_trigrams = trigrams(f" {query_token} ")
+            shared = defaultdict(int)
+            for trigram in query_trigrams:
+                for token in self.token_trigrams.get(trigram, ()):
+                    shared[token] += 1
+            for token, count in shared.items():
+                if count >= len(query_trigrams) - 6:
+                    distance = bounded_edit_distance(query_token, token, 2)
+                    if distance <= 2:
+                        tokens_by_cost[TYPO_COST * distance].append(token)
+
+        costs = {}
+        groups = {}
+        for cost, tokens in tokens_by_cost.items():
+            if tokens:
+                costs.update(dict.fromkeys(tokens, cost))
+                groups[cost] = tokens, sum(map(len, map(self.token_names.get, tokens)))
+
+        if len(self.match_cache) >= self.MATCH_CACHE_SIZE:
+            self.match_cache.pop(next(iter(self.match_cache)))
+        self.match_cache[query_token] = TokenMatches(costs, groups)
+        return self.match_cache[query_token]
+
+    def tokens_with_deletion(self, deleted: str) -> Iterable[str]:
+        """Tokens which give deleted when removing one of their letters."""
+        key = f"{deleted}\0"
+        position = bisect.bisect_left(self.sorted_deletions, key)
+        while position < len(self.sorted_deletions) and self.sorted_deletions[
+            position
+        ].startswith(key):
+            yield self.sorted_deletions[position][len(key) :]
+            position += 1
+
+    def names_by_recency(self, token: str) -> List[str]:
+        """Names containing token, most recently modified first."""
+        names = self.recent_names.get(token)
+        if names is None:
+            names = sorted(
+                self.token_names[token], key=self.timestamps.get, reverse=True
+            )
+            self.recent_names[token] = names
+        return names
+
+    def all_names_by_recency(self) -> List[str]:
+        """All the names, most recently modified first."""
+        if self.recent_all is None:
+            self.recent_all = sorted(
+                self.timestamps, key=self.timestamps.get, reverse=True
+            )
+        return self.recent_all
+
+    def search(self, query: str, limit: int = 50) -> List[str]:
+        """Finds the names matching query, best first.
+
+        Args:
+            query (str): Words to look for, in any order.
+            limit (int, optional): Maximum number of results.
+
+        Returns:
+            List[str]: Matching names.
+        """
+        query_tokens = list(dict.fromkeys(tokenize(query)))
+        if not query_tokens:
+            return []
+
+        token_matches = [self.match_token(token) for token in query_tokens]
+        if not all(matches.costs for matches in token_matches):
+            return []
+
+        # Candidates come from the most selective query token, the other
+        # ones are checked against the tokens of each candidate.
+        token_matches.sort(
+            key=lambda matches: sum(count for _, count in matches.groups.values())
+        )
+        first_matches = token_matches[0]
+        other_costs = [matches.costs for matches in token_matches[1:]]
+        # Lowest cost the other query tokens can add.
+        min_other_cost = sum(min(costs.values()) for costs in other_costs)
+
+        now = time.time()
+
+        def scored_names(names: Iterable[str], cost: float):
+            for name in names:
+                age = max(0.0, now - self.timestamps[name])
+                yield cost - RECENCY_WEIGHT * 0.5 ** (age / RECENCY_HALF_LIFE), name
+
+        def names_with_tokens(tokens: Set[str]):
+            for name in self.all_names_by_recency():
+                if not tokens.isdisjoint(self.name_tokens[name]):
+                    yield name
+
+        # Names of each matching token, most recent first.
+        streams = []
+        for cost, (tokens, names_count) in first_matches.groups.items():
+            # Merging the lists costs about one step per token, while scanning
+            # all the names costs one step per name for each name yielded.
+            if len(tokens) * names_count <= limit * len(self.timestamps):
+                streams.extend(
+                    scored_names(self.names_by_recency(token), cost) for token in tokens
+                )
+            else:
+                streams.append(scored_names(names_with_tokens(set(tokens)), cost))
+
+        # The candidates come by increasing partial score, which the other
+        # query tokens can only increase: once limit candidates have a
+        # better score than the next partial score, the search is over.
+        candidates = []
+        worst_scores = []  # Negated scores of the best candidates so far.
+        seen = set()
+        for score, name in heapq.merge(*streams):
+            if len(worst_scores) >= limit and score + min_other_cost > -worst_scores[0]:
+                break
+            if name in seen:
+                continue
+            seen.add(name)
+
+            for costs in other_costs:
+                cost = min(
+                    (costs[t] for t in self.name_tokens[name] if t in costs),
+                    default=None,
+                )
+                if cost is None:
+                    break
+                score += cost
+            else:
+                candidates.append((score, len(name), name))
+                if len(worst_scores) < limit:
+                    heapq.heappush(worst_scores, -score)
+                elif score < -worst_scores[0]:
+                    heapq.heapreplace(worst_scores, -score)
+
+        return [name for _, _, name in heapq.nsmallest(limit, candidates)]
+
+
+def benchmark(count: int = 100000):
+    """Measures the query time over generated names.
+
+    Args:
+        count (int, optional): Number of names to index.
+    """
+    syllables = ["du", "pon", "le", "fè", "vre", "gau", "thier", "ma", "rin", "bœuf",
+                 "mül", "ler", "na", "der", "ro", "ché", "ber", "nard", "pe", "tit"]
+    first_names = ["Éloïse", "Jean", "Zoé", "François", "Hélène", "Noël", "Inès",
+                   "Léa", "Chloé", "Joseph", "Anaïs", "Loïc", "Maëlle", "Céline"]
+    now = time.time()
+    names = {}
+    while len(names) < count:
+        last_name = "".join(random.choices(syllables, k=random.randint(2, 4)))
+        first_name = random.choice(first_names)
+        name = f"{last_name.upper()} {first_name} {random.randint(1940, 2020)}"
+        names[name] = now - random.uniform(0, 365 * 24 * 3600)
+
+    engine = SearchEngine()
+    start = time.perf_counter()
+    engine.build(names)
+    print(f"{count} names indexed in {1000 * (time.perf_counter() - start):.0f} ms")
+
+    samples = [normalize(name).split() for name in random.sample(list(names), 3)]
+    queries = [
+        "eloise",
+        "xyz",
+        # Accent-less last name and first name.
+        f"{samples[0][0]} {samples[0][1]}",
+        # Last name being typed.
+        samples[1][0][:6],
+        # Last name with its last two letters swapped.
+        samples[2][0][:-2] + samples[2][0][:-3:-1],
+    ]
+    for query in queries:
+        # Query typed letter by letter.
+        elapsed = []
+        for length in range(1, len(query) + 1):
+            start = time.perf_counter()
+            results = engine.search(query[:length])
+            elapsed.append(time.perf_counter() - start)
+        print(
+            f"{query!r}: {len(results)} results in {1000 * elapsed[-1]:.2f} ms, "
+            f"{1000 * sum(elapsed) / len(elapsed):.2f} ms/keystroke {results[:3]}"
+        )
+
+
+if __name__ == "__main__":
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,225 @@
+"""
+Persistent thumbnail cache used by the image gallery.
+
+Thumbnails are stored inside each patient folder, under `.epanouident/thumbs`,
+and are content-addressed by the source path, its modification time and size.
+A small in-memory LRU sits in front of the disk cache, and the disk cache is
+trimmed by evicting the least recently used thumbnails.
+"""
+
+import cv2
+import hashlib
+import numpy as np
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from backend.preview_loader import load_preview
+from backend.utils import evict_least_recently_used
+
+CACHE_DIR_NAME = ".epanouident"
+THUMBNAILS_DIR_NAME = "thumbs"
+
+
+class ThumbnailCache:
+    """Two level (memory + disk) cache of image thumbnails.
+
+    It is thread-safe, so it can be used from the gallery loading threads.
+    """
+
+    THUMBNAIL_SIZE = 300  # Longest side of a thumbnail, in pixels.
+    MAX_MEMORY_ENTRIES = 1024
+    MAX_DISK_BYTES = 256 * 1024 * 1024  # Per patient folder.
+    JPEG_QUALITY = 85
+
+    def __init__(
+        self,
+        thumbnail_size: int = THUMBNAIL_SIZE,
+        max_memory_entries: int = MAX_MEMORY_ENTRIES,
+        max_disk_bytes: int = MAX_DISK_BYTES,
+    ):
+        """Constructor
+
+        Args:
+            thumbnail_size (int, optional): Longest side of the thumbnails.
+            max_memory_entries (int, optional): Number of thumbnails kept in memory.
+            max_disk_bytes (int, optional): Size limit of each on-disk cache folder.
+        """
+        self.thumbnail_size = thumbnail_size
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def cache_directory(image_path: str) -> str:
+        """Returns the thumbnails directory of the folder containing image_path."""
+        return os.path.join(
+            os.path.dirname(os.path.abspath(image_path)),
+            CACHE_DIR_NAME,
+            THUMBNAILS_DIR_NAME,
+        )
+
+    def key(self, image_path: str) -> Optional[str]:
+        """Computes the cache key of an image file.
+
+        Args:
+            image_path (str): Path to the image.
+
+        Returns:
+            Optional[str]: The key, None if the file can't be accessed.
+        """
+        try:
+            stat = os.stat(image_path)
+        except OSError:
+            return None
+
+        identity = (
+            f"{os.path.abspath(image_path)}|{stat.st_mtime_ns}|{stat.st_size}"
+            f"|{self.thumbnail_size}"
+        )
+        return hashlib.sha1(identity.encode("utf-8")).hexdigest()
+
+    def get(self, image_path: str) -> Optional[np.ndarray]:
+        """Returns the cached thumbnail of image_path if any.
+
+        Args:
+            image_path (str): Path to the original image.
+        """
+        key = self.key(image_path)
+        if key is None:
+            return None
+
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                return self.memory[key]
+
+        thumbnail_path = os.path.join(self.cache_directory(image_path), f"{key}.jpg")
+        try:
+            with open(thumbnail_path, "rb") as f:
+                data = np.frombuffer(f.read(), dtype=np.uint8)
+            # Mark it as recently used for the disk eviction.
+            os.utime(thumbnail_path)
+        except OSError:
+            return None
+
+        thumbnail = cv2.imdecode(data, cv2.IMREAD_COLOR)
+        if thumbnail is not None:
+            self.remember(key, thumbnail)
+        return thumbnail
+
+    def put(self, image_path: str, thumbnail: np.ndarray):
+        """Stores the thumbnail of image_path in memory and on disk.
+        Read-only folders are silently kept in memory only.
+
+        Args:
+            image_path (str): Path to the original image.
+            thumbnail (np.ndarray): Thumbnail to store.
+        """
+        key = self.key(image_path)
+        if key is None:
+            return
+
+        self.remember(key, thumbnail)
+
+        ret, data = cv2.imencode(
+            ".jpg", thumbnail, [cv2.IMWRITE_JPEG_QUALITY, self.JPEG_QUALITY]
+        )
+        if not ret:
+            return
+
+        directory = self.cache_directory(image_path)
+        thumbnail_path = os.path.join(directory, f"{key}.jpg")
+        tmp_path = f"{thumbnail_path}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(directory, exist_ok=True)
+            with open(tmp_path, "wb") as f:
+                f.write(data.tobytes())
+            os.replace(tmp_path, thumbnail_path)
+        except OSError:
+            return
+
+    def get_or_create(self, image_path: str) -> Optional[np.ndarray]:
+        """Returns the thumbnail of image_path, creating it if not cached.
+
+        Args:
+            image_path (str): Path to the original image.
+
+        Returns:
+            Optional[np.ndarray]: BGR thumbnail, None if the file isn't an image.
+        """
+        thumbnail = self.get(image_path)
+        if thumbnail is not None:
+            return thumbnail
+
+        img = load_preview(image_path, self.thumbnail_size)
+        if img is None:
+            return None
+
+        thumbnail = self.resize(img)
+        self.put(image_path, thumbnail)
+        return thumbnail
+
+    def resize(self, img: np.ndarray) -> np.ndarray:
+        """Downscales img so its longest side is the thumbnail size."""
+        height, width = img.shape[:2]
+        scale = self.thumbnail_size / max(height, width)
+        if scale >= 1:
+            return img
+
+        return cv2.resize(
+            img,
+            (max(1, round(width * scale)), max(1, round(height * scale))),
+            interpolation=cv2.INTER_AREA,
+        )
+
+    def remember(self, key: str, thumbnail: np.ndarray):
+        """Adds a thumbnail to the in-memory LRU."""
+        with self.lock:
+            self.memory[key] = thumbnail
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.max_memory_entries:
+                self.memory.popitem(last=False)
+
+    def trim(self, directory: str):
+        """Evicts least recently used thumbnails of a patient folder
+        until the disk cache fits in max_disk_bytes.
+
+        Args:
+            directory (str): Patient folder.
+        """
+        evict_least_recently_used(
+            os.path.join(directory, CACHE_DIR_NAME, THUMBNAILS_DIR_NAME),
+            self.max_disk_bytes,
+        )
+
+
+_thumbnail_cache = None
+
+
+def get_thumbnail_cache() -> ThumbnailCache:
+    """Returns the application-wide thumbnail cache.
+    Limits can be configured with EPANOUIDENT_THUMBNAIL_CACHE_MB and
+    EPANOUIDENT_THUMBNAIL_MEMORY_ENTRIES environment variables.
+    """
+    global _thumbnail_cache
+    if _thumbnail_cache is None:
+        _thumbnail_cache = ThumbnailCache(
+            max_memory_entries=int(
+                os.environ.get(
+                    "EPANOUIDENT_THUMBNAIL_MEMORY_ENTRIES",
+                    ThumbnailCache.MAX_MEMORY_ENTRIES,
+                )
+            ),
+            max_disk_bytes=int(
+                os.environ.get(
+                    "EPANOUIDENT_THUMBNAIL_CACHE_MB",
+                    ThumbnailCache.MAX_DISK_BYTES // (1024 * 1024),
+                )
+            )
+            * 1024
+            * 1024,
+        )
+    return _thumbnail_cache
@@ -0,0 +1,124 @@
+"""
+Multi-resolution tile pyramid of an image.
+
+Level 0 is the image itself, each next level is half the size of the
+previous one, down to a single tile. A view zoomed out draws the tiles of a
+small level, a view zoomed in draws the few tiles of level 0 it shows: the
+cost of a frame depends on the size of the view, not on the size of the
+image. Levels are computed the first time they are needed and kept.
+"""
+
+import cv2
+import itertools
+import math
+import numpy as np
+from PySide6.QtCore import QRectF
+from typing import Iterator, List, Tuple
+
+TILE_SIZE = 256
+
+# Distinguishes the tiles of the pyramids in a cache.
+pyramid_keys = itertools.count()
+
+
+class TilePyramid:
+    """Pyramid of an image, split in tiles of TILE_SIZE pixels."""
+
+    levels: List[np.ndarray]  # Level n is 2**n times smaller than level 0.
+    scale: float  # Pixels of level 0 per full resolution pixel.
+
+    def __init__(self, image: np.ndarray, scale: float = 1.0, tile_size=TILE_SIZE):
+        """Constructor
+
+        Args:
+            image (np.ndarray): BGR or BGRA image, not modified nor copied.
+            scale (float, optional): Pixels of the image per full resolution
+                                     pixel, e.g. for a proxy of the image.
+                                     Defaults to 1.0.
+            tile_size (int, optional): Size of the tiles. Defaults to TILE_SIZE.
+        """
+        self.key = next(pyramid_keys)
+        self.levels = [image]
+        self.scale = scale
+        self.tile_size = tile_size
+        height, width = image.shape[:2]
+        self.level_count = 1 + max(
+            0, math.ceil(math.log2(max(width, height, 1) / tile_size))
+        )
+
+    @property
+    def width(self) -> float:
+        """Width of the full resolution image."""
+        return self.levels[0].shape[1] / self.scale
+
+    @property
+    def height(self) -> float:
+        """Height of the full resolution image."""
+        return self.levels[0].shape[0] / self.scale
+
+    def level_image(self, level: int) -> np.ndarray:
+        """Image of a level, computed from the previous levels if needed."""
+        while len(self.levels) <= level:
+            self.levels.append(cv2.pyrDown(self.levels[-1]))
+        return self.levels[level]
+
+    def level_scale(self, level: int) -> float:
+        """Pixels of a level per full resolution pixel."""
+        return self.scale / 2**level
+
+    def level_for(self, zoom: float) -> int:
+        """Smallest level with at least zoom pixels per full resolution pixel,
+        so that its tiles are never enlarged unless level 0 is.
+
+        Args:
+            zoom (float): Displayed pixels per full resolution pixel.
+        """
+        if zoom <= 0:
+            return self.level_count - 1
+        level = math.floor(math.log2(self.scale / zoom))
+        return min(max(level, 0), self.level_count - 1)
+
+    def tiles(self, level: int, rect: QRectF) -> Iterator[Tuple[int, int]]:
+        """Columns and rows of the tiles of a level overlapping an area.
+
+        Args:
+            level (int): Level of the tiles.
+            rect (QRectF): Area, in full resolution coordinates.
+        """
+        height, width = self.level_image(level).shape[:2]
+        size = self.tile_size / self.level_scale(level)
+        columns = math.ceil(width / self.tile_size)
+        rows = math.ceil(height / self.tile_size)
+        first_column = max(0, int(rect.left() // size))
+        last_column = min(columns - 1, int(rect.right() // size))
+        first_row = max(0, int(rect.top() // size))
+        last_row = min(rows - 1, int(rect.bottom() // size))
+        for column in range(first_column, last_column + 1):
+            for row in range(first_row, last_row + 1):
+                yield column, row
+
+    def tile(self, level: int, column: int, row: int) -> Tuple[np.ndarray, QRectF]:
+        """Pixels of a tile and its area.
+
+        Args:
+            level (int): Level of the tile.
+            column (int): Column of the tile.
+            row (int): Row of the tile.
+
+        Returns:
+            Tuple[np.ndarray, QRectF]: Contiguous copy of the tile, and its
+                                       area in full resolution coordinates.
+        """
+        size = self.tile_size
+        tile = np.ascontiguousarray(
+            self.level_image(level)[
+                row * size : (row + 1) * size, column * size : (column + 1) * size
+            ]
+        )
+        scale = self.level_scale(level)
+        return tile, QRectF(
+            column * size / scale,
+            row * size / scale,
+            tile.shape[1] / scale,
+            tile.shape[0] / scale,
+        )
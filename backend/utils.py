@@ -2,21 +2,59 @@
 This file contains global helper functions used in the project.
 """
 
-from itertools import compress
+import os
+import re
 from typing import List
 
 
-def match_pattern_in_list(folder_list: List[str], pattern: str) -> List[str]:
-    """This function finds the matching string in pattern.
-    The matching is case-insensitive.
+def evict_least_recently_used(directory: str, max_bytes: int) -> int:
+    """Deletes the least recently used files of a directory until its
+    total size fits in max_bytes. File modification time is used as the
+    last access time, so readers should touch the files they use.
 
     Args:
-        list (List[str]): List of strings to search from.
-        pattern (str): Pattern to search for in list
+        directory (str): Directory to trim.
+        max_bytes (int): Maximum total size of the files, in bytes.
+
+    Returns:
+        int: Number of bytes freed.
+    """
+    try:
+        entries = [entry for entry in os.scandir(directory) if entry.is_file()]
+    except OSError:
+        return 0
+
+    files = []
+    for entry in entries:
+        try:
+            stat = entry.stat()
+        except OSError:
+            continue
+        files.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total = sum(size for _, size, _ in files)
+    freed = 0
+    for _, size, path in sorted(files):
+        if total - freed <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            freed += size
+        except OSError:
+            continue
+
+    return freed
+
+
+def natural_sort_key(name: str) -> List:
+    """Sort key ordering numbers by value, so that "DSC_2.JPG"
+    comes before "DSC_10.JPG". The comparison is case-insensitive.
+
+    Args:
+        name (str): String to compute the key of.
     """
-    if len(folder_list) > 0 and pattern not in [None, ""]:
-        filter = [pattern.lower() == f.lower() for f in folder_list]
-        if any(filter):
-            return list(compress(folder_list, filter))
-    else:
-        return []
+    return [
+        (0, int(part), "") if part.isdigit() else (1, 0, part)
+        for part in re.split(r"(\d+)", name.lower())
+        if part
+    ]
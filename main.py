@@ -6,15 +6,25 @@ from PySide6.QtCore import QSize
 from PySide6.QtWidgets import QApplication
 
 from ui.pages.main_page import MainPage
+from backend.background_removal_worker import shutdown_background_removal_worker
 
+import logging
+import multiprocessing
 import os
 import sys
 
 if __name__ == "__main__":
+    # Worker processes of the frozen executable start here.
+    multiprocessing.freeze_support()
+    logging.basicConfig(
+        level=os.environ.get("EPANOUIDENT_LOG_LEVEL", "INFO"),
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+    )
     app = QApplication(sys.argv)
     base_path = os.path.join(os.path.abspath(__file__), os.path.dirname(__file__))
     window = MainPage(title="EpanouiDent", size=QSize(1280, 800), base_path=base_path)
     window.show()
     app.exec()
 
-    window.downloader_thread.process.kill()
+    window.downloader_thread.stop()
+    shutdown_background_removal_worker()
@@ -14,16 +14,17 @@ from PySide6.QtWidgets import (
     QPushButton,
     QSizePolicy,
     QLabel,
+    QProgressBar,
 )
 from PySide6.QtGui import QIcon
-from typing import List
+from typing import List, Optional
 
+from backend.background_removal_worker import get_background_removal_worker
 from ui.widgets.gallery import Gallery
-from backend.utils import match_pattern_in_list
 
 class GalleryPage(QWidget):
-    """Gallery image page containing a scrolling area in which
-    we have an image gallery and a directory selector.
+    """Gallery image page containing an image gallery (which scrolls
+    by itself) and a directory selector.
 
     Args:
         QWidget (_type_): _description_
@@ -32,28 +33,39 @@ class GalleryPage(QWidget):
     double_click_signal = Signal(str)
     collage_click_signal = Signal(list)
 
-    scroll_area: QScrollArea
     gallery_preview: Gallery
     button_explore: QPushButton
+    batch_id: Optional[int]  # Running background removal batch.
 
     def __init__(self):
         """Constructor"""
         super().__init__()
 
         self.directory_name = None
+        self.images_selected = []
+        self.batch_id = None
 
         layout = QVBoxLayout()
         h_layout = QHBoxLayout()
         self.collage_button = QPushButton("Collage")
         self.collage_button.setVisible(False)
         self.collage_button.clicked.connect(self.create_collage_page)
-        self.scroll_area = QScrollArea()
-        self.scroll_area.setWidgetResizable(True)  # Make the scroll area resizable
+        self.background_button = QPushButton("Remove backgrounds")
+        self.background_button.setVisible(False)
+        self.background_button.clicked.connect(self.background_button_clicked)
+        self.background_progress = QProgressBar()
+        self.background_progress.setVisible(False)
+        self.background_label = QLabel()
+        self.background_label.setVisible(False)
         self.gallery_preview = Gallery("")
-        self.scroll_area.setWidget(self.gallery_preview)
+
+        h_layout.addWidget(self.background_button)
+        h_layout.addWidget(self.background_progress)
+        h_layout.addWidget(self.background_label)
 
         layout.addWidget(self.collage_button)
-        layout.addWidget(self.scroll_area)
+        layout.addLayout(h_layout)
+        layout.addWidget(self.gallery_preview)
 
         self.setLayout(layout)
 
@@ -63,10 +75,16 @@ class GalleryPage(QWidget):
         self.gallery_preview.show_collage_button_signal.connect(
             self.show_collage_button
         )
+        worker = get_background_removal_worker()
+        worker.batch_progress.connect(self.background_removal_progress)
+        worker.batch_finished.connect(self.background_removal_finished)
 
     def image_selected(self, list_of_names: List[str]):
         """Image selection event."""
         self.images_selected = list_of_names
+        self.background_button.setVisible(
+            self.batch_id is not None or len(list_of_names) > 0
+        )
 
     def image_double_clicked(self, filename):
         """Image double clicked event."""
@@ -91,3 +109,61 @@ class GalleryPage(QWidget):
     def create_collage_page(self):
         """Collage button clicked"""
         self.collage_click_signal.emit(self.images_selected)
+
+    def background_button_clicked(self):
+        """Removes the backgrounds of the selected images, or cancels the
+        running batch.
+        """
+        worker = get_background_removal_worker()
+        if self.batch_id is not None:
+            worker.cancel_batch(self.batch_id)
+            return
+
+        if not self.images_selected:
+            return
+        self.batch_id = worker.request_batch(list(self.images_selected))
+        self.background_button.setText("Cancel")
+        self.background_progress.setRange(0, len(self.images_selected))
+        self.background_progress.setValue(0)
+        self.background_progress.setVisible(True)
+        self.background_label.setText("")
+        self.background_label.setVisible(True)
+
+    def background_removal_progress(
+        self, batch_id: int, processed: int, total: int, images_per_second: float
+    ):
+        """Batch progress signal callback.
+
+        Args:
+            batch_id (int): Batch sent from the background removal worker.
+            processed (int): Pictures done so far, failed ones included.
+            total (int): Pictures of the batch.
+            images_per_second (float): Throughput of the batch so far.
+        """
+        if batch_id != self.batch_id:
+            return
+        self.background_progress.setRange(0, total)
+        self.background_progress.setValue(processed)
+        self.background_label.setText(
+            f"{processed}/{total}, {images_per_second:.1f} pictures/s"
+        )
+
+    def background_removal_finished(self, batch_id: int, written: int, failed: int):
+        """Batch finished signal callback.
+
+        Args:
+            batch_id (int): Batch sent from the background removal worker.
+            written (int): Pictures written without their background.
+            failed (int): Pictures that couldn't be processed, or were cancelled.
+        """
+        if batch_id != self.batch_id:
+            return
+        self.batch_id = None
+        self.background_button.setText("Remove backgrounds")
+        self.background_button.setVisible(len(self.images_selected) > 0)
+        self.background_progress.setVisible(False)
+        text = f"{written} backgrounds removed"
+        if failed:
+            text += f", {failed} failed"
+        self.background_label.setText(text)
+        self.sync_diff()
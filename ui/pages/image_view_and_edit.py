@@ -51,11 +51,16 @@ class ImageViewEdit(QWidget):
         self.scroll_area.setWidgetResizable(True)
 
         self.image_container = ImageContainer(base_path)
-        self.image_container.background_image_generated.connect(self.enable_background_removal_button)
+        self.image_container.background_image_generated.connect(
+            self.background_removal_finished
+        )
         self.scroll_area.setWidget(self.image_container)
 
         self.image_edit_menu = ImageEditMenu()
         self.image_edit_menu.channel_gain_signal.connect(self.channel_gain_changed)
+        self.image_edit_menu.channel_gain_released_signal.connect(
+            self.channel_gain_released
+        )
         self.image_edit_menu.draw_rectangle_signal.connect(
             self.enable_drawing_rectangle
         )
@@ -92,10 +97,16 @@ class ImageViewEdit(QWidget):
 
         self.setLayout(layout)
         self.setFocusPolicy(Qt.StrongFocus)
+        self.image_edit_menu.remove_background_button.setEnabled(
+            self.image_container.pipeline is not None
+        )
 
-    def enable_background_removal_button(self, flag: bool):
-        """Enable removing background button"""
-        self.image_edit_menu.remove_background_button.setEnabled(flag)
+    def background_removal_finished(self, flag: bool):
+        """Unchecks removing background button if the background couldn't be
+        removed.
+        """
+        if not flag:
+            self.image_edit_menu.remove_background_button.setChecked(False)
 
     def paint_brush_size_changed(self, new_brush_size: int):
         """Change paint brush size.
@@ -179,12 +190,20 @@ class ImageViewEdit(QWidget):
         self.image_container.rotate_counter_clockwise()
 
     def channel_gain_changed(self, value: int):
-        """Channel gain changed event handler.
+        """Channel gain changed event handler, while the slider moves.
 
         Args:
             sender (str): Slider name in menu.
             value (int): New value of the slider
         """
+        self.image_container.preview_channel_gains(value[:3])
+
+    def channel_gain_released(self, value: list):
+        """Channel gain slider released event handler.
+
+        Args:
+            value (list): Values of the sliders (R, G, B).
+        """
         self.image_container.apply_channel_gains(value[:3])
 
     # def save_image(self):
@@ -198,7 +217,7 @@ class ImageViewEdit(QWidget):
             self, "Save File", os.path.dirname(self.base_path)
         )
 
-        ret = self.image_container.current_pixmap.toImage().save(
+        ret = self.image_container.export_image().save(
             os.path.join(os.path.dirname(self.base_path), file_name[0])
         )
 
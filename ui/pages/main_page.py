@@ -5,6 +5,7 @@ Main page of EpanouiDent.
 from typing import List
 import os
 import shutil
+import time
 
 from PySide6.QtWidgets import (
     QMainWindow,
@@ -24,7 +25,7 @@ from PySide6.QtWidgets import (
 
 )
 from PySide6.QtWidgets import QHBoxLayout, QVBoxLayout
-from PySide6.QtCore import QSize, Qt, QStringListModel
+from PySide6.QtCore import QSize, Qt, QStringListModel, QTimer
 
 from ui.pages.image_view_and_edit import ImageViewEdit
 from ui.pages.gallery import GalleryPage
@@ -32,9 +33,8 @@ from ui.widgets.gallery import Gallery
 from ui.widgets.collage import CollagePreview
 
 from backend.background_downloader import ImageDownloaderThread
-from backend.airmtp_log_analyzer import AirMTPLogAnalyzer
-
-from backend.utils import match_pattern_in_list
+from backend.folder_index import FolderIndex, FolderIndexBuilder
+from backend.folder_watcher import FolderWatcher
 
 
 class MainPage(QMainWindow):
@@ -44,10 +44,15 @@ class MainPage(QMainWindow):
     """
 
     gallery_page: GalleryPage
+    folder_index: FolderIndex
+    folder_index_ready: bool
+    folder_watcher: FolderWatcher
     opened_tab: int
     camera_model: str
     camera_serial: str
 
+    SEARCH_DEBOUNCE_MS = 150
+
     def __init__(self, title: str, size: QSize, base_path: str):
         """Constructor"""
         super().__init__()
@@ -58,7 +63,15 @@ class MainPage(QMainWindow):
         else:
             self.default_path = os.environ["EPANOUIDENT_DEFAULT_PATH"]
 
-        self.folders_list = os.listdir(self.default_path)
+        # Patient folders are listed and indexed once in the background,
+        # then the watcher keeps the index up to date.
+        self.folder_index = FolderIndex()
+        self.folder_index_ready = False
+        self.folder_watcher = FolderWatcher(lambda entry: entry.is_dir())
+        self.folder_watcher.files_changed.connect(self.folders_changed)
+        self.folder_index_builder = FolderIndexBuilder(self.default_path)
+        self.folder_index_builder.index_built.connect(self.folder_index_built)
+        self.folder_index_builder.start()
 
         self.opened_tab = 0
         self.base_path = base_path
@@ -85,6 +98,11 @@ class MainPage(QMainWindow):
         font_size = self.path_search.fontInfo().pixelSize()
         self.path_search.setFixedHeight(2.5 * font_size)
         self.path_search.textChanged.connect(self.path_search_text_change)
+        # Searching waits for a pause in typing.
+        self.search_timer = QTimer()
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(self.SEARCH_DEBOUNCE_MS)
+        self.search_timer.timeout.connect(self.search_folders)
         self.path_cleared = False
         self.completer = QCompleter(self.path_search)
         self.completer.setWidget(self.path_search)  # Attach completer to QTextEdit
@@ -147,16 +165,11 @@ class MainPage(QMainWindow):
 
         # Image Downloader Thread
         self.downloader_thread = ImageDownloaderThread()
+        self.downloader_thread.camera_detected.connect(self.camera_detected)
+        self.downloader_thread.camera_disconnected.connect(self.camera_disconnected)
+        self.downloader_thread.download_signal.connect(self.picture_downloaded)
         self.downloader_thread.start()
 
-        self.airmtp_log_analyzer_thread = AirMTPLogAnalyzer()
-        self.airmtp_log_analyzer_thread.camera_detected.connect(self.camera_detected)
-        self.airmtp_log_analyzer_thread.camera_disconnected.connect(
-            self.camera_disconnected
-        )
-        self.airmtp_log_analyzer_thread.download_signal.connect(self.picture_downloaded)
-        self.airmtp_log_analyzer_thread.start()
-
     def camera_detected(self, camera_model: str, serial_number: str):
         """Handler of camera detection signal.
 
@@ -218,6 +231,10 @@ class MainPage(QMainWindow):
         Args:
             index (int): Index of the tab being closed
         """
+        tab = self.tab_widget.widget(index)
+        if isinstance(tab, ImageViewEdit):
+            # Its background doesn't need to be removed anymore.
+            tab.image_container.cancel_background_removal()
         if index == 0 and self.opened_tab == 0:
             self.tab_widget.setStyleSheet(
                 "background-image: url(logo.png); background-repeat: no-repeat; background-position: center;"
@@ -257,11 +274,16 @@ class MainPage(QMainWindow):
             self.path_search.setText("")
             self.path_search.clear()
 
+        self.search_timer.start()
+
+    def search_folders(self):
+        """Shows the patient folders matching the text typed."""
         text = self.path_search.toPlainText().strip()
-        if os.path.exists(self.default_path) and text != "":
+        # Until the index is built, folder_index_built() runs the search.
+        if self.folder_index_ready and text != "":
             matches = [
-                os.path.join(self.default_path, f) for f in os.listdir(self.default_path)
-                if text.lower() in f.lower()
+                os.path.join(self.default_path, f)
+                for f in self.folder_index.search(text)
             ]
 
             if len(matches) >= 1:
@@ -341,7 +363,7 @@ class MainPage(QMainWindow):
         if response == QMessageBox.Yes:
             os.makedirs(new_directory)#, exist_ok=True)
 
-            self.update_folders_list()
+            self.update_folders_list(os.path.basename(new_directory))
 
             if not self.gallery_page:
                 self.tab_widget.setStyleSheet("")
@@ -361,6 +383,47 @@ class MainPage(QMainWindow):
         elif response == QMessageBox.No:
             return
 
-    def update_folders_list(self):
-        """Updates folder list in case new folders are created"""
-        self.folders_list = os.listdir(self.default_path)
+    @property
+    def folders_list(self) -> List[str]:
+        """Names of the patient folders."""
+        return list(self.folder_index)
+
+    def update_folders_list(self, new_folder: str = None):
+        """Updates folder list in case new folders are created
+
+        Args:
+            new_folder (str, optional): Name of the folder just created. It's added
+                                        right away, other changes are picked up by
+                                        the next scan.
+        """
+        if new_folder:
+            self.folder_index.add(new_folder, time.time())
+        self.folder_watcher.schedule_scan()
+
+    def folder_index_built(self, folder_index: FolderIndex, snapshot: dict):
+        """Background indexing of the patient folders is done.
+
+        Args:
+            folder_index (FolderIndex): Index of the patient folders.
+            snapshot (dict): Sub-folders of the default path.
+        """
+        self.folder_index = folder_index
+        self.folder_index_ready = True
+        self.folder_watcher.watch(self.default_path, snapshot)
+
+        # Run the search typed while the index was being built.
+        self.search_folders()
+
+    def folders_changed(
+        self, added: List[str], removed: List[str], modified: List[str]
+    ):
+        """Folder watcher callback, keeps the folder index up to date.
+
+        Args:
+            added (List[str]): Paths of new folders.
+            removed (List[str]): Paths of deleted folders.
+            modified (List[str]): Paths of modified folders.
+        """
+        self.folder_index.apply_changes(
+            self.folder_watcher.snapshot, added, removed, modified
+        )
@@ -2,6 +2,13 @@
 Importing widgets
 """
 
-from . import before_after_widget, image_container, gallery, image_preview, collage
+from . import before_after_widget, image_container, gallery, gallery_model, image_preview, collage
 
-__all__ = ["before_after_widget", "image_container", "gallery", "ImagePreview", "collage"]
+__all__ = [
+    "before_after_widget",
+    "image_container",
+    "gallery",
+    "gallery_model",
+    "ImagePreview",
+    "collage",
+]
@@ -9,6 +9,7 @@ from PySide6.QtCore import *
 from PySide6.QtWidgets import QWidget, QLabel, QSlider, QVBoxLayout, QHBoxLayout
 from PySide6.QtGui import QPixmap, QDropEvent, QDragEnterEvent, QImageReader, QImage
 from backend.background_removal import remove_background
+from backend.image_loader_pool import get_image_loader_pool, PRIORITY_INTERACTIVE
 
 
 class BeforeAfter(QWidget):
@@ -39,8 +40,22 @@ class BeforeAfter(QWidget):
         """
         super().__init__()
         if os.path.exists(image_path_after) and os.path.exists(image_path_before):
-            self.image_before = cv2.imread(image_path_before, cv2.IMREAD_COLOR)
-            self.image_after = cv2.imread(image_path_after, cv2.IMREAD_COLOR)
+            # Decode both images in parallel.
+            pool = get_image_loader_pool()
+            future_before = pool.submit(
+                cv2.imread,
+                image_path_before,
+                cv2.IMREAD_COLOR,
+                priority=PRIORITY_INTERACTIVE,
+            )
+            future_after = pool.submit(
+                cv2.imread,
+                image_path_after,
+                cv2.IMREAD_COLOR,
+                priority=PRIORITY_INTERACTIVE,
+            )
+            self.image_before = future_before.result()
+            self.image_after = future_after.result()
 
             # Make sure to have (C, H, W) instead of (H, W)
             if len(self.image_before.shape) != 3:
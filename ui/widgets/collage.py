@@ -11,6 +11,8 @@ from PySide6.QtCore import *
 from PySide6.QtWidgets import QWidget, QLabel, QSlider, QVBoxLayout, QGridLayout
 from PySide6.QtGui import QPixmap, QDropEvent, QDragEnterEvent, QImageReader, QImage
 
+from backend.image_loader_pool import get_image_loader_pool, PRIORITY_INTERACTIVE
+from backend.preview_loader import load_preview
 from ui.widgets.image_preview import ImagePreview
 
 
@@ -29,6 +31,8 @@ class CollagePreview(QWidget):
     pixmap_container: QLabel
     slider: QSlider
 
+    TILE_SIZE = 1200  # Collage tiles never need the full camera resolution.
+
     def __init__(self, image_path_list: List[str]):
         """Constructor for CollagePreview widget.
 
@@ -45,9 +49,16 @@ class CollagePreview(QWidget):
 
         self.image_path_list = image_path_list
 
-        for file in self.image_path_list:
+        # Decode all the pictures in parallel.
+        futures = [
+            get_image_loader_pool().submit(
+                load_preview, file, self.TILE_SIZE, priority=PRIORITY_INTERACTIVE
+            )
+            for file in self.image_path_list
+        ]
+        for file, future in zip(self.image_path_list, futures):
             try:
-                self.images.append(cv2.imread(file, cv2.IMREAD_COLOR))
+                self.images.append(future.result())
                 self.image_names.append(file)
             except Exception as e:
                 print(e)
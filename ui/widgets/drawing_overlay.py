@@ -0,0 +1,138 @@
+"""
+Transparent layer drawn over the image of the ImageContainer.
+It paints the annotations and the shape being drawn at screen resolution,
+so drawing doesn't touch the image itself, whatever its size. Annotations
+are only flattened into the image when it's exported.
+"""
+
+from PySide6.QtCore import QEvent, QObject, QPointF, QRectF, Qt
+from PySide6.QtGui import QColor, QPainter, QPaintEvent, QPen
+from PySide6.QtWidgets import QWidget
+from typing import Optional, Tuple
+
+from backend.annotations import AnnotationLayer, Shape
+
+
+class DrawingOverlay(QWidget):
+    """Overlay covering its parent widget, mouse events go through it."""
+
+    layer: AnnotationLayer
+    shape: Optional[Shape]  # Being drawn.
+    selected_shape: Optional[Shape]
+    image_offset: QPointF  # Position of the displayed image in the widget.
+    image_scale: float  # Displayed pixels per full resolution pixel.
+
+    def __init__(self, parent: QWidget):
+        """Constructor
+
+        Args:
+            parent (QWidget): Widget displaying the image.
+        """
+        super().__init__(parent)
+        self.layer = AnnotationLayer()
+        self.shape = None
+        self.selected_shape = None
+        self.image_offset = QPointF()
+        self.image_scale = 1.0
+
+        self.setAttribute(Qt.WidgetAttribute.WA_TransparentForMouseEvents)
+        self.setAttribute(Qt.WidgetAttribute.WA_NoSystemBackground)
+        self.resize(parent.size())
+        parent.installEventFilter(self)
+
+    def eventFilter(self, watched: QObject, event: QEvent) -> bool:
+        """Follows the size of the parent widget."""
+        if watched is self.parentWidget() and event.type() == QEvent.Type.Resize:
+            self.resize(event.size())
+        return False
+
+    def set_image_geometry(self, offset: QPointF, scale: float):
+        """Sets where the image is displayed in the parent widget.
+
+        Args:
+            offset (QPointF): Top left corner of the displayed image.
+            scale (float): Displayed pixels per full resolution pixel.
+        """
+        if offset == self.image_offset and scale == self.image_scale:
+            return
+        self.image_offset = offset
+        self.image_scale = scale
+        self.update()
+
+    def to_widget(self, rect: QRectF) -> QRectF:
+        """Converts an area of the image to widget coordinates."""
+        return QRectF(
+            rect.x() * self.image_scale,
+            rect.y() * self.image_scale,
+            rect.width() * self.image_scale,
+            rect.height() * self.image_scale,
+        ).translated(self.image_offset)
+
+    def to_image(self, rect: QRectF) -> QRectF:
+        """Converts an area of the widget to image coordinates."""
+        rect = rect.translated(-self.image_offset)
+        return QRectF(
+            rect.x() / self.image_scale,
+            rect.y() / self.image_scale,
+            rect.width() / self.image_scale,
+            rect.height() / self.image_scale,
+        )
+
+    def update_shape_area(self, shape: Optional[Shape]):
+        """Schedules the repaint of the area of a shape."""
+        if shape is None:
+            return
+        if shape.kind == Shape.TEXT:
+            # Text can overflow its frame.
+            self.update()
+        else:
+            area = self.to_widget(shape.bounds()).toAlignedRect()
+            self.update(area.adjusted(-2, -2, 2, 2))
+
+    def set_annotations(self, annotations: Tuple[Shape, ...]):
+        """Sets the annotations painted over the image."""
+        annotations = tuple(annotations)
+        if annotations == self.layer.shapes:
+            return
+        # Only one shape added: only its area changes.
+        added = annotations[:-1] == self.layer.shapes
+        self.layer.set_shapes(annotations)
+        if self.selected_shape not in self.layer.shapes:
+            self.selected_shape = None
+        if added:
+            self.update_shape_area(annotations[-1])
+        else:
+            self.update()
+
+    def set_shape(self, shape: Optional[Shape]):
+        """Shows the shape being drawn, or nothing if shape is None."""
+        if shape is self.shape:
+            return
+        self.update_shape_area(self.shape)
+        self.shape = shape
+        self.update_shape_area(self.shape)
+
+    def set_selected_shape(self, shape: Optional[Shape]):
+        """Highlights an annotation, or nothing if shape is None."""
+        if shape is self.selected_shape:
+            return
+        self.update_shape_area(self.selected_shape)
+        self.selected_shape = shape
+        self.update_shape_area(self.selected_shape)
+
+    def paintEvent(self, event: QPaintEvent):
+        if not self.layer.shapes and self.shape is None:
+            return
+        with QPainter(self) as painter:
+            painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+            painter.setClipRect(event.rect())
+            if self.selected_shape is not None:
+                painter.setPen(QPen(QColor("dodgerblue"), 1, Qt.PenStyle.DashLine))
+                painter.drawRect(self.to_widget(self.selected_shape.bounds()))
+
+            painter.translate(self.image_offset)
+            # Only the annotations in the area to repaint.
+            area = self.to_image(QRectF(event.rect()))
+            self.layer.paint(painter, self.image_scale, area)
+            if self.shape is not None:
+                self.shape.paint(painter, self.image_scale)
@@ -0,0 +1,120 @@
+"""
+Coalesces the repaints of a widget into frames.
+
+Repaint requests (mouse moves, key presses, slider ticks) only schedule a
+frame: at most one frame is painted per timer tick, however many requests
+came in between. Frames requested by user interaction are painted fast,
+and a last high quality frame is painted once the interaction stops.
+
+The widget calls frame_painted() at the end of its paintEvent: a frame is
+timed from its request to the end of its painting.
+"""
+
+import logging
+import time
+from PySide6.QtCore import QObject, QTimer, Signal
+
+logger = logging.getLogger(__name__)
+
+
+class FrameScheduler(QObject):
+    """Frame scheduler with frame time and dropped frames counters."""
+
+    # Paint a frame. True for a high quality frame, False for a fast one.
+    frame_requested = Signal(bool)
+
+    FRAME_INTERVAL_MS = 16  # ~60 frames per second.
+    IDLE_DELAY_MS = 150  # Without interaction, paint a high quality frame.
+
+    frames: int
+    dropped_frames: int  # Frame intervals missed because painting was too slow.
+    coalesced_requests: int  # Requests merged into an already scheduled frame.
+    total_frame_time: float  # In seconds.
+    max_frame_time: float  # In seconds.
+
+    def __init__(self, parent: QObject = None, name: str = "frames"):
+        """Constructor
+
+        Args:
+            parent (QObject, optional): Parent object. Defaults to None.
+            name (str, optional): Name used in the logs. Defaults to "frames".
+        """
+        super().__init__(parent)
+        self.name = name
+        self.interactive = False
+        self.last_frame = 0.0
+        self.frame_start = None  # Start of the frame not painted yet.
+        self.reset_stats()
+
+        self.frame_timer = QTimer(self)
+        self.frame_timer.setSingleShot(True)
+        self.frame_timer.timeout.connect(self.paint_frame)
+
+        self.idle_timer = QTimer(self)
+        self.idle_timer.setSingleShot(True)
+        self.idle_timer.setInterval(self.IDLE_DELAY_MS)
+        self.idle_timer.timeout.connect(self.interaction_finished)
+
+    def reset_stats(self):
+        self.frames = 0
+        self.dropped_frames = 0
+        self.coalesced_requests = 0
+        self.total_frame_time = 0.0
+        self.max_frame_time = 0.0
+
+    def request(self, interactive: bool = False):
+        """Schedules a frame.
+
+        Args:
+            interactive (bool, optional): The frame follows user interaction:
+                                          paint it fast, and a high quality
+                                          one once interaction stops.
+                                          Defaults to False.
+        """
+        if interactive:
+            self.interactive = True
+            self.idle_timer.start()
+
+        if self.frame_timer.isActive():
+            self.coalesced_requests += 1
+            return
+
+        # Right away if the last frame is old enough, else on the next tick.
+        elapsed_ms = 1000 * (time.perf_counter() - self.last_frame)
+        self.frame_timer.start(max(0, int(self.FRAME_INTERVAL_MS - elapsed_ms)))
+
+    def paint_frame(self):
+        high_quality = not self.interactive
+        self.frame_start = time.perf_counter()
+        self.frame_requested.emit(high_quality)
+        self.last_frame = time.perf_counter()
+
+    def frame_painted(self):
+        """Called by the widget once it painted the frame."""
+        if self.frame_start is None:
+            # Not a scheduled frame, e.g. the window was uncovered.
+            return
+        self.last_frame = time.perf_counter()
+        frame_time = self.last_frame - self.frame_start
+        self.frame_start = None
+        self.frames += 1
+        self.total_frame_time += frame_time
+        self.max_frame_time = max(self.max_frame_time, frame_time)
+        self.dropped_frames += int(1000 * frame_time // self.FRAME_INTERVAL_MS)
+
+    def interaction_finished(self):
+        """Logs the counters of the interaction and paints a high quality frame."""
+        self.interactive = False
+        if self.frames:
+            logger.info(
+                "%s: %d frames, %.1f ms average, %.1f ms max, %d dropped, "
+                "%d requests coalesced",
+                self.name,
+                self.frames,
+                1000 * self.total_frame_time / self.frames,
+                1000 * self.max_frame_time,
+                self.dropped_frames,
+                self.coalesced_requests,
+            )
+        self.reset_stats()
+        self.request()
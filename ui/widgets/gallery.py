@@ -2,25 +2,36 @@
 The idea is to be used on a directory of images.
 """
 
-import cv2
-from multiprocessing.pool import ThreadPool
-import numpy as np
+import logging
 import os
-from PySide6.QtCore import Signal
-from PySide6.QtWidgets import QWidget, QGridLayout
-from PySide6.QtGui import QImage
+import time
+from PySide6.QtCore import QModelIndex, QPoint, Qt, Signal
+from PySide6.QtWidgets import QWidget, QListView, QVBoxLayout
 from typing import List
-from ui.widgets.image_preview import ImagePreview
+from backend.folder_watcher import FolderWatcher
+from backend.utils import natural_sort_key
+from ui.widgets.gallery_model import (
+    GalleryDelegate,
+    GalleryModel,
+    LoadError,
+    is_image_entry,
+)
+
+logger = logging.getLogger(__name__)
 
 
 class Gallery(QWidget):
-    """Main class of the image gallery."""
+    """Main class of the image gallery.
+    It's a virtualized view: only the tiles inside the viewport are painted
+    and decoded, so folders with thousands of pictures stay smooth.
+    """
 
     directory: str
-    layout: QGridLayout
-    images: List[np.ndarray]
-    image_names: List[str]
-    image_containers: List[ImagePreview]
+    view: QListView
+    model: GalleryModel
+    delegate: GalleryDelegate
+    folder_watcher: FolderWatcher
+    load_errors: List[LoadError]
     selected_images: List[str]
     standalone: bool  # Used to check if widget is inside another page or not.
 
@@ -36,11 +47,38 @@ class Gallery(QWidget):
         """
         super().__init__()
 
-        self.images = []
-        self.image_names = []
-        self.image_containers = []
+        self.load_errors = []
         self.selected_images = []
-        self.layout = QGridLayout()
+        self.load_start_time = 0
+        self.time_to_first_paint = None
+
+        self.model = GalleryModel()
+        self.model.check_state_changed.connect(self.image_selected)
+        self.model.path_renamed.connect(self.image_renamed)
+        self.model.thumbnail_shown.connect(self.thumbnail_shown)
+        self.model.load_failed.connect(self.load_errors.append)
+        self.delegate = GalleryDelegate()
+        self.folder_watcher = FolderWatcher(is_image_entry)
+        self.folder_watcher.files_changed.connect(self.files_changed)
+
+        self.view = QListView()
+        self.view.setViewMode(QListView.ViewMode.IconMode)
+        self.view.setResizeMode(QListView.ResizeMode.Adjust)
+        self.view.setMovement(QListView.Movement.Static)
+        self.view.setUniformItemSizes(True)
+        self.view.setGridSize(GalleryDelegate.TILE_SIZE)
+        self.view.setSelectionMode(QListView.SelectionMode.NoSelection)
+        self.view.setMouseTracking(True)
+        self.view.setModel(self.model)
+        self.view.setItemDelegate(self.delegate)
+        self.view.clicked.connect(self.tile_clicked)
+        self.view.doubleClicked.connect(self.image_double_clicked)
+        self.view.verticalScrollBar().valueChanged.connect(self.update_visible_range)
+
+        layout = QVBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self.view)
+        self.setLayout(layout)
 
         # Since it's showing a full directory
         self.standalone = False
@@ -50,99 +88,93 @@ class Gallery(QWidget):
             print("Directory does not exist.")
 
         if os.path.exists(self.directory):
-            self.potential_entries = os.listdir(self.directory)
-            with ThreadPool(len(self.potential_entries)) as p:
-                results = p.map(func=self.load_files, iterable=self.potential_entries)
-
             self.update_gallery()
 
-    def load_files(self, entry_name: str):
-        """Function to read entry (could be image or not) and update
-        objects internal variables.
-
-        Args:
-            entry_id (str): String containing the path of the potential entry
-        """
-        try:
-            img = cv2.imread(os.path.join(self.directory, entry_name), cv2.IMREAD_COLOR)
-            if img is not None:
-                self.images.append(img)
-                self.image_names.append(os.path.join(self.directory, entry_name))
-        except Exception as e:
-            print(e)
-            pass
+    @property
+    def image_names(self) -> List[str]:
+        """Paths of the images shown, in display order."""
+        return self.model.paths
 
     def update_gallery(self):
-        """Updatess image gallery preview."""
-        cols = 4
-
-        for id, img in enumerate(self.images):
-            i = id // cols
-            j = id % cols
-
-            q_image = QImage(
-                img,
-                img.shape[1],
-                img.shape[0],
-                img.shape[1] * 3,
-                QImage.Format_BGR888,
+        """Lists the directory, shows its images and watches it for changes."""
+        self.load_start_time = time.perf_counter()
+        self.time_to_first_paint = None
+        snapshot = self.folder_watcher.watch(self.directory)
+        self.model.set_paths(sorted(snapshot, key=natural_sort_key))
+        self.update_visible_range()
+        self.model.image_loader_pool.submit(
+            self.model.thumbnail_cache.trim, self.directory
+        )
+
+        logger.info(
+            "Gallery: %d tiles laid out in %.1f ms",
+            len(self.model.paths),
+            1000 * (time.perf_counter() - self.load_start_time),
+        )
+
+    def update_visible_range(self):
+        """Tells the model which rows are inside the viewport."""
+        viewport = self.view.viewport().rect()
+        first = self.view.indexAt(viewport.topLeft() + QPoint(1, 1))
+        last = self.view.indexAt(viewport.bottomRight() - QPoint(1, 1))
+        first_row = first.row() if first.isValid() else 0
+        last_row = last.row() if last.isValid() else self.model.rowCount() - 1
+        self.model.set_visible_range(first_row, last_row)
+
+    def resizeEvent(self, event):
+        """Resize event. More or less tiles are visible."""
+        super().resizeEvent(event)
+        self.update_visible_range()
+
+    def thumbnail_shown(self, path: str):
+        """Measures the time until the first thumbnail is shown."""
+        if self.time_to_first_paint is None:
+            self.time_to_first_paint = time.perf_counter() - self.load_start_time
+            logger.info(
+                "Gallery: first thumbnail shown after %.1f ms",
+                1000 * self.time_to_first_paint,
             )
 
-            image_container = ImagePreview(
-                id=id,
-                q_image=q_image,
-                name=self.image_names[id],
-            )
-
-            image_container.checkbox_toggled.connect(self.image_selected)
-            image_container.double_click_signal.connect(self.image_double_clicked)
-            self.image_containers.append(image_container)
-
-            # self.layout.setContentsMargins(20, 20, 20, 20)
-            self.layout.addWidget(self.image_containers[-1], i, j)
-
-        self.setLayout(self.layout)
-
     def update_directory(self, directory: str):
         """Updates gallery preview. Used when an object is created
         with unknown or empty directory.
-        Handles clearing previous images, image containers and selected images.
+        Handles clearing previous images and selected images.
 
         Args:
             directory (str): Directory to be previewed.
         """
-        self.image_names = []
-        self.images = []
-        for widget in self.image_containers:
-            self.layout.removeWidget(widget)
-            widget.deleteLater()
-        self.image_containers = []
-        self.update()
+        self.load_errors.clear()
         self.selected_images = []
+        self.folder_watcher.stop()
+        self.model.set_paths([])
 
         self.directory = directory
         if not os.path.exists(self.directory):
             print("Directory does not exist.")
 
         if os.path.exists(self.directory):
-            self.potential_entries = os.listdir(self.directory)
-            if len(self.potential_entries) > 0:
-                with ThreadPool(len(self.potential_entries)) as p:
-                    results = p.map(
-                        func=self.load_files,
-                        iterable=self.potential_entries,
-                    )
-
             self.update_gallery()
 
-    def image_selected(self, selected, id):
+    def tile_clicked(self, index: QModelIndex):
+        """A click on a tile toggles its checkbox."""
+        if not self.model.flags(index) & Qt.ItemFlag.ItemIsEnabled:
+            return
+
+        checked = index.data(Qt.ItemDataRole.CheckStateRole) == Qt.CheckState.Checked
+        self.model.setData(
+            index,
+            Qt.CheckState.Unchecked if checked else Qt.CheckState.Checked,
+            Qt.ItemDataRole.CheckStateRole,
+        )
+
+    def image_selected(self, name: str, selected: bool):
         """Image selected event"""
         if selected:
-            # Add selected ID to list
-            self.selected_images.append(self.image_names[id])
-        else:
-            # Remove selected ID from list
-            self.selected_images.remove(self.image_names[id])
+            # Add selected image to list
+            self.selected_images.append(name)
+        elif name in self.selected_images:
+            # Remove selected image from list
+            self.selected_images.remove(name)
 
         # Show collage button in Gallery Page.
         if not self.standalone:
@@ -150,23 +182,54 @@ class Gallery(QWidget):
 
         self.image_selected_signal.emit(self.selected_images)
 
-    def image_double_clicked(self, id):
+    def image_double_clicked(self, index: QModelIndex):
         """Event raised when double click detected on image."""
-        self.double_click_signal.emit(self.image_names[id])
+        if self.model.flags(index) & Qt.ItemFlag.ItemIsEnabled:
+            self.double_click_signal.emit(self.model.paths[index.row()])
+
+    def image_renamed(self, old_path: str, new_path: str):
+        """Keeps the selection up to date when a selected image is renamed."""
+        if old_path in self.selected_images:
+            self.selected_images[self.selected_images.index(old_path)] = new_path
+            self.image_selected_signal.emit(self.selected_images)
+
+    def apply_diff(self, added: List[str], removed: List[str]):
+        """Applies changes of the directory to the gallery. Tiles of
+        unchanged images are kept as they are, new images are appended
+        and only them will be decoded.
+
+        Args:
+            added (List[str]): Paths of new images, in display order.
+            removed (List[str]): Paths of images which don't exist anymore.
+        """
+        removed = set(removed)
+        new_paths = []
+        for path in added:
+            # A new file with the same size and mtime as a removed one is a rename.
+            old_path = self.model.find_renamed(path)
+            if old_path in removed:
+                removed.discard(old_path)
+                self.model.rename_path(old_path, path)
+            else:
+                new_paths.append(path)
+
+        self.model.remove_paths(list(removed))
+        self.model.append_paths(new_paths)
+
+    def files_changed(self, added: List[str], removed: List[str], modified: List[str]):
+        """Folder watcher callback.
+
+        Args:
+            added (List[str]): Paths of new images.
+            removed (List[str]): Paths of deleted images.
+            modified (List[str]): Paths of images whose content changed.
+        """
+        self.apply_diff(sorted(added, key=natural_sort_key), removed)
+        self.model.refresh_paths(modified)
 
     def sync_diff(self):
-        """Sync directory for new files and update."""
-        for file in os.listdir(self.directory):
-            if os.path.join(self.directory, file) not in self.image_names:
-                try:
-                    img = cv2.imread(
-                        os.path.join(self.directory, file), cv2.IMREAD_COLOR
-                    )
-                    if img is not None:
-                        self.images.append(img)
-                        self.image_names.append(os.path.join(self.directory, file))
-                except Exception as e:
-                    print(e)
-                    pass
-
-        self.update_gallery()
+        """Sync directory for new, deleted and renamed files and update.
+        The folder watcher already does it by itself, this only makes
+        it check now (debounced) for changes we know about.
+        """
+        self.folder_watcher.schedule_scan()
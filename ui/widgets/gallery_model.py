@@ -0,0 +1,444 @@
+"""
+Model and delegate of the virtualized image gallery.
+
+The model only holds the file paths of the folder. Thumbnails are requested
+when the view asks for a row's decoration, which it only does for the tiles
+it paints, and the decoded pixmaps are kept in a bounded LRU.
+"""
+
+import os
+from collections import OrderedDict
+from PySide6.QtCore import (
+    QAbstractListModel,
+    QModelIndex,
+    QRect,
+    QSize,
+    Qt,
+    Signal,
+)
+from PySide6.QtGui import QColor, QImage, QPen, QPixmap
+from PySide6.QtWidgets import (
+    QStyle,
+    QStyledItemDelegate,
+    QStyleOptionButton,
+    QStyleOptionViewItem,
+)
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple, Union
+
+from backend.image_loader_pool import get_image_loader_pool, PRIORITY_VISIBLE
+from backend.preview_loader import IMAGE_EXTENSIONS
+from backend.thumbnail_cache import get_thumbnail_cache
+
+
+class ImageRecord(NamedTuple):
+    """A successfully loaded gallery entry."""
+
+    path: str
+    thumbnail: QImage
+    signature: Optional[Tuple[int, int]]  # See file_signature().
+
+
+class LoadError(NamedTuple):
+    """A gallery entry that couldn't be loaded."""
+
+    path: str
+    reason: str
+
+
+# Returned by load_thumbnail when the tile left the viewport before decoding.
+SKIPPED = object()
+
+
+class GalleryModel(QAbstractListModel):
+    """List model of the images of a directory."""
+
+    paths: List[str]
+    rows: Dict[str, int]  # Path to row.
+    checked: Set[str]
+    failed: Dict[str, str]  # Path to failure reason.
+    pixmaps: "OrderedDict[str, QPixmap]"  # LRU of decoded thumbnails.
+    pending: Set[str]  # Paths being decoded.
+    signatures: Dict[Tuple[int, int], str]  # file_signature() to decoded path.
+    path_signatures: Dict[str, Tuple[int, int]]  # Decoded path to file_signature().
+
+    MAX_PIXMAPS = 512
+    VISIBLE_MARGIN = 8  # Rows around the viewport still worth decoding.
+
+    check_state_changed = Signal(str, bool)
+    path_renamed = Signal(str, str)
+    thumbnail_shown = Signal(str)
+    load_failed = Signal(object)
+    # Emitted from the loader threads: generation, path, load result.
+    thumbnail_loaded = Signal(int, str, object)
+
+    def __init__(self):
+        """Constructor"""
+        super().__init__()
+        self.thumbnail_cache = get_thumbnail_cache()
+        self.image_loader_pool = get_image_loader_pool()
+        self.paths = []
+        self.rows = {}
+        self.checked = set()
+        self.failed = {}
+        self.pixmaps = OrderedDict()
+        self.pending = set()
+        self.signatures = {}
+        self.path_signatures = {}
+        # Incremented when the model is reset, results of older loads are dropped.
+        self.generation = 0
+        self.visible_range = (0, 0)
+        self.thumbnail_loaded.connect(self.on_thumbnail_loaded)
+
+    def set_paths(self, paths: List[str]):
+        """Replaces the content of the model.
+
+        Args:
+            paths (List[str]): Image paths, already sorted.
+        """
+        self.image_loader_pool.cancel_group(self)
+        self.beginResetModel()
+        self.generation += 1
+        self.paths = list(paths)
+        self.rows = {path: row for row, path in enumerate(self.paths)}
+        self.checked = set()
+        self.failed = {}
+        self.pixmaps.clear()
+        self.pending = set()
+        self.signatures = {}
+        self.path_signatures = {}
+        self.endResetModel()
+
+    def append_paths(self, paths: List[str]):
+        """Adds images at the end of the model. Each image costs O(1)
+        and already shown tiles are left untouched.
+
+        Args:
+            paths (List[str]): Image paths not already in the model.
+        """
+        if not paths:
+            return
+
+        first_row = len(self.paths)
+        self.beginInsertRows(QModelIndex(), first_row, first_row + len(paths) - 1)
+        for path in paths:
+            self.rows[path] = len(self.paths)
+            self.paths.append(path)
+        self.endInsertRows()
+
+    def remove_paths(self, paths: List[str]):
+        """Removes images from the model.
+
+        Args:
+            paths (List[str]): Image paths of the model.
+        """
+        removed_rows = sorted(
+            (self.rows[path] for path in paths if path in self.rows), reverse=True
+        )
+        if not removed_rows:
+            return
+
+        for row in removed_rows:
+            path = self.paths[row]
+            self.beginRemoveRows(QModelIndex(), row, row)
+            del self.paths[row]
+            self.endRemoveRows()
+
+            self.forget(path)
+            if path in self.checked:
+                self.checked.discard(path)
+                self.check_state_changed.emit(path, False)
+
+        # Rows after the first removed one moved up.
+        for row in range(removed_rows[-1], len(self.paths)):
+            self.rows[self.paths[row]] = row
+
+    def rename_path(self, old_path: str, new_path: str):
+        """Renames an image, keeping its tile, thumbnail and check state.
+
+        Args:
+            old_path (str): Path in the model.
+            new_path (str): New path, not in the model.
+        """
+        row = self.rows.pop(old_path)
+        self.paths[row] = new_path
+        self.rows[new_path] = row
+
+        if old_path in self.pixmaps:
+            self.pixmaps[new_path] = self.pixmaps.pop(old_path)
+        if old_path in self.path_signatures:
+            signature = self.path_signatures.pop(old_path)
+            self.path_signatures[new_path] = signature
+            self.signatures[signature] = new_path
+        if old_path in self.failed:
+            self.failed[new_path] = self.failed.pop(old_path)
+        if old_path in self.checked:
+            self.checked.discard(old_path)
+            self.checked.add(new_path)
+
+        self.path_renamed.emit(old_path, new_path)
+        index = self.index(row)
+        self.dataChanged.emit(index, index)
+
+    def refresh_paths(self, paths: List[str]):
+        """Reloads the thumbnails of modified images.
+
+        Args:
+            paths (List[str]): Image paths of the model.
+        """
+        for path in paths:
+            row = self.rows.get(path)
+            if row is None:
+                continue
+            self.forget(path)
+            self.rows[path] = row
+            index = self.index(row)
+            self.dataChanged.emit(index, index)
+
+    def find_renamed(self, path: str) -> Optional[str]:
+        """Finds the decoded image which has the same content as path.
+
+        Args:
+            path (str): Path of a new file.
+
+        Returns:
+            Optional[str]: The path of the model it was renamed from, if any.
+        """
+        signature = file_signature(path)
+        if signature is None:
+            return None
+        return self.signatures.get(signature)
+
+    def forget(self, path: str):
+        """Drops everything cached about a path that left the model."""
+        self.rows.pop(path, None)
+        self.pixmaps.pop(path, None)
+        self.failed.pop(path, None)
+        self.pending.discard(path)
+        signature = self.path_signatures.pop(path, None)
+        if self.signatures.get(signature) == path:
+            del self.signatures[signature]
+
+    def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        """Number of images."""
+        return 0 if parent.isValid() else len(self.paths)
+
+    def data(self, index: QModelIndex, role: int = Qt.ItemDataRole.DisplayRole):
+        """Returns the data of a tile. Asking for the decoration of a tile
+        which isn't decoded yet queues its loading.
+        """
+        if not index.isValid():
+            return None
+
+        path = self.paths[index.row()]
+        if role == Qt.ItemDataRole.DecorationRole:
+            pixmap = self.pixmaps.get(path)
+            if pixmap is not None:
+                self.pixmaps.move_to_end(path)
+                return pixmap
+            self.request_thumbnail(path)
+            return None
+        elif role == Qt.ItemDataRole.DisplayRole:
+            if path in self.failed:
+                return "Unreadable image"
+            return "Loading..."
+        elif role == Qt.ItemDataRole.ToolTipRole:
+            return path
+        elif role == Qt.ItemDataRole.CheckStateRole:
+            return (
+                Qt.CheckState.Checked if path in self.checked else Qt.CheckState.Unchecked
+            )
+
+        return None
+
+    def setData(self, index: QModelIndex, value, role: int = Qt.ItemDataRole.EditRole):
+        """Handles tile (un)checking."""
+        if not index.isValid() or role != Qt.ItemDataRole.CheckStateRole:
+            return False
+
+        path = self.paths[index.row()]
+        state = Qt.CheckState(value) == Qt.CheckState.Checked
+        if state == (path in self.checked):
+            return True
+
+        if state:
+            self.checked.add(path)
+        else:
+            self.checked.discard(path)
+        self.dataChanged.emit(index, index, [Qt.ItemDataRole.CheckStateRole])
+        self.check_state_changed.emit(path, state)
+        return True
+
+    def flags(self, index: QModelIndex) -> Qt.ItemFlag:
+        """Tiles of unreadable images are disabled."""
+        if not index.isValid() or self.paths[index.row()] in self.failed:
+            return Qt.ItemFlag.NoItemFlags
+        return Qt.ItemFlag.ItemIsEnabled | Qt.ItemFlag.ItemIsUserCheckable
+
+    def set_visible_range(self, first_row: int, last_row: int):
+        """Updates the rows currently shown by the view.
+        Queued loads of rows far from it are skipped.
+        """
+        self.visible_range = (first_row, last_row)
+
+    def is_row_wanted(self, generation: int, path: str) -> bool:
+        """Checks if a queued tile is still worth decoding.
+        Called from the loader threads.
+        """
+        first_row, last_row = self.visible_range
+        row = self.rows.get(path)
+        return (
+            generation == self.generation
+            and row is not None
+            and first_row - self.VISIBLE_MARGIN <= row <= last_row + self.VISIBLE_MARGIN
+        )
+
+    def request_thumbnail(self, path: str):
+        """Queues the loading of a thumbnail, if not already queued."""
+        if path in self.pending or path in self.failed:
+            return
+
+        self.pending.add(path)
+        self.image_loader_pool.submit(
+            self.load_thumbnail,
+            self.generation,
+            path,
+            priority=PRIORITY_VISIBLE,
+            group=self,
+        )
+
+    def load_thumbnail(self, generation: int, path: str):
+        """Decodes a thumbnail and sends it to the GUI thread.
+        Runs in the image loader pool.
+
+        Args:
+            generation (int): Model generation the path belongs to.
+            path (str): Image path.
+        """
+        if not self.is_row_wanted(generation, path):
+            self.thumbnail_loaded.emit(generation, path, SKIPPED)
+            return
+
+        try:
+            signature = file_signature(path)
+            img = self.thumbnail_cache.get_or_create(path)
+        except Exception as e:
+            self.thumbnail_loaded.emit(generation, path, LoadError(path, str(e)))
+            return
+
+        if img is None:
+            result = LoadError(path, "Unreadable image")
+        else:
+            # QImage (unlike QPixmap) can be built outside of the GUI thread.
+            result = ImageRecord(
+                path,
+                QImage(
+                    img,
+                    img.shape[1],
+                    img.shape[0],
+                    img.shape[1] * 3,
+                    QImage.Format_BGR888,
+                ).copy(),
+                signature,
+            )
+        self.thumbnail_loaded.emit(generation, path, result)
+
+    def on_thumbnail_loaded(
+        self, generation: int, path: str, result: Union[ImageRecord, LoadError, object]
+    ):
+        """Stores a decoded thumbnail and repaints its tile."""
+        if generation != self.generation:
+            return
+
+        self.pending.discard(path)
+        row = self.rows.get(path)
+        if row is None or result is SKIPPED:
+            return
+
+        if isinstance(result, ImageRecord):
+            self.pixmaps[path] = QPixmap.fromImage(result.thumbnail)
+            while len(self.pixmaps) > self.MAX_PIXMAPS:
+                self.pixmaps.popitem(last=False)
+            if result.signature is not None:
+                self.signatures[result.signature] = path
+                self.path_signatures[path] = result.signature
+            self.thumbnail_shown.emit(path)
+        else:
+            self.failed[path] = result.reason
+            self.checked.discard(path)
+            self.load_failed.emit(result)
+
+        index = self.index(row)
+        self.dataChanged.emit(index, index)
+
+
+class GalleryDelegate(QStyledItemDelegate):
+    """Paints gallery tiles: checkbox, thumbnail (or placeholder) and border."""
+
+    TILE_SIZE = QSize(320, 340)
+    MARGIN = 10
+    CHECKBOX_HEIGHT = 20
+
+    def editorEvent(self, event, model, option, index) -> bool:
+        """Checking is handled by the gallery on click, on the whole tile."""
+        return False
+
+    def sizeHint(self, option: QStyleOptionViewItem, index: QModelIndex) -> QSize:
+        """All tiles have the same size."""
+        return self.TILE_SIZE
+
+    def paint(self, painter, option: QStyleOptionViewItem, index: QModelIndex):
+        """Paints a tile."""
+        painter.save()
+        rect = option.rect.adjusted(self.MARGIN, self.MARGIN, -self.MARGIN, -self.MARGIN)
+
+        # Checkbox
+        checkbox = QStyleOptionButton()
+        checkbox.rect = QRect(
+            rect.left(), rect.top(), self.CHECKBOX_HEIGHT, self.CHECKBOX_HEIGHT
+        )
+        checkbox.state = QStyle.StateFlag.State_Enabled
+        if index.data(Qt.ItemDataRole.CheckStateRole) == Qt.CheckState.Checked:
+            checkbox.state |= QStyle.StateFlag.State_On
+        else:
+            checkbox.state |= QStyle.StateFlag.State_Off
+        option.widget.style().drawPrimitive(
+            QStyle.PrimitiveElement.PE_IndicatorCheckBox, checkbox, painter, option.widget
+        )
+
+        # Image frame, highlighted on hover.
+        frame = rect.adjusted(0, self.CHECKBOX_HEIGHT + 4, 0, 0)
+        if option.state & QStyle.StateFlag.State_MouseOver:
+            painter.fillRect(frame, QColor(40, 127, 200, 100))
+        painter.setPen(QPen(QColor("gray"), 1))
+        painter.drawRect(frame)
+
+        pixmap = index.data(Qt.ItemDataRole.DecorationRole)
+        if pixmap is not None:
+            size = pixmap.size().scaled(frame.size() - QSize(2, 2), Qt.KeepAspectRatio)
+            target = QRect(0, 0, size.width(), size.height())
+            target.moveCenter(frame.center())
+            painter.drawPixmap(target, pixmap)
+        else:
+            painter.drawText(
+                frame,
+                Qt.AlignmentFlag.AlignCenter,
+                index.data(Qt.ItemDataRole.DisplayRole),
+            )
+
+        painter.restore()
+
+
+def file_signature(path: str) -> Optional[Tuple[int, int]]:
+    """Returns (size, modification time) of a file, used to recognize
+    renamed files. None if the file can't be accessed.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def is_image_entry(entry: os.DirEntry) -> bool:
+    """Checks if a directory entry should be shown in the gallery."""
+    return entry.name.lower().endswith(IMAGE_EXTENSIONS) and entry.is_file()
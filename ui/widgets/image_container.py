@@ -3,11 +3,10 @@ Custom image container widget
 """
 
 from PySide6.QtCore import Qt, QPoint, QPointF, QRect, QKeyCombination, Signal
-from PySide6.QtWidgets import QLabel, QWidget, QVBoxLayout
+from PySide6.QtWidgets import QWidget, QVBoxLayout
 import cv2
 import numpy as np
 import os
-from threading import Thread
 from PySide6.QtGui import (
     QMouseEvent,
     QPixmap,
@@ -22,9 +21,23 @@ from PySide6.QtGui import (
     QFont,
     QPen,
 )
-from typing import List
-from collections import deque
-from backend.background_removal import remove_background
+from typing import List, Optional
+from backend.background_removal_worker import get_background_removal_worker
+from backend.annotations import Shape
+from backend.edit_pipeline import (
+    ChannelGainsOperation,
+    EditPipeline,
+    FlipOperation,
+    Operation,
+    RemoveBackgroundOperation,
+    RotateOperation,
+    array_to_qimage,
+)
+from backend.image_loader_pool import get_image_loader_pool, PRIORITY_INTERACTIVE
+from backend.tile_pyramid import TilePyramid
+from ui.widgets.drawing_overlay import DrawingOverlay
+from ui.widgets.frame_scheduler import FrameScheduler
+from ui.widgets.tiled_image_view import TiledImageView
 
 
 class ImageContainer(QWidget):
@@ -37,7 +50,11 @@ class ImageContainer(QWidget):
     - Background removal
     """
 
+    pipeline: EditPipeline
+
     background_image_generated = Signal(bool)
+    # Emitted from the image loader pool: operations, full resolution pyramid.
+    full_resolution_rendered = Signal(object, object)
 
     def __init__(self, image_path: str = None):
         """Constructor
@@ -47,26 +64,41 @@ class ImageContainer(QWidget):
         """
         super().__init__()
         layout = QVBoxLayout()
-        self.image_container = QLabel()
-        self.image_container.setStyleSheet("border: 1px solid gray")
-        self.image_container.mousePressEvent = self.mouseReleaseEvent
+        # Zoomable view, only the visible tiles of the image are drawn.
+        self.image_container = TiledImageView()
+        self.image_container.mouseReleaseEvent = self.mouseReleaseEvent
         self.image_container.mousePressEvent = self.mousePressEvent
         self.image_container.mouseMoveEvent = self.mouseMoveEvent
-        self.image_container.setAlignment(Qt.AlignmentFlag.AlignCenter)
         self.image_container.setFocusPolicy(Qt.StrongFocus)
+        self.image_container.view_changed.connect(self.view_changed)
         layout.addWidget(self.image_container)
+        # Shape being drawn, shown over the image.
+        self.overlay = DrawingOverlay(self.image_container)
 
-        self.image_container_current_size = self.image_container.size()
+        # Repaints are coalesced into frames.
+        self.frame_scheduler = FrameScheduler(self, "Image view")
+        self.frame_scheduler.frame_requested.connect(self.paint_frame)
+        self.image_container.frame_painted.connect(self.frame_scheduler.frame_painted)
         self.image_path = image_path
         self.original_image = None
         self.latest_updated_image = None
         self.image_without_background = None
-        self.out_image = QImage()
+        # The background removal was asked for, its mask isn't there yet.
+        self.background_requested = False
         self.last_point = None
-
-        # Undo/Redo stack handling
-        self.pixmap_undo_stack = deque([])
-        self.pixmap_redo_stack = deque([])
+        # Position of the mouse while it pans the view.
+        self.pan_point = None
+
+        # Edits of the image, with undo/redo handling.
+        self.pipeline = None
+        # Operations and proxy image under the channel gains being edited,
+        # and index of the gains operation they replace.
+        self.gains_base_operations = None
+        self.gains_base_image = None
+        self.gains_index = None
+        # Operations whose full resolution pyramid is being rendered.
+        self.full_resolution_operations = None
+        self.full_resolution_rendered.connect(self.show_full_resolution)
 
         # Drawing flags and variables
         self.enable_drawing_line = False
@@ -78,80 +110,201 @@ class ImageContainer(QWidget):
         self.brush_size = 6
         self.first_point = None
         self.last_point = None
-        self.rect = None
         self.current_text = ""
         self.enable_text = False
 
         if os.path.exists(image_path):
-            t = Thread(target=self.remove_background_target, args=[image_path])
-            t.start()
-
-            self.original_image = cv2.imread(image_path, cv2.IMREAD_COLOR)
-            self.latest_updated_image = self.original_image
-            self.out_image = QImage(
-                self.latest_updated_image,
-                self.latest_updated_image.shape[1],
-                self.latest_updated_image.shape[0],
-                self.latest_updated_image.shape[1] * 3,
-                QImage.Format_BGR888,
+            # Goes ahead of the queued gallery thumbnails.
+            self.original_image = (
+                get_image_loader_pool()
+                .submit(
+                    cv2.imread,
+                    image_path,
+                    cv2.IMREAD_COLOR,
+                    priority=PRIORITY_INTERACTIVE,
+                )
+                .result()
             )
-            self.current_pixmap = QPixmap(self.out_image)
-            self.update_undo_stack()
-        else:
-            self.current_pixmap = QPixmap()
+            self.pipeline = EditPipeline(self.original_image)
+            self.set_image(self.pipeline.render())
+
+            # Masks are computed by a separate process, when asked for.
+            worker = get_background_removal_worker()
+            worker.job_finished.connect(self.background_removed)
+            worker.job_failed.connect(self.background_removal_failed)
 
         self.update_image()
         self.setAcceptDrops(True)
         self.setLayout(layout)
 
-    def remove_background_target(self, img_path: str):
-        """Function to be called in a background thread.
+    def background_removed(self, image_path: str, mask: np.ndarray):
+        """Called when the background removal worker computed a mask.
 
         Args:
-            img_path (str): Image file name
+            image_path (str): Image file name
+            mask (np.ndarray): Alpha mask of the foreground.
         """
-        self.image_without_background, self.original_image = remove_background(
-            image_path=img_path
-        )
+        if not self.background_requested or image_path != os.path.abspath(
+            self.image_path
+        ):
+            return
+        self.background_requested = False
+        self.pipeline.set_background_mask(mask)
+        self.apply_operation(RemoveBackgroundOperation())
 
         self.background_image_generated.emit(True)
 
-    def update_image(self, pixmap: QPixmap = None):
-        """Update the image display based on the widget's size.
-        TODO: There's an issue, it redraws for all iterations.
-        This function should only update the view with a given pixmap not just
-        self.current_pixmap.
+    def background_removal_failed(self, image_path: str, error: str):
+        """Called when the background removal worker couldn't compute a mask.
+
+        Args:
+            image_path (str): Image file name
+            error (str): Error message.
+        """
+        if not self.background_requested or image_path != os.path.abspath(
+            self.image_path
+        ):
+            return
+        self.background_requested = False
+        self.background_image_generated.emit(False)
+
+    def cancel_background_removal(self):
+        """Cancels the background removal, e.g. when the image is closed."""
+        if self.background_requested:
+            self.background_requested = False
+            get_background_removal_worker().cancel(self.image_path)
+
+    def set_image(self, image: np.ndarray):
+        """Sets the current image, without updating the display.
+
+        Args:
+            image (np.ndarray): BGR or BGRA image, at the proxy resolution.
+        """
+        self.latest_updated_image = image
+        self.image_container.set_pyramid(
+            TilePyramid(image, self.pipeline.proxy_scale)
+        )
+
+    def render(self):
+        """Shows the current edits of the image."""
+        image = self.pipeline.render()
+        # e.g. only the annotations changed.
+        if image is not self.latest_updated_image:
+            self.set_image(image)
+            self.update_image()
+        self.overlay.set_annotations(self.pipeline.annotations)
+
+    def apply_operation(self, operation: Operation):
+        """Adds an operation to the edits of the image."""
+        self.pipeline.push(operation)
+        self.render()
+
+    def add_annotation(self, shape: Shape):
+        """Adds a shape to the annotations drawn over the image."""
+        self.pipeline.commit(annotations=self.pipeline.annotations + (shape,))
+        self.overlay.set_shape(None)
+        self.render()
+
+    def remove_annotation(self, shape: Shape):
+        """Removes a shape from the annotations drawn over the image."""
+        self.pipeline.commit(
+            annotations=tuple(
+                annotation
+                for annotation in self.pipeline.annotations
+                if annotation is not shape
+            )
+        )
+        self.render()
+
+    def export_image(self) -> QImage:
+        """Renders the edits of the image at full resolution, with the
+        annotations flattened into it, e.g. to save it.
+        """
+        return array_to_qimage(np.ascontiguousarray(self.pipeline.export())).copy()
+
+    def update_image(self, interactive: bool = False):
+        """Schedules the update of the image display.
+        Updates are coalesced: at most one is painted per frame.
+
+        Args:
+            interactive (bool, optional): The update follows user interaction
+                                          (e.g. a slider moving): scale fast,
+                                          until the interaction stops.
+                                          Defaults to False.
+        """
+        self.frame_scheduler.request(interactive)
+
+    def paint_frame(self, high_quality: bool):
+        """Shows the image, at the zoom of the view.
 
         Args:
-            pixmap (QPixmap, optional): Pixmap to assign to the image container.
-                                        If None, assign self.current_pixmap
+            high_quality (bool): Smooth scaling if True, fast scaling otherwise.
+        """
+        view = self.image_container
+        if (
+            high_quality
+            and view.pyramid is not None
+            and view.pyramid.scale < 1
+            and view.zoom > view.pyramid.scale
+            and self.gains_base_operations is None
+        ):
+            # Zoomed in beyond the proxy: show the full resolution details,
+            # once they are rendered.
+            self.request_full_resolution()
+        view.paint_frame(high_quality)
+        self.update_overlay()
+
+    def request_full_resolution(self):
+        """Renders the full resolution pyramid of the current edits in the
+        image loader pool, see show_full_resolution.
         """
-        # if (
-        #     self.out_image.size().width() > self.width()
-        #     or self.out_image.size().height() > self.height()
-        # ):
-        #     self.image_container.setPixmap(
-        #         self.current_pixmap.scaled(
-        #             self.width(),
-        #             self.height(),
-        #             Qt.KeepAspectRatio,
-        #             Qt.SmoothTransformation,
-        #         )
-        #     )
-
-        # else:
-        #     self.image_container.setPixmap(self.current_pixmap)
-        if not pixmap:
-            pixmap = self.current_pixmap
-
-        self.image_container.setPixmap(
-            pixmap.scaled(
-                self.image_container_current_size,
-                Qt.KeepAspectRatio,
-                Qt.SmoothTransformation,
+        operations = self.pipeline.operations
+        if operations == self.full_resolution_operations:
+            # Already being rendered.
+            return
+        self.full_resolution_operations = operations
+        get_image_loader_pool().submit(
+            self.render_full_resolution, operations, priority=PRIORITY_INTERACTIVE
+        )
+
+    def render_full_resolution(self, operations: tuple):
+        """Runs in the image loader pool."""
+        pyramid = None
+        try:
+            pyramid = TilePyramid(
+                self.pipeline.render(proxy=False, operations=operations)
             )
+            # All the levels are built here rather than while painting.
+            pyramid.level_image(pyramid.level_count - 1)
+        finally:
+            self.full_resolution_rendered.emit(operations, pyramid)
+
+    def show_full_resolution(self, operations: tuple, pyramid: Optional[TilePyramid]):
+        """Shows the full resolution pyramid, unless the image was edited
+        while it was rendered.
+        """
+        if operations == self.full_resolution_operations:
+            self.full_resolution_operations = None
+        if (
+            pyramid is None
+            or operations != self.pipeline.operations
+            or self.gains_base_operations is not None
+        ):
+            return
+        self.image_container.set_pyramid(pyramid)
+        self.update_image()
+
+    def update_overlay(self):
+        """Tells the overlay where the image is displayed."""
+        self.overlay.set_image_geometry(
+            self.image_container.image_offset, self.image_container.zoom
         )
 
+    def view_changed(self):
+        """The view was zoomed or panned."""
+        self.update_overlay()
+        self.update_image(interactive=True)
+
     # def resizeEvent(self, event):
     #     """Resize event.
     #     Update the image to fit the new size of the widget.
@@ -159,18 +312,6 @@ class ImageContainer(QWidget):
     #     self.update_image()
     #     super().resizeEvent(event)
 
-    def wheelEvent(self, event):
-        """Mouse wheel event"""
-        self.image_container.setPixmap(
-            self.current_pixmap.scaled(
-                self.width() + event.angleDelta().y(),
-                self.height() + event.angleDelta().y(),
-                Qt.KeepAspectRatio,
-                Qt.SmoothTransformation,
-            )
-        )
-        self.image_container_current_size = self.image_container.size()
-
     # def dragEnterEvent(self, event: QDragEnterEvent) -> None:
     #     """DragEnter event
 
@@ -202,28 +343,66 @@ class ImageContainer(QWidget):
     #     self.reset_original_image()
     #     self.save_no_background_image()
 
-    def apply_channel_gains(self, gains: List[int]):
-        """Apply a list of gains provided in %.
+    def preview_channel_gains(self, gains: List[int]):
+        """Shows channel gains while their slider moves. Only the proxy image
+        under the gains is processed, see apply_channel_gains.
 
         Args:
             gains (List[int]): List of gains to apply (R, G, B) order.
         """
-        gains = np.array([x / 100.0 for x in gains])
-        new_image = cv2.xphoto.applyChannelGains(
-            self.latest_updated_image, gains[2], gains[1], gains[0]
-        )
-        # TODO: needs normalization...
-        # new_image = self.latest_updated_image * gains
-        self.out_image = QImage(
-            new_image,
-            new_image.shape[1],
-            new_image.shape[0],
-            new_image.shape[1] * 3,
-            QImage.Format_BGR888,
+        if self.pipeline is None:
+            return
+        if self.gains_base_operations is None:
+            operations = self.pipeline.operations
+            # Gains aren't cumulative: the new ones replace the previous ones,
+            # wherever they are. They act on each pixel, the other operations
+            # (flips, rotations, alpha) commute with them: they are previewed
+            # over the result of the other operations.
+            self.gains_index = next(
+                (
+                    index
+                    for index in reversed(range(len(operations)))
+                    if isinstance(operations[index], ChannelGainsOperation)
+                ),
+                None,
+            )
+            if self.gains_index is not None:
+                operations = (
+                    operations[: self.gains_index] + operations[self.gains_index + 1 :]
+                )
+            self.gains_base_operations = operations
+            self.gains_base_image = self.pipeline.render(operations=operations)
+
+        self.set_image(
+            ChannelGainsOperation(tuple(gains)).apply(
+                self.gains_base_image, self.pipeline.proxy_scale
+            )
         )
-        self.update_undo_stack()
-        self.current_pixmap = QPixmap(self.out_image)
-        self.update_image()
+        self.update_image(interactive=True)
+
+    def apply_channel_gains(self, gains: List[int]):
+        """Apply a list of gains provided in %, e.g. when their slider is
+        released. It's a single undo step, whatever the number of previews.
+
+        Args:
+            gains (List[int]): List of gains to apply (R, G, B) order.
+        """
+        if self.pipeline is None:
+            return
+        if self.gains_base_operations is None:
+            self.preview_channel_gains(gains)
+
+        operation = ChannelGainsOperation(tuple(gains))
+        if self.gains_index is None:
+            self.pipeline.commit(self.gains_base_operations + (operation,))
+        elif self.pipeline.operations[self.gains_index] != operation:
+            self.pipeline.set_operation(self.gains_index, operation)
+        self.gains_base_operations = None
+        self.gains_base_image = None
+        self.gains_index = None
+        self.render()
+        # Full resolution is computed once per gesture, saving is then instant.
+        self.request_full_resolution()
 
     # def paintEvent(self, event):
     #     painter = QPainter(self)
@@ -235,42 +414,32 @@ class ImageContainer(QWidget):
         if data.keyboardModifiers() == Qt.KeyboardModifier.ControlModifier:
             if data.key() == Qt.Key.Key_Z:
                 self.undo_image_manipulation()
-            # elif data.key() == Qt.Key.Key_Y:
-            # self.redo_image_manipulation()
+            elif data.key() == Qt.Key.Key_Y:
+                self.redo_image_manipulation()
+            return
+
+        if event.key() == Qt.Key.Key_Delete and self.overlay.selected_shape:
+            self.remove_annotation(self.overlay.selected_shape)
             return
 
-        tmp_pixmap = self.current_pixmap.copy()
-        with QPainter(tmp_pixmap) as painter:
-            painter.setPen(QPen(self.pen_color, self.brush_size))
-            if self.first_point:
-                if self.enable_text:
-                    if event.key() == Qt.Key.Key_Backspace:
-                        self.current_text = self.current_text[:-1]
-                    elif event.key() in [Qt.Key.Key_Enter, Qt.Key.Key_Return]:
-                        self.current_text += "\n"
-                    elif event.text():
-                        self.current_text += chr(event.key())
-
-                    serifFont = QFont("Times", self.brush_size * 3, QFont.Bold)
-                    painter.setFont(serifFont)
-                    painter.drawText(self.rect, self.current_text)
-                    painter.drawRect(self.rect)
-                    self.update_image(tmp_pixmap)
+        if self.first_point and self.enable_text:
+            if event.key() == Qt.Key.Key_Backspace:
+                self.current_text = self.current_text[:-1]
+            elif event.key() in [Qt.Key.Key_Enter, Qt.Key.Key_Return]:
+                self.current_text += "\n"
+            elif event.text():
+                self.current_text += chr(event.key())
+            self.preview_drawing()
 
     def undo_image_manipulation(self):
         """Undo latest modification."""
-        if len(self.pixmap_undo_stack) > 0:
-            self.current_pixmap = self.pixmap_undo_stack.pop()
-            self.pixmap_redo_stack.append(self.current_pixmap.copy())
-            self.update_image()
+        if self.pipeline is not None and self.pipeline.undo():
+            self.render()
 
-    # def redo_image_manipulation(self):
-    #     """Redo latest modification."""
-    #     if len(self.pixmap_redo_stack) > 0:
-    #         self.current_pixmap = self.pixmap_redo_stack.pop()
-    #         print(f"Undo: {len(self.pixmap_undo_stack)}, Redo: {len(self.pixmap_redo_stack)}")
-    #         self.update_undo_stack()
-    #         self.update_image()
+    def redo_image_manipulation(self):
+        """Redo latest modification."""
+        if self.pipeline is not None and self.pipeline.redo():
+            self.render()
 
     def is_mouse_inside_pixmap(self, ev: QMouseEvent):
         """Checks if mouse is inside the actual pixmap or not.
@@ -278,310 +447,186 @@ class ImageContainer(QWidget):
         Args:
             ev (QMouseEvent): Event data related to the mouse's position.
         """
-        point = ev.position()
-        left = (
-            self.image_container.width() - self.image_container.pixmap().width()
-        ) // 2
-        top = (
-            self.image_container.height() - self.image_container.pixmap().height()
-        ) // 2
-        if point.x() > left and point.x() < self.image_container.width() - left:
-            if point.y() > top and point.y() < self.image_container.height() - top:
-                return True
-            return False
-        return False
+        return self.image_container.image_rect().contains(ev.position())
+
+    def image_point(self, ev: QMouseEvent) -> QPointF:
+        """Converts the mouse's position to full resolution image coordinates.
+
+        Args:
+            ev (QMouseEvent): Event data related to the mouse's position.
+        """
+        return self.image_container.to_image(ev.position())
+
+    def drawing_shape(self) -> Optional[Shape]:
+        """Shape being drawn, None if there's none."""
+        if not self.first_point or not self.last_point:
+            return None
+
+        x0, y0 = self.first_point.x(), self.first_point.y()
+        x1, y1 = self.last_point.x(), self.last_point.y()
+        if self.enable_text:
+            kind = Shape.TEXT
+        elif self.enable_drawing_rectangle:
+            kind = Shape.RECTANGLE
+        elif self.enable_drawing_circle:
+            kind = Shape.CIRCLE
+        elif self.enable_drawing_horizontal_line:
+            kind, y1 = Shape.LINE, y0
+        elif self.enable_drawing_vertical_line:
+            kind, x1 = Shape.LINE, x0
+        elif self.enable_drawing_line:
+            kind = Shape.LINE
+        else:
+            return None
+
+        return Shape(
+            kind,
+            x0,
+            y0,
+            x1,
+            y1,
+            self.pen_color.name(),
+            self.brush_size,
+            self.current_text,
+        )
+
+    def is_drawing_enabled(self) -> bool:
+        return (
+            self.enable_text
+            or self.enable_drawing_rectangle
+            or self.enable_drawing_circle
+            or self.enable_drawing_horizontal_line
+            or self.enable_drawing_vertical_line
+            or self.enable_drawing_line
+        )
+
+    def preview_drawing(self):
+        """Shows the shape being drawn over the image, at screen resolution.
+        The image itself is never modified by drawings.
+        """
+        self.update_overlay()
+        self.overlay.set_shape(self.drawing_shape())
 
     def mouseMoveEvent(self, ev: QMouseEvent) -> None:
         """Called when the user moves the mouse while it's pressed.
-        TODO: Convert from image_container's coordinates to pixmap's.
 
         Args:
             ev (QMouseEvent): Event data related to the mouse's position.
         """
-        if self.is_mouse_inside_pixmap(ev):
-            pixmap_offset_x = (
-                self.image_container.width() - self.image_container.pixmap().width()
-            ) // 2
-            pixmap_offset_y = (
-                self.image_container.height() - self.image_container.pixmap().height()
-            ) // 2
-            self.last_point = QPointF(
-                ev.position().x() - pixmap_offset_x, ev.position().y() - pixmap_offset_y
-            )
+        if self.pipeline is None:
+            return
 
-        tmp_pixmap = self.current_pixmap.copy()
-        scale_x = tmp_pixmap.width() / self.image_container.pixmap().width()
-        scale_y = tmp_pixmap.height() / self.image_container.pixmap().height()
-
-        self.last_point.setX(self.last_point.x() * scale_x)
-        self.last_point.setY(self.last_point.y() * scale_y)
-
-        with QPainter(tmp_pixmap) as painter:
-            painter.setPen(QPen(self.pen_color, self.brush_size))
-            if self.first_point:
-                if self.enable_drawing_rectangle or self.enable_text:
-                    self.rect = QRect(
-                        min(self.first_point.x(), self.last_point.x()),
-                        min(self.first_point.y(), self.last_point.y()),
-                        abs(self.first_point.x() - self.last_point.x()),
-                        abs(self.first_point.y() - self.last_point.y()),
-                    )
-                    painter.drawRect(self.rect)
-                    self.update_image(tmp_pixmap)
-
-                elif self.enable_drawing_circle:
-                    radius = (self.last_point - self.first_point).manhattanLength() // 2
-                    center = self.first_point + (self.last_point - self.first_point) / 2
-                    painter.drawEllipse(center, radius, radius)
-                    self.update_image(tmp_pixmap)
-
-                elif self.enable_drawing_horizontal_line:
-                    painter.drawLine(
-                        self.first_point.x(),
-                        self.first_point.y(),
-                        self.last_point.x(),
-                        self.first_point.y(),
-                    )
-                    self.update_image(tmp_pixmap)
-
-                elif self.enable_drawing_vertical_line:
-                    painter.drawLine(
-                        self.first_point.x(),
-                        self.first_point.y(),
-                        self.first_point.x(),
-                        self.last_point.y(),
-                    )
-                    self.update_image(tmp_pixmap)
-
-                elif self.enable_drawing_line:
-                    painter.drawLine(
-                        self.first_point.x(),
-                        self.first_point.y(),
-                        self.last_point.x(),
-                        self.last_point.y(),
-                    )
-                    self.update_image(tmp_pixmap)
+        if self.pan_point is not None:
+            self.image_container.pan_by(ev.position() - self.pan_point)
+            self.pan_point = ev.position()
+            return
+
+        if self.is_mouse_inside_pixmap(ev):
+            self.last_point = self.image_point(ev)
+        self.preview_drawing()
 
     def mousePressEvent(self, ev: QMouseEvent) -> None:
         """Called when the user initiates a mouse press/move event.
-        TODO: Convert from image_container's coordinates to pixmap's.
 
         Args:
             ev (QMouseEvent): Event data related to the mouse's position.
         """
+        if self.pipeline is None:
+            return
+
+        # The middle button always pans the view.
+        if ev.button() == Qt.MouseButton.MiddleButton:
+            self.pan_point = ev.position()
+            return
+
+        first_point = None
         if self.is_mouse_inside_pixmap(ev):
-            pixmap_offset_x = (
-                self.image_container.width() - self.image_container.pixmap().width()
-            ) // 2
-            pixmap_offset_y = (
-                self.image_container.height() - self.image_container.pixmap().height()
-            ) // 2
-            self.first_point = QPointF(
-                ev.position().x() - pixmap_offset_x, ev.position().y() - pixmap_offset_y
-            )
-            scale_x = (
-                self.current_pixmap.width() / self.image_container.pixmap().width()
-            )
-            scale_y = (
-                self.current_pixmap.height() / self.image_container.pixmap().height()
-            )
-            self.first_point.setX(self.first_point.x() * scale_x)
-            self.first_point.setY(self.first_point.y() * scale_y)
-        else:
-            self.first_point = None
+            first_point = self.image_point(ev)
 
         # If text edit enabled, write the final version of the text.
-        if self.enable_text:
-            with QPainter(self.current_pixmap) as painter:
-                serifFont = QFont("Times", self.brush_size * 3, QFont.Bold)
-                painter.setFont(serifFont)
-                painter.setPen(QPen(self.pen_color, self.brush_size))
-                if (
-                    self.first_point
-                    and self.current_text is not None
-                    and len(self.current_text) > 0
-                ):
-                    painter.drawText(self.rect, self.current_text)
-                    painter.drawRect(self.rect)
-                    self.update_image()
+        if self.enable_text and first_point and self.current_text:
+            shape = self.drawing_shape()
+            if shape is not None:
+                self.add_annotation(shape)
 
+        self.first_point = first_point
+        self.last_point = None
         self.current_text = ""
+        self.overlay.set_shape(None)
+
+        # Without drawing tool, a click selects an annotation (Delete removes it).
+        selected_shape = None
+        if first_point and not self.is_drawing_enabled():
+            self.update_overlay()
+            selected_shape = self.overlay.layer.shape_at(
+                first_point.x(), first_point.y(), 4 / self.overlay.image_scale
+            )
+        self.overlay.set_selected_shape(selected_shape)
+
+        # Nor drawing tool nor annotation under the mouse: pan the view.
+        if not self.is_drawing_enabled() and selected_shape is None:
+            self.pan_point = ev.position()
 
     def mouseReleaseEvent(self, ev: QMouseEvent) -> None:
         """Called when the user releases the mouse and thus applies
         the last draw shape.
-        TODO: Convert from image_container's coordinates to pixmap's.
 
         Args:
             ev (QMouseEvent): Event data related to the mouse's position.
         """
-        with QPainter(self.current_pixmap) as painter:
-            painter.setPen(QPen(self.pen_color, self.brush_size))
-            if self.first_point:
-                if self.enable_drawing_rectangle or (
-                    self.enable_text and self.current_text != ""
-                ):
-                    self.rect = QRect(
-                        min(self.first_point.x(), self.last_point.x()),
-                        min(self.first_point.y(), self.last_point.y()),
-                        abs(self.first_point.x() - self.last_point.x()),
-                        abs(self.first_point.y() - self.last_point.y()),
-                    )
-                    self.update_undo_stack()
-                    painter.drawRect(self.rect)
-                    self.update_image()
-
-                elif self.enable_drawing_circle:
-                    radius = (self.last_point - self.first_point).manhattanLength() // 2
-                    center = self.first_point + (self.last_point - self.first_point) / 2
-                    self.update_undo_stack()
-                    painter.drawEllipse(center, radius, radius)
-                    self.update_image()
-
-                elif self.enable_drawing_horizontal_line:
-                    self.update_undo_stack()
-                    painter.drawLine(
-                        self.first_point.x(),
-                        self.first_point.y(),
-                        self.last_point.x(),
-                        self.first_point.y(),
-                    )
-                    self.update_image()
-
-                elif self.enable_drawing_vertical_line:
-                    self.update_undo_stack()
-                    painter.drawLine(
-                        self.first_point.x(),
-                        self.first_point.y(),
-                        self.first_point.x(),
-                        self.last_point.y(),
-                    )
-                    self.update_image()
-
-                elif self.enable_drawing_line:
-                    if self.first_point and self.last_point:
-                        self.update_undo_stack()
-                        painter.drawLine(
-                            self.first_point.x(),
-                            self.first_point.y(),
-                            self.last_point.x(),
-                            self.last_point.y(),
-                        )
-                        self.update_image()
-
-        out_image = self.current_pixmap.toImage()
-        out_image = out_image.convertToFormat(QImage.Format_BGR888)
-        ptr = out_image.bits()
-
-        self.latest_updated_image = np.array(ptr).reshape(
-            out_image.height(), out_image.width(), 3
-        )
+        if self.pan_point is not None:
+            self.pan_point = None
+            return
 
-    def update_undo_stack(self):
-        if len(self.pixmap_redo_stack) > 0:
-            self.pixmap_redo_stack.clear()
-        self.pixmap_undo_stack.append(self.current_pixmap.copy())
+        if self.enable_text:
+            # The text is applied once typed, on the next mouse press.
+            return
+
+        shape = self.drawing_shape()
+        if shape is not None:
+            self.add_annotation(shape)
 
     def remove_background(self):
         """
-        Remove background of the image. In fact this will replace the original
-        image with the one without background.
-        TODO:
-        - Handle it more intelligently, by taking the current pixmap and
-        removing the background.
-            - This can be done by creating another function remove_background_pixmap()
-            that will take as input `current_pixmap`.
+        Remove background of the image. The alpha mask computed on the
+        original image follows the flips and rotations done before.
         """
-        if self.image_without_background is None:
-            # TODO: Handle asynchronously
-            print("Not yet generated")
+        if self.pipeline.background_mask is None:
+            # Applied once the worker computed the mask, see background_removed.
+            if not self.background_requested:
+                self.background_requested = True
+                get_background_removal_worker().request(
+                    self.image_path, priority=PRIORITY_INTERACTIVE
+                )
             return
-        out_image = QImage(
-            self.image_without_background,
-            self.image_without_background.shape[1],
-            self.image_without_background.shape[0],
-            self.image_without_background.shape[1] * 4,
-            QImage.Format_RGBA8888,
-        )
-        self.update_undo_stack()
-        self.current_pixmap = QPixmap(out_image)
-        self.update_image()
+        self.apply_operation(RemoveBackgroundOperation())
 
     def reset_original_image(self):
         """
-        Resets original image with background.
+        Restores the background of the image, keeping the other edits.
         """
-        out_image = QImage(
-            self.original_image,
-            self.original_image.shape[1],
-            self.original_image.shape[0],
-            self.original_image.shape[1] * 3,
-            QImage.Format_BGR888,
+        self.cancel_background_removal()
+        operations = tuple(
+            operation
+            for operation in self.pipeline.operations
+            if not isinstance(operation, RemoveBackgroundOperation)
         )
-        self.update_undo_stack()
-        self.current_pixmap = QPixmap(out_image)
-        self.update_image()
+        if operations != self.pipeline.operations:
+            self.pipeline.commit(operations)
+            self.render()
 
     def horizontal_flip(self):
-        """Flip image horizontally.
-        # TODO: Modify latest_updated_image?
-        """
-        self.latest_updated_image = cv2.flip(self.latest_updated_image, 1)
-        out_image = QImage(
-            self.latest_updated_image,
-            self.latest_updated_image.shape[1],
-            self.latest_updated_image.shape[0],
-            self.latest_updated_image.shape[1] * 3,
-            QImage.Format_BGR888,
-        )
-        self.update_undo_stack()
-        self.current_pixmap = QPixmap(out_image)
-        self.update_image()
+        """Flip image horizontally."""
+        self.apply_operation(FlipOperation(1))
 
     def vertical_flip(self):
-        """Flip image vertically.
-        # TODO: Modify latest_updated_image?
-        """
-        self.latest_updated_image = cv2.flip(self.latest_updated_image, 0)
-        out_image = QImage(
-            self.latest_updated_image,
-            self.latest_updated_image.shape[1],
-            self.latest_updated_image.shape[0],
-            self.latest_updated_image.shape[1] * 3,
-            QImage.Format_BGR888,
-        )
-        self.update_undo_stack()
-        self.current_pixmap = QPixmap(out_image)
-        self.update_image()
+        """Flip image vertically."""
+        self.apply_operation(FlipOperation(0))
 
     def rotate_clockwise(self):
         """Rotate image clockwise"""
-        self.latest_updated_image = cv2.rotate(
-            self.latest_updated_image, cv2.ROTATE_90_CLOCKWISE
-        )
-        out_image = QImage(
-            self.latest_updated_image,
-            self.latest_updated_image.shape[1],
-            self.latest_updated_image.shape[0],
-            self.latest_updated_image.shape[1] * 3,
-            QImage.Format_BGR888,
-        )
-        self.update_undo_stack()
-        self.current_pixmap = QPixmap(out_image)
-        self.update_image()
+        self.apply_operation(RotateOperation(cv2.ROTATE_90_CLOCKWISE))
 
     def rotate_counter_clockwise(self):
         """Rotate image counter clockwise"""
-        self.latest_updated_image = cv2.rotate(
-            self.latest_updated_image, cv2.ROTATE_90_COUNTERCLOCKWISE
-        )
-        out_image = QImage(
-            self.latest_updated_image,
-            self.latest_updated_image.shape[1],
-            self.latest_updated_image.shape[0],
-            self.latest_updated_image.shape[1] * 3,
-            QImage.Format_BGR888,
-        )
-        self.update_undo_stack()
-        self.current_pixmap = QPixmap(out_image)
-        self.update_image()
+        self.apply_operation(RotateOperation(cv2.ROTATE_90_COUNTERCLOCKWISE))
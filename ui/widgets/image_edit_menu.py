@@ -42,7 +42,8 @@ class ImageEditMenu(QWidget):
     flip_vertical_signal = Signal(bool)
     rotate_clockwise_signal = Signal(bool)
     rotate_counter_clockwise_signal = Signal(bool)
-    channel_gain_signal = Signal(list)  # R, G, B
+    channel_gain_signal = Signal(list)  # R, G, B, while the slider moves.
+    channel_gain_released_signal = Signal(list)  # R, G, B
     paint_brush_size_signal = Signal(int)
     image_rotation_signal = Signal(int)
 
@@ -171,35 +172,33 @@ class ImageEditMenu(QWidget):
         row_increment += 1
 
         # Channel gain widget.
-        # widget = QWidget()
-        # v_layout = QVBoxLayout()
-
-        # label_channel_gains = QLabel("Edit Channel Gains")
-        # self.grid_layout.addWidget(
-        #     label_channel_gains,
-        #     row_increment,
-        #     1,
-        #     -1,
-        #     -1,
-        #     alignment=Qt.AlignmentFlag.AlignTop,
-        # )
-        # row_increment += 1
+        widget = QWidget()
+        v_layout = QVBoxLayout()
 
-        # widget_r = self.create_slider_widget("Red", 0, 100)
-        # # widget_r.setStyleSheet("border: 1px solid gray;")
-        # v_layout.addWidget(widget_r, alignment=Qt.AlignmentFlag.AlignTop)
+        label_channel_gains = QLabel("Edit Channel Gains")
+        self.grid_layout.addWidget(
+            label_channel_gains,
+            row_increment,
+            1,
+            alignment=Qt.AlignmentFlag.AlignTop,
+        )
+        row_increment += 1
 
-        # widget_g = self.create_slider_widget("Green", 0, 100)
-        # v_layout.addWidget(widget_g, alignment=Qt.AlignmentFlag.AlignTop)
+        widget_r = self.create_slider_widget("Red", 0, 100)
+        # widget_r.setStyleSheet("border: 1px solid gray;")
+        v_layout.addWidget(widget_r, alignment=Qt.AlignmentFlag.AlignTop)
 
-        # widget_b = self.create_slider_widget("Blue", 0, 100)
-        # v_layout.addWidget(widget_b, alignment=Qt.AlignmentFlag.AlignTop)
-        # widget.setLayout(v_layout)
-        # # widget.setStyleSheet("border: 1px solid gray;")
-        # self.grid_layout.addWidget(
-        #     widget, row_increment, 1, 1, -1, alignment=Qt.AlignmentFlag.AlignTop
-        # )
-        # row_increment += 1
+        widget_g = self.create_slider_widget("Green", 0, 100)
+        v_layout.addWidget(widget_g, alignment=Qt.AlignmentFlag.AlignTop)
+
+        widget_b = self.create_slider_widget("Blue", 0, 100)
+        v_layout.addWidget(widget_b, alignment=Qt.AlignmentFlag.AlignTop)
+        widget.setLayout(v_layout)
+        # widget.setStyleSheet("border: 1px solid gray;")
+        self.grid_layout.addWidget(
+            widget, row_increment, 1, alignment=Qt.AlignmentFlag.AlignTop
+        )
+        row_increment += 1
 
         self.setLayout(self.grid_layout)
 
@@ -247,6 +246,9 @@ class ImageEditMenu(QWidget):
         getattr(self, f"{channel_str.lower()}_slider").valueChanged.connect(
             self.slider_value_changed
         )
+        getattr(self, f"{channel_str.lower()}_slider").sliderReleased.connect(
+            self.slider_released
+        )
 
         h_layout.addWidget(getattr(self, f"{channel_str.lower()}_checkbox"), stretch=1)
         h_layout.addWidget(label_channel, stretch=1)
@@ -346,11 +348,22 @@ class ImageEditMenu(QWidget):
         """Remove background signal."""
         self.remove_background_signal.emit(self.remove_background_button.isChecked())
 
-    def slider_value_changed(self):
-        """Channel gain changed event."""
+    def channel_gains(self) -> list:
+        """Values of the channel gain sliders (R, G, B)."""
         names = ["red", "green", "blue"]
-        values = [getattr(self, f"{x}_slider").value() for x in names]
-        self.channel_gain_signal.emit(values)
+        return [getattr(self, f"{x}_slider").value() for x in names]
+
+    def slider_value_changed(self):
+        """Channel gain changed event. While a slider is dragged, the gains
+        are only previewed until it's released."""
+        self.channel_gain_signal.emit(self.channel_gains())
+        # Keyboard and mouse wheel changes are applied right away.
+        if not self.sender().isSliderDown():
+            self.channel_gain_released_signal.emit(self.channel_gains())
+
+    def slider_released(self):
+        """Channel gain slider released event."""
+        self.channel_gain_released_signal.emit(self.channel_gains())
 
     def checkbox_clicked(self):
         """Channel gain checkbox clicked event.
@@ -0,0 +1,235 @@
+"""
+Zoomable and pannable view of an image, drawn from a tile pyramid.
+
+Only the tiles visible in the view are drawn, from the level of the pyramid
+matching the zoom (see backend.tile_pyramid). Tiles are converted to
+pixmaps once and kept in a least recently used cache of bounded size.
+"""
+
+import os
+from collections import OrderedDict
+from PySide6.QtCore import QPointF, QRectF, Qt, Signal
+from PySide6.QtGui import QColor, QPainter, QPaintEvent, QPixmap, QWheelEvent
+from PySide6.QtWidgets import QWidget
+from typing import Optional
+
+from backend.edit_pipeline import array_to_qimage
+from backend.tile_pyramid import TilePyramid
+
+MAX_TILE_CACHE_BYTES = (
+    int(os.environ.get("EPANOUIDENT_TILE_CACHE_MB", 128)) * 1024 * 1024
+)
+
+
+def pixmap_bytes(pixmap: QPixmap) -> int:
+    return pixmap.width() * pixmap.height() * pixmap.depth() // 8
+
+
+class TileCache:
+    """Pixmaps of the tiles, least recently used ones are dropped first."""
+
+    def __init__(self, max_bytes: int = MAX_TILE_CACHE_BYTES):
+        """Constructor
+
+        Args:
+            max_bytes (int, optional): Memory budget of the pixmaps.
+                                       Defaults to MAX_TILE_CACHE_BYTES.
+        """
+        self.max_bytes = max_bytes
+        self.pixmaps = OrderedDict()
+        self.bytes = 0
+
+    def get(self, pyramid: TilePyramid, level: int, column: int, row: int):
+        """Pixmap of a tile and its area in full resolution coordinates,
+        converted from the pyramid if it isn't cached.
+        """
+        key = (pyramid.key, level, column, row)
+        cached = self.pixmaps.get(key)
+        if cached is not None:
+            self.pixmaps.move_to_end(key)
+            return cached
+
+        tile, rect = pyramid.tile(level, column, row)
+        pixmap = QPixmap.fromImage(array_to_qimage(tile))
+        self.pixmaps[key] = pixmap, rect
+        self.bytes += pixmap_bytes(pixmap)
+        while self.bytes > self.max_bytes and len(self.pixmaps) > 1:
+            old_pixmap, _ = self.pixmaps.popitem(last=False)[1]
+            self.bytes -= pixmap_bytes(old_pixmap)
+        return pixmap, rect
+
+    def clear(self):
+        self.pixmaps.clear()
+        self.bytes = 0
+
+
+class TiledImageView(QWidget):
+    """View of an image. The wheel zooms around the mouse, pan_by moves the
+    image. Until the user zooms, the image fits in the view.
+    """
+
+    # The zoom or the position of the image changed.
+    view_changed = Signal()
+    # A frame was painted, e.g. to time it (see FrameScheduler.frame_painted).
+    frame_painted = Signal()
+
+    MAX_ZOOM = 8.0  # Displayed pixels per full resolution pixel.
+    ZOOM_STEP = 1.25  # Per wheel notch.
+
+    pyramid: Optional[TilePyramid]
+    zoom: float  # Displayed pixels per full resolution pixel.
+    image_offset: QPointF  # Position of the image in the view.
+    fitted: bool  # The image follows the size of the view.
+    high_quality: bool  # Smooth scaling of the tiles.
+
+    def __init__(self, parent: QWidget = None):
+        """Constructor
+
+        Args:
+            parent (QWidget, optional): Parent widget. Defaults to None.
+        """
+        super().__init__(parent)
+        self.pyramid = None
+        self.tile_cache = TileCache()
+        self.zoom = 1.0
+        self.image_offset = QPointF()
+        self.fitted = True
+        self.high_quality = True
+        self.setAttribute(Qt.WidgetAttribute.WA_OpaquePaintEvent)
+
+    def set_pyramid(self, pyramid: Optional[TilePyramid]):
+        """Sets the image, keeping the zoom and position if its size didn't
+        change (e.g. an edit, or a more detailed pyramid of the same image).
+        The owner schedules the repaint.
+        """
+        same_size = False
+        if self.pyramid is not None and pyramid is not None:
+            # Up to a pixel of the smallest pyramid, e.g. a proxy.
+            tolerance = 1 / min(self.pyramid.scale, pyramid.scale)
+            same_size = (
+                abs(self.pyramid.width - pyramid.width) <= tolerance
+                and abs(self.pyramid.height - pyramid.height) <= tolerance
+            )
+        if pyramid is not self.pyramid:
+            # The tiles of the previous pyramid won't be drawn anymore.
+            self.tile_cache.clear()
+        self.pyramid = pyramid
+        if self.fitted or not same_size:
+            self.fit()
+
+    def fit_zoom(self) -> float:
+        """Zoom showing the whole image."""
+        if self.pyramid is None:
+            return 1.0
+        return max(
+            1e-3,
+            min(self.width() / self.pyramid.width, self.height() / self.pyramid.height),
+        )
+
+    def fit(self):
+        """Shows the whole image, centered, and follows the size of the view."""
+        self.fitted = True
+        self.set_view(self.fit_zoom(), QPointF())
+
+    def image_rect(self) -> QRectF:
+        """Area of the view showing the image."""
+        if self.pyramid is None:
+            return QRectF()
+        return QRectF(
+            self.image_offset,
+            QPointF(
+                self.image_offset.x() + self.pyramid.width * self.zoom,
+                self.image_offset.y() + self.pyramid.height * self.zoom,
+            ),
+        )
+
+    def to_image(self, point: QPointF) -> QPointF:
+        """Converts a point of the view to full resolution image coordinates."""
+        return (point - self.image_offset) / self.zoom
+
+    def set_view(self, zoom: float, offset: QPointF):
+        """Sets the zoom and the position of the image. The image is centered
+        if it's smaller than the view, else it covers it.
+        """
+        if self.pyramid is not None:
+            width, height = self.pyramid.width * zoom, self.pyramid.height * zoom
+            offset = QPointF(
+                self.clamp_offset(offset.x(), width, self.width()),
+                self.clamp_offset(offset.y(), height, self.height()),
+            )
+        if zoom == self.zoom and offset == self.image_offset:
+            return
+        self.zoom = zoom
+        self.image_offset = offset
+        self.view_changed.emit()
+
+    @staticmethod
+    def clamp_offset(offset: float, image_size: float, view_size: float) -> float:
+        if image_size <= view_size:
+            return (view_size - image_size) / 2
+        return min(0.0, max(view_size - image_size, offset))
+
+    def zoom_at(self, factor: float, position: QPointF):
+        """Zooms, keeping the image point under position in place."""
+        fit_zoom = self.fit_zoom()
+        zoom = min(max(self.zoom * factor, fit_zoom), max(self.MAX_ZOOM, fit_zoom))
+        self.fitted = zoom == fit_zoom
+        anchor = self.to_image(position)
+        self.set_view(zoom, position - anchor * zoom)
+
+    def pan_by(self, delta: QPointF):
+        """Moves the image by delta pixels of the view."""
+        self.set_view(self.zoom, self.image_offset + delta)
+
+    def paint_frame(self, high_quality: bool):
+        """Repaints the view.
+
+        Args:
+            high_quality (bool): Smooth scaling if True, fast scaling otherwise.
+        """
+        self.high_quality = high_quality
+        self.update()
+
+    def wheelEvent(self, event: QWheelEvent):
+        """Zooms around the mouse."""
+        notches = event.angleDelta().y() / 120
+        if notches and self.pyramid is not None:
+            self.zoom_at(self.ZOOM_STEP**notches, event.position())
+        event.accept()
+
+    def resizeEvent(self, event):
+        if self.fitted:
+            self.fit()
+        else:
+            self.set_view(self.zoom, self.image_offset)
+        super().resizeEvent(event)
+
+    def paintEvent(self, event: QPaintEvent):
+        with QPainter(self) as painter:
+            painter.fillRect(event.rect(), self.palette().window())
+            if self.pyramid is not None:
+                painter.setRenderHint(
+                    QPainter.RenderHint.SmoothPixmapTransform, self.high_quality
+                )
+                # Only the tiles in the area to repaint.
+                area = QRectF(
+                    self.to_image(QPointF(event.rect().topLeft())),
+                    self.to_image(QPointF(event.rect().bottomRight()) + QPointF(1, 1)),
+                )
+                level = self.pyramid.level_for(self.zoom)
+                for column, row in self.pyramid.tiles(level, area):
+                    pixmap, rect = self.tile_cache.get(self.pyramid, level, column, row)
+                    # Rounded corners: neighbour tiles share their edges.
+                    top_left = self.image_offset + rect.topLeft() * self.zoom
+                    bottom_right = self.image_offset + rect.bottomRight() * self.zoom
+                    painter.drawPixmap(
+                        QRectF(
+                            QPointF(round(top_left.x()), round(top_left.y())),
+                            QPointF(round(bottom_right.x()), round(bottom_right.y())),
+                        ),
+                        pixmap,
+                        QRectF(pixmap.rect()),
+                    )
+            painter.setPen(QColor("gray"))
+            painter.drawRect(self.rect().adjusted(0, 0, -1, -1))
+        self.frame_painted.emit()